@@ -1,9 +1,40 @@
 from flask import Flask
 
+def _start_upstream_workers():
+    """Background threads that talk to upstream; only the leader runs them with WEB_WORKERS > 1."""
+    from .tokens import manager as token_manager
+    token_manager.start_renewal()
+
+    from .discovery import registry as roku_registry
+    roku_registry.start()
+
+    from .catalog import catalog
+    catalog.start()
+
+    from .status import status_service
+    status_service.start()
+
 def create_app():
     app = Flask(__name__)
 
     from .routes import register_routes
     register_routes(app)
 
-    return app
\ No newline at end of file
+    from .assets import manifest as assets
+    assets.start()
+
+    from .shared import cluster
+    if cluster.enabled:
+        cluster.start(on_lead=_start_upstream_workers)
+    else:
+        _start_upstream_workers()
+
+    from .scheduler import scheduler
+    scheduler.start()
+
+    return app
+
+def create_asgi_app():
+    """ASGI entry point (e.g. ``uvicorn --factory app:create_asgi_app``)."""
+    from .asgi import build_asgi_app
+    return build_asgi_app(create_app())
@@ -0,0 +1,246 @@
+"""ASGI entry point for serving many clients and /events subscribers from one process.
+
+The hot paths (/events, /tv-status and JSON /toggle-mute) are handled on the
+event loop: an open event stream is a parked coroutine, /tv-status is read
+from the in-memory snapshot, and a toggle only updates the state model and
+queues its command, so none of them holds a thread. They run on a pool
+thread instead before any snapshot exists (the first fetch waits on
+upstream) and with WEB_WORKERS > 1, where reads, commands and state changes
+go through the shared SQLite store (app/shared.py). Every other route is
+passed through to the Flask app.
+"""
+import asyncio
+import contextvars
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from . import client, metrics
+from .config import log
+from .events import hub
+from .routes import event_stream_heartbeat, open_event_stream, toggle_mute_all, toggle_payload, tv_status_payload
+from .shared import cluster
+from .status import status_service
+
+
+def _header(scope: dict, name: bytes) -> str:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return ""
+
+async def _send_json(send, payload: dict, status: int = 200) -> None:
+    body = json.dumps(payload).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"cache-control", b"no-store")],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def _in_thread(fn, *args):
+    # run_in_executor doesn't carry contextvars over; copy them for Server-Timing.
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(client.executor, context.run, fn, *args)
+
+def _on_loop() -> bool:
+    """Whether the hot paths can skip the pool: nothing they do blocks."""
+    # Before the first snapshot they wait on upstream; with workers, on SQLite.
+    return status_service.ready and not cluster.enabled
+
+# ---------- Flask pass-through ----------
+
+# Threads serving pass-through Flask requests at once
+_WSGI_THREADS = 16
+
+
+def _environ(scope: dict, body: bytes) -> dict:
+    """The WSGI environ for an ASGI http ``scope``."""
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+        "SERVER_NAME": scope["server"][0] if scope.get("server") else "localhost",
+        "SERVER_PORT": str(scope["server"][1]) if scope.get("server") else "80",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+    for key, value in scope["headers"]:
+        name = key.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_LENGTH", "CONTENT_TYPE"):
+            name = "HTTP_" + name
+        value = value.decode("latin-1")
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+class WsgiApp:
+    """Serve a WSGI app (Flask) from ASGI, each request on a thread of our own pool.
+
+    asgiref's WsgiToAsgi runs every request on one shared "thread-sensitive"
+    thread, which serializes Flask routes and, under concurrent requests,
+    fails with "CurrentThreadExecutor already quit or is broken".
+    """
+
+    def __init__(self, wsgi_app, threads: int = _WSGI_THREADS):
+        self.wsgi_app = wsgi_app
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope, receive, send) -> None:
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        await loop.run_in_executor(self._executor, context.run, self._run, scope, bytes(body), loop, send)
+
+    def _run(self, scope: dict, body: bytes, loop, send) -> None:
+        """Call the WSGI app and pass its response back to the event loop, chunk by chunk."""
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get("sent"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["start"] = {
+                "type": "http.response.start",
+                "status": int(status.split(" ", 1)[0]),
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+            }
+
+        def start():
+            if not response.get("sent"):
+                response["sent"] = True
+                emit(response["start"])
+
+        output = self.wsgi_app(_environ(scope, body), start_response)
+        try:
+            for chunk in output:
+                if chunk:
+                    start()
+                    emit({"type": "http.response.body", "body": chunk, "more_body": True})
+            start()
+            emit({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(output, "close"):
+                output.close()
+
+# ---------- Async routes ----------
+
+async def tv_status(scope, receive, send) -> None:
+    refresh = parse_qs(scope["query_string"].decode()).get("refresh", ["1"])[0] == "1"
+    if _on_loop():
+        payload = tv_status_payload(refresh)
+    else:
+        payload = await _in_thread(tv_status_payload, refresh)
+    await _send_json(send, payload)
+
+async def toggle_mute(scope, receive, send) -> None:
+    log("Web request received to toggle mute")
+    # Only queues commands, so it's fine on the loop once a snapshot exists.
+    if _on_loop():
+        ok, results = toggle_mute_all()
+    else:
+        ok, results = await _in_thread(toggle_mute_all)
+    body, status = toggle_payload(ok, results)
+    await _send_json(send, body, status)
+
+async def events(scope, receive, send) -> None:
+    if _on_loop():
+        open_event_stream()
+    else:
+        await _in_thread(open_event_stream)
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+        ],
+    })
+
+    async def pump():
+        stream = hub.stream_async(_header(scope, b"last-event-id") or None, event_stream_heartbeat)
+        async for frame in stream:
+            await send({"type": "http.response.body", "body": frame.encode(), "more_body": True})
+
+    async def disconnected():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    pumping = asyncio.ensure_future(pump())
+    watching = asyncio.ensure_future(disconnected())
+    await asyncio.wait({pumping, watching}, return_when=asyncio.FIRST_COMPLETED)
+    watching.cancel()
+    if not pumping.done():
+        pumping.cancel()
+        return
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+ROUTES = {
+    ("GET", "/tv-status"): tv_status,
+    ("GET", "/events"): events,
+    ("POST", "/toggle-mute"): toggle_mute,
+}
+
+# ---------- Application ----------
+
+async def _timed(handler, scope, receive, send) -> None:
+    """Run a native route with the same Server-Timing header and metrics as Flask's."""
+    started = time.perf_counter()
+    metrics.start_timing()
+
+    async def timed_send(message):
+        if message["type"] == "http.response.start":
+            elapsed = time.perf_counter() - started
+            timing = metrics.stop_timing(elapsed)
+            message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", timing.encode())])
+            metrics.observe_request(scope["path"], scope["method"], message["status"], elapsed)
+        await send(message)
+
+    await handler(scope, receive, timed_send)
+
+def build_asgi_app(flask_app):
+    """Wrap ``flask_app`` so the routes in ``ROUTES`` run natively on the event loop."""
+    wsgi = WsgiApp(flask_app)
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        handler = ROUTES.get((scope.get("method"), scope.get("path")))
+        # HTML form posts to /toggle-mute still get Flask's redirect/error page.
+        if handler is toggle_mute and "application/json" not in _header(scope, b"accept"):
+            handler = None
+        if scope["type"] == "http" and handler is not None:
+            await _timed(handler, scope, receive, send)
+            return
+        await wsgi(scope, receive, send)
+
+    return app
@@ -0,0 +1,128 @@
+"""Content-hashed static assets with precompressed variants.
+
+At startup every file under ``app/static`` is read once and given a URL with
+its content hash in the name (``/assets/css/style.3f9a1c2b7d.css``). Those URLs
+never change meaning, so they are served with a one-year ``immutable`` cache
+header; editing a file gives it a new URL. Text assets are gzip- and (when the
+``brotli`` module is installed) brotli-compressed once, in a background thread
+at startup, and each request gets the smallest variant its ``Accept-Encoding``
+allows.
+
+``/static/...`` references inside text assets (e.g. icons in the web app
+manifest) are rewritten to their hashed URLs before hashing.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from .config import log
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+URL_PREFIX = "/assets/"
+# Worth compressing; images like PNG are already compressed.
+_COMPRESSIBLE = ("text/", "application/javascript", "application/json", "application/manifest+json",
+                 "image/svg+xml", "image/x-icon", "image/vnd.microsoft.icon")
+_STATIC_REF = re.compile(r"/static/([\w./-]+)")
+
+mimetypes.add_type("application/manifest+json", ".webmanifest")
+
+
+class Asset:
+    def __init__(self, path: str, body: bytes):
+        self.path = path
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        digest = hashlib.sha256(body).hexdigest()
+        self.etag = digest[:16]
+        stem, ext = os.path.splitext(path)
+        self.hashed = f"{stem}.{digest[:10]}{ext}"
+        self.variants = {"identity": body}
+
+    @property
+    def compressible(self) -> bool:
+        return self.mimetype.startswith(_COMPRESSIBLE)
+
+    def compress(self) -> None:
+        body = self.variants["identity"]
+        compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body, quality=11)
+        # Keep a variant only if it actually saves something; swap the dict in
+        # whole so concurrent requests never see it half-built.
+        self.variants = dict(self.variants, **{
+            encoding: data for encoding, data in compressed.items() if len(data) < len(body) * 0.9
+        })
+
+    def negotiate(self, accepts) -> tuple:
+        """(encoding, body) for the smallest variant allowed by ``accepts(encoding)``."""
+        allowed = [(len(data), encoding) for encoding, data in self.variants.items()
+                   if encoding == "identity" or accepts(encoding)]
+        _, encoding = min(allowed)
+        return encoding, self.variants[encoding]
+
+
+class AssetManifest:
+    def __init__(self, root: str = STATIC_DIR):
+        self.root = root
+        self.by_path = {}
+        self.by_hashed = {}
+        self.build()
+
+    def _files(self) -> list:
+        found = []
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                found.append(os.path.relpath(os.path.join(folder, name), self.root).replace(os.sep, "/"))
+        return sorted(found)
+
+    def build(self) -> None:
+        """Hash everything under ``root``; referenced files first."""
+        files = self._files()
+        texts = [path for path in files if (mimetypes.guess_type(path)[0] or "").startswith(_COMPRESSIBLE)]
+        for path in [p for p in files if p not in texts] + texts:
+            with open(os.path.join(self.root, path), "rb") as f:
+                body = f.read()
+            if path in texts and path.endswith((".css", ".webmanifest", ".js", ".json")):
+                body = _STATIC_REF.sub(lambda m: self.url(m.group(1)), body.decode()).encode()
+            asset = Asset(path, body)
+            self.by_path[path] = asset
+            self.by_hashed[asset.hashed] = asset
+
+    def precompress(self) -> None:
+        """Build the gzip/brotli variants (slow at brotli's top quality, so off the startup path)."""
+        started = time.perf_counter()
+        for asset in self.by_path.values():
+            if asset.compressible:
+                asset.compress()
+        log(f"Compressed {len(self.by_path)} static asset(s) in {(time.perf_counter() - started) * 1000:.0f} ms"
+            + ("" if brotli is not None else " (brotli not installed; gzip only)"))
+
+    def start(self) -> None:
+        threading.Thread(target=self.precompress, name="asset-compress", daemon=True).start()
+
+    def url(self, path: str) -> str:
+        """Hashed URL for ``path`` relative to app/static; unknown files fall back to /static/."""
+        asset = self.by_path.get(path)
+        return URL_PREFIX + asset.hashed if asset else f"/static/{path}"
+
+    def get(self, hashed: str):
+        return self.by_hashed.get(hashed)
+
+    @property
+    def version(self) -> str:
+        """Changes whenever any asset does (names the service worker cache)."""
+        return hashlib.sha256("".join(sorted(self.by_hashed)).encode()).hexdigest()[:12]
+
+    def urls(self) -> list:
+        return [URL_PREFIX + asset.hashed for asset in self.by_path.values()]
+
+
+manifest = AssetManifest()
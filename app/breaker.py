@@ -0,0 +1,139 @@
+"""Per-device circuit breakers with jittered exponential backoff.
+
+Each SmartThings device and each Roku gets a breaker. After
+``BREAKER_THRESHOLD`` offline (409/503) or timeout results in a row it opens:
+background reads fail fast from memory instead of waiting on a TV that is
+off, and user commands get a single attempt with no retry waits. Once the
+open period passes, one caller is let through as a half-open probe; success
+closes the breaker, failure re-opens it for twice as long (up to
+``BREAKER_MAX_DELAY``), with jitter so several devices don't probe in step.
+Callers ``settle()`` every call they let through, so a probe answered with
+neither (say a 401 or a 500) also counts as failed instead of leaving the
+breaker half-open.
+"""
+import random
+import threading
+import time
+
+from .config import BREAKER_BASE_DELAY, BREAKER_MAX_DELAY, BREAKER_THRESHOLD, log
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# A half-open probe that hasn't reported back after this long is presumed lost.
+_PROBE_TIMEOUT = 30
+
+
+def backoff(attempt: int, base: float, cap: float = BREAKER_MAX_DELAY) -> float:
+    """Delay before retry ``attempt`` (1-based): exponential with "equal jitter"."""
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, threshold: int = BREAKER_THRESHOLD,
+                 base_delay: float = BREAKER_BASE_DELAY, max_delay: float = BREAKER_MAX_DELAY):
+        self.name = name
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.retry_at = 0.0
+        self.fast_fails = 0
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """True if a call should go upstream (closed, or this caller is the half-open probe)."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and now >= self.retry_at:
+                self.state = HALF_OPEN
+                self._probe_started = now
+                log(f"Circuit {self.name}: half-open, probing")
+                return True
+            if self.state == HALF_OPEN and now - self._probe_started > _PROBE_TIMEOUT:
+                self._probe_started = now
+                return True
+            self.fast_fails += 1
+            return False
+
+    @property
+    def closed(self) -> bool:
+        return self.state == CLOSED
+
+    def success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                log(f"Circuit {self.name}: closed after {self.failures} failure(s)")
+            self.state = CLOSED
+            self.failures = 0
+            self.opens = 0
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                self.opens += 1
+                delay = backoff(self.opens, self.base_delay * 2, self.max_delay)
+                self.state = OPEN
+                self.retry_at = time.monotonic() + delay
+                log(f"Circuit {self.name}: open for {delay:.0f}s after {self.failures} failure(s)")
+
+    def settle(self) -> None:
+        """End a call that reported neither ``success()`` nor ``failure()`` (a 401, a 500, …).
+
+        A half-open probe left unresolved would fail every other call fast until
+        ``_PROBE_TIMEOUT``, so an inconclusive probe counts as a failed one. No-op
+        when the breaker isn't half-open.
+        """
+        with self._lock:
+            probing = self.state == HALF_OPEN
+        if probing:
+            self.failure()
+
+    def probe_soon(self) -> None:
+        """Something suggests the device is back (e.g. a power-on event); probe on next use."""
+        with self._lock:
+            if self.state == OPEN:
+                self.retry_at = time.monotonic()
+
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "retry_in": max(0.0, round(self.retry_at - time.monotonic(), 1)) if self.state == OPEN else 0.0,
+            "fast_fails": self.fast_fails,
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name: str) -> CircuitBreaker:
+    """The breaker for device ``name`` (e.g. ``smartthings/<id>``, ``roku/<host:port>``)."""
+    with _breakers_lock:
+        found = _breakers.get(name)
+        if found is None:
+            found = _breakers[name] = CircuitBreaker(name)
+        return found
+
+def smartthings_breaker(device_id: str) -> CircuitBreaker:
+    return breaker(f"smartthings/{device_id}")
+
+def roku_breaker(base_url: str) -> CircuitBreaker:
+    return breaker(f"roku/{base_url.split('//', 1)[-1]}")
+
+def states() -> dict:
+    with _breakers_lock:
+        return {name: b.to_dict() for name, b in _breakers.items()}
+
+def open_count() -> int:
+    with _breakers_lock:
+        return sum(not b.closed for b in _breakers.values())
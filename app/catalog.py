@@ -0,0 +1,187 @@
+"""Cached catalog of the channels installed on the Roku, with a name/id index.
+
+``/query/apps`` is fetched once and parsed incrementally as it streams in.
+The result is kept in memory and in ``CATALOG_FILE`` (per Roku address), so
+a restart can launch by name without fetching the catalog first. Entries
+older than ``CATALOG_TTL`` are still served but revalidated in the
+background; a lookup that misses triggers a rate-limited refetch in case a
+channel was just installed. Channels missing from a fresh catalog are
+evicted, as are saved catalogs of Rokus not seen for ``_FORGET_AFTER``.
+"""
+import difflib
+import json
+import os
+import re
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+from . import client
+from .config import CATALOG_FILE, CATALOG_TTL, log
+from .discovery import registry as roku_registry
+
+# Refetch at most this often on lookup misses (seconds)
+_MISS_REFETCH = 60
+# Drop saved catalogs of Rokus we haven't fetched from in this long
+_FORGET_AFTER = 30 * 86400
+
+
+def normalize(name: str) -> str:
+    """Lower-case alphanumerics only: "CNN Go!" -> "cnngo"."""
+    return re.sub(r"[^0-9a-z]", "", name.lower())
+
+def parse_apps(chunks) -> dict:
+    """Parse /query/apps XML from an iterable of byte chunks into {id: {name, type, version}}."""
+    parser = ET.XMLPullParser(events=("end",))
+    apps = {}
+
+    def drain():
+        for _, element in parser.read_events():
+            if element.tag == "app" and element.get("id"):
+                apps[element.get("id")] = {
+                    "name": (element.text or "").strip(),
+                    "type": element.get("type", ""),
+                    "version": element.get("version", ""),
+                }
+                element.clear()
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        drain()
+    parser.close()
+    drain()
+    return apps
+
+
+class AppCatalog:
+    def __init__(self, path: str = CATALOG_FILE, ttl: float = CATALOG_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._fetching = {}
+        self._last_miss_fetch = {}
+        self._data = self._load()
+        # Per Roku: normalized name -> app id
+        self._names = {roku: self._index(entry["apps"]) for roku, entry in self._data.items()}
+
+    # ---------- Persistence ----------
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        cutoff = time.time() - _FORGET_AFTER
+        return {roku: entry for roku, entry in data.items() if entry.get("fetched_at", 0) > cutoff}
+
+    def _save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._data, f)
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def _index(apps: dict) -> dict:
+        return {normalize(app["name"]): app_id for app_id, app in apps.items()}
+
+    # ---------- Fetching ----------
+
+    def refresh(self, base_url: str = None) -> bool:
+        """Fetch the catalog from the Roku now; True if it was updated.
+
+        A caller arriving while a fetch is running waits for that fetch instead.
+        """
+        roku = base_url or roku_registry.base_url()
+        with self._lock:
+            running = self._fetching.get(roku)
+            if running is None:
+                done = self._fetching[roku] = threading.Event()
+        if running is not None:
+            running.wait(10)
+            return roku in self._data
+        try:
+            started = time.perf_counter()
+            with client.roku.get(f"{roku}/query/apps", timeout=5, op="apps", stream=True) as resp:
+                resp.raise_for_status()
+                apps = parse_apps(resp.iter_content(4096))
+            with self._lock:
+                previous = self._data.get(roku, {}).get("apps", {})
+                evicted = len(set(previous) - set(apps))
+                self._data[roku] = {"fetched_at": time.time(), "apps": apps}
+                self._names[roku] = self._index(apps)
+                self._save()
+            log(f"Roku catalog: {len(apps)} app(s) in {(time.perf_counter() - started) * 1000:.0f} ms"
+                + (f", {evicted} evicted" if evicted else ""))
+            return True
+        except Exception as e:
+            log(f"Failed to fetch Roku app catalog: {e}")
+            return False
+        finally:
+            with self._lock:
+                del self._fetching[roku]
+            done.set()
+
+    def _refresh_in_background(self, roku: str) -> None:
+        threading.Thread(target=self.refresh, args=(roku,), name="roku-catalog", daemon=True).start()
+
+    def _entry(self, roku: str):
+        """The cached catalog for ``roku``, fetching it if absent and revalidating if stale."""
+        entry = self._data.get(roku)
+        if entry is None:
+            self.refresh(roku)
+            return self._data.get(roku)
+        if time.time() - entry["fetched_at"] > self.ttl:
+            self._refresh_in_background(roku)
+        return entry
+
+    # ---------- Lookups ----------
+
+    def apps(self, base_url: str = None) -> dict:
+        entry = self._entry(base_url or roku_registry.base_url())
+        return dict(entry["apps"]) if entry else {}
+
+    def _match(self, roku: str, query: str):
+        entry = self._data.get(roku)
+        if entry is None:
+            return None
+        apps = entry["apps"]
+        if query in apps:
+            return query
+        names = self._names.get(roku, {})
+        wanted = normalize(query)
+        if not wanted:
+            return None
+        if wanted in names:
+            return names[wanted]
+        # Prefix, then substring; the shortest (closest) name wins.
+        for test in (str.startswith, str.__contains__):
+            hits = [name for name in names if test(name, wanted)]
+            if hits:
+                return names[min(hits, key=len)]
+        close = difflib.get_close_matches(wanted, names, n=1, cutoff=0.6)
+        return names[close[0]] if close else None
+
+    def lookup(self, query: str, base_url: str = None):
+        """Find an installed app by id or (fuzzy) name; returns {'id', 'name', ...} or None."""
+        roku = base_url or roku_registry.base_url()
+        self._entry(roku)
+        app_id = self._match(roku, query)
+        if app_id is None and time.monotonic() - self._last_miss_fetch.get(roku, -_MISS_REFETCH) >= _MISS_REFETCH:
+            # Maybe it was installed since the last fetch.
+            self._last_miss_fetch[roku] = time.monotonic()
+            if self.refresh(roku):
+                app_id = self._match(roku, query)
+        if app_id is None:
+            return None
+        return dict(self._data[roku]["apps"][app_id], id=app_id)
+
+    def start(self) -> None:
+        """Fetch the catalog in the background at startup unless a fresh copy was saved."""
+        roku = roku_registry.base_url()
+        entry = self._data.get(roku)
+        if entry is None or time.time() - entry["fetched_at"] > self.ttl:
+            self._refresh_in_background(roku)
+
+
+catalog = AppCatalog()
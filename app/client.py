@@ -0,0 +1,84 @@
+"""Shared keep-alive HTTP clients for the SmartThings cloud and the Roku ECP port.
+
+Each upstream gets one ``requests.Session`` with its own connection pool, so
+repeated calls reuse TCP (and, for SmartThings, TLS) connections instead of
+opening a new one per request.
+"""
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+from .config import (
+    ROKU_CONNECT_TIMEOUT,
+    ROKU_POOL_SIZE,
+    SMARTTHINGS_CONNECT_TIMEOUT,
+    SMARTTHINGS_POOL_SIZE,
+    UPSTREAM_WORKERS,
+    log,
+)
+
+
+class UpstreamClient:
+    """A pooled session for one upstream with a fixed connect timeout."""
+
+    def __init__(self, name: str, pool_size: int, connect_timeout: float, hosts: int = 1):
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method: str, url: str, timeout: float, op: str = "other", **kwargs) -> requests.Response:
+        """Send one request; its latency and outcome are recorded under ``op``."""
+        started = time.perf_counter()
+        code = "error"
+        try:
+            resp = self.session.request(method, url, timeout=(self.connect_timeout, timeout), **kwargs)
+            code = resp.status_code
+            return resp
+        finally:
+            metrics.observe_upstream(self.name, op, time.perf_counter() - started, code)
+
+    def get(self, url: str, timeout: float, **kwargs) -> requests.Response:
+        return self.request("GET", url, timeout, **kwargs)
+
+    def post(self, url: str, timeout: float, **kwargs) -> requests.Response:
+        return self.request("POST", url, timeout, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+# TLS to api.smartthings.com
+smartthings = UpstreamClient("smartthings", SMARTTHINGS_POOL_SIZE, SMARTTHINGS_CONNECT_TIMEOUT)
+# Plain HTTP to the Roku's ECP port; a small pool per TV on the LAN.
+roku = UpstreamClient("roku", ROKU_POOL_SIZE, ROKU_CONNECT_TIMEOUT, hosts=4)
+
+# Bounded pool reused for running independent upstream calls side by side.
+executor = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix="upstream")
+
+
+def fan_out(calls: dict, deadline: float):
+    """Run ``{name: callable}`` concurrently, waiting at most ``deadline`` seconds.
+
+    Returns ``(results, pending)``: results for calls that finished in time and
+    the still-running futures for the rest. Calls that raised are left out of
+    both.
+    """
+    # Copy the caller's context so upstream time still lands in its Server-Timing.
+    futures = {name: executor.submit(contextvars.copy_context().run, fn) for name, fn in calls.items()}
+    wait(futures.values(), timeout=deadline)
+    results, pending = {}, {}
+    for name, future in futures.items():
+        if not future.done():
+            pending[name] = future
+        elif future.exception() is not None:
+            log(f"Upstream call {name} failed: {future.exception()}")
+        else:
+            results[name] = future.result()
+    return results, pending
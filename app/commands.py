@@ -0,0 +1,188 @@
+"""Per-device SmartThings command queue with batching and tap coalescing.
+
+Commands for one TV submitted within ``COMMAND_BATCH_WINDOW`` seconds of the
+first go out together in a single /commands request. Before sending, the
+batch is reduced to its net effect: mute toggles cancel in pairs (an even
+number of taps sends nothing), a later mute/unmute or switch on/off replaces
+an earlier one, and repeated refreshes become one. Other commands are sent
+as submitted, in order.
+
+Every caller gets a Future for its own outcome, ``{"ok", "command",
+"coalesced"}``: the command actually sent on its behalf (None if it cancelled
+out) and how many requests shared it. A toggle needs the current mute state;
+the value this queue last sent is trusted for ``_TRUST_SENT`` seconds, since
+SmartThings status lags behind commands, and otherwise the device is asked
+once per batch unless the state model (app/state.py) has a recent reading.
+Batches for one TV are sent one at a time.
+
+Under the multi-worker server, followers forward every command to the
+leader (see app/shared.py), so taps from all workers share one queue per TV
+and one idea of what was last sent.
+"""
+import threading
+import time
+from concurrent.futures import Future
+
+from . import metrics
+from .config import COMMAND_BATCH_WINDOW, SMARTTHINGS_TV_DEVICE_ID, STATUS_STALE_AFTER, log
+from .devices import command_entry, get_mute_state, send_smartthings_commands
+from .shared import cluster
+from .state import model
+
+TOGGLE = "toggle"
+# Capabilities whose commands set a state, so only the last one in a batch matters
+_LAST_WINS = ("audioMute", "switch", "refresh")
+# Seconds for which the mute value we last sent beats asking the device
+_TRUST_SENT = 10
+# Seconds a follower waits for the leader to send a forwarded command (retries included)
+_FORWARD_TIMEOUT = 60
+
+commands_total = metrics.Counter(
+    "smartthings_commands_total", "Commands requested, by outcome (sent, coalesced, cancelled).", ("outcome",))
+batches_total = metrics.Counter(
+    "smartthings_command_batches_total", "/commands requests sent by the command queue.")
+metrics.register(commands_total)
+metrics.register(batches_total)
+
+
+class DeviceQueue:
+    def __init__(self, device_id: str, window: float = COMMAND_BATCH_WINDOW):
+        self.device_id = device_id
+        self.window = window
+        self._pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._sent_mute = None  # (value, monotonic time)
+
+    def submit(self, capability: str, command: str, arguments: list = None) -> Future:
+        """Queue a command for the next batch; ``command`` may be ``TOGGLE`` for audioMute."""
+        future = Future()
+        with self._lock:
+            self._pending.append((capability, command, arguments, future))
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+        return future
+
+    def _flush(self) -> None:
+        # Holding the send lock keeps batches in order; taps arriving meanwhile
+        # pile up for the next one.
+        with self._send_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._timer = None
+            try:
+                self._send(batch)
+            except Exception as e:
+                log(f"SmartThings command batch for {self.device_id} failed: {e}")
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_result({"ok": False, "command": None, "error": str(e)})
+
+    @staticmethod
+    def _collapse(batch: list) -> list:
+        """Group ``batch`` into slots, one per command to send (before toggles are resolved)."""
+        slots = {}
+        ordered = []
+        for capability, command, arguments, future in batch:
+            key = capability if capability in _LAST_WINS else object()
+            slot = slots.get(key)
+            if slot is None:
+                slot = slots[key] = {"capability": capability, "command": None, "arguments": arguments,
+                                     "flips": 0, "futures": []}
+                ordered.append(slot)
+            slot["futures"].append(future)
+            if command == TOGGLE:
+                slot["flips"] += 1
+            else:
+                slot.update(command=command, arguments=arguments, flips=0)
+        return ordered
+
+    def _mute_state(self):
+        sent = self._sent_mute
+        confirmed = model.confirmed_mute(self.device_id, STATUS_STALE_AFTER)
+        # A reading from after our last command settled beats what we sent;
+        # one from before may not reflect the command yet.
+        if sent is not None and time.monotonic() - sent[1] < _TRUST_SENT \
+                and (confirmed is None or confirmed[1] < sent[1] + model.settle):
+            return "muted" if sent[0] == "mute" else "unmuted"
+        if confirmed is not None:
+            return confirmed[0]
+        try:
+            return get_mute_state(self.device_id)
+        except Exception as e:
+            log(f"Error reading mute state: {e}")
+            return None
+
+    def _send(self, batch: list) -> None:
+        to_send = []
+        for slot in self._collapse(batch):
+            if slot["flips"]:
+                if slot["command"] is not None:
+                    if slot["flips"] % 2:
+                        slot["command"] = "unmute" if slot["command"] == "mute" else "mute"
+                elif slot["flips"] % 2 == 0:
+                    self._resolve(slot, True, "cancelled")
+                    continue
+                else:
+                    # Mute unless it's known to be muted, as the plain toggle does.
+                    slot["command"] = "unmute" if self._mute_state() == "muted" else "mute"
+            to_send.append(slot)
+        if not to_send:
+            log(f"SmartThings commands for {self.device_id} cancelled out ({len(batch)} request(s))")
+            return
+        entries = [command_entry(slot["capability"], slot["command"], slot["arguments"]) for slot in to_send]
+        batches_total.inc()
+        flags = send_smartthings_commands(entries, device_id=self.device_id)
+        for slot, ok in zip(to_send, flags):
+            if ok and slot["capability"] == "audioMute":
+                self._sent_mute = (slot["command"], time.monotonic())
+            self._resolve(slot, ok, "sent")
+
+    @staticmethod
+    def _resolve(slot: dict, ok: bool, outcome: str) -> None:
+        futures = slot["futures"]
+        if outcome == "sent":
+            commands_total.inc("sent")
+            commands_total.inc("coalesced", amount=len(futures) - 1)
+        else:
+            commands_total.inc(outcome, amount=len(futures))
+        command = slot["command"] if outcome == "sent" else None
+        for future in futures:
+            future.set_result({"ok": ok, "command": command, "coalesced": len(futures)})
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def device_queue(device_id: str = None) -> DeviceQueue:
+    device_id = device_id or SMARTTHINGS_TV_DEVICE_ID
+    with _queues_lock:
+        found = _queues.get(device_id)
+        if found is None:
+            found = _queues[device_id] = DeviceQueue(device_id)
+        return found
+
+def submit(capability: str, command: str, arguments: list = None, device_id: str = None) -> Future:
+    if cluster.following:
+        payload = {"capability": capability, "command": command, "arguments": arguments, "device_id": device_id}
+        return cluster.call("command", payload, _FORWARD_TIMEOUT)
+    return device_queue(device_id).submit(capability, command, arguments)
+
+def _serve(payload: dict) -> Future:
+    """Leader side of a command forwarded by a follower."""
+    return device_queue(payload["device_id"]).submit(payload["capability"], payload["command"], payload["arguments"])
+
+def send(capability: str, command: str, arguments: list = None, device_id: str = None) -> dict:
+    """Queue a command and wait for its result."""
+    return submit(capability, command, arguments, device_id).result()
+
+def toggle_mute(device_id: str = None) -> Future:
+    """Toggle mute; taps in the same batch are combined into their net effect."""
+    return submit("audioMute", TOGGLE, device_id=device_id)
+
+
+cluster.serve("command", _serve)
@@ -0,0 +1,135 @@
+import os
+import time
+
+from dotenv import load_dotenv
+
+# Load .env from repo root
+BASE_DIR = os.path.dirname(__file__)
+ROOT_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
+load_dotenv(os.path.join(ROOT_DIR, ".env"))
+
+# ---------- Roku config ----------
+ROKU_IP = os.getenv("ROKU_IP", "192.168.50.129")
+ROKU_PORT = int(os.getenv("ROKU_PORT", "8060"))
+# Pin a specific Roku by serial number when more than one is on the network
+ROKU_SERIAL = os.getenv("ROKU_SERIAL")
+ROKU_REGISTRY_FILE = os.path.expanduser("~/.roku_devices.json")
+# SSDP multicast group and how long to collect answers (seconds)
+SSDP_ADDRESS = os.getenv("SSDP_ADDRESS", "239.255.255.250:1900")
+SSDP_TIMEOUT = float(os.getenv("SSDP_TIMEOUT", "2"))
+CNN_APP_ID = "65978"  # from /query/apps
+# Installed-channel catalog (see app/catalog.py) and how long before it is revalidated
+CATALOG_FILE = os.path.expanduser("~/.roku_apps.json")
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "86400"))
+# Named key macros as "name = step, step, ..." separated by ";" (see app/macros.py)
+ROKU_MACROS = os.getenv("ROKU_MACROS", "")
+# Least time between two keypresses so the Roku UI registers each one (seconds)
+MACRO_KEY_GAP = float(os.getenv("MACRO_KEY_GAP", "0.15"))
+
+# ---------- TV group config ----------
+# Several TVs as "name=roku/smartthings_device_id,..." (see app/groups.py)
+TV_GROUP = os.getenv("TV_GROUP", "")
+# TVs acted on at once, and the per-device deadline for a group action (seconds)
+GROUP_PARALLELISM = int(os.getenv("GROUP_PARALLELISM", "4"))
+GROUP_DEADLINE = float(os.getenv("GROUP_DEADLINE", "40"))
+
+# ---------- Playback readiness config ----------
+# Give up waiting for playback after this many seconds (then mute anyway)
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", "20"))
+# Shortest and longest gap between readiness polls
+READY_POLL_MIN = float(os.getenv("READY_POLL_MIN", "0.25"))
+READY_POLL_MAX = float(os.getenv("READY_POLL_MAX", "1"))
+# Learned time-to-ready per app, shared by the web app and the cron script
+READY_FILE = os.path.expanduser("~/.roku_ready_times.json")
+
+# ---------- SmartThings config ----------
+SMARTTHINGS_CLIENT_ID = os.getenv("SMARTTHINGS_CLIENT_ID")
+SMARTTHINGS_CLIENT_SECRET = os.getenv("SMARTTHINGS_CLIENT_SECRET")
+SMARTTHINGS_TV_DEVICE_ID = os.getenv("SMARTTHINGS_TV_DEVICE_ID")
+
+# Overridable so the app can be pointed at a local stand-in (scripts/fake_upstreams.py)
+SMARTTHINGS_API_URL = os.getenv("SMARTTHINGS_API_URL", "https://api.smartthings.com").rstrip("/")
+OAUTH_TOKEN_URL = f"{SMARTTHINGS_API_URL}/oauth/token"
+API_BASE = f"{SMARTTHINGS_API_URL}/v1"
+TOKEN_FILE = os.path.expanduser("~/.smartthings_tokens.json")
+# Shared secret for hmac-sha256 signed webhook calls (local testing); real
+# SmartThings calls are verified against its published RSA keys.
+SMARTTHINGS_WEBHOOK_SECRET = os.getenv("SMARTTHINGS_WEBHOOK_SECRET")
+SMARTTHINGS_KEY_URL = "https://key.smartthings.com"
+# Seconds before expiry at which the web app renews the token in the background
+TOKEN_RENEW_AHEAD = int(os.getenv("SMARTTHINGS_TOKEN_RENEW_AHEAD", "300"))
+# Commands for one TV within this many seconds go out in one request (see app/commands.py)
+COMMAND_BATCH_WINDOW = float(os.getenv("COMMAND_BATCH_WINDOW", "0.2"))
+
+# ---------- HTTP client config ----------
+# Keep-alive connections held open per upstream host.
+SMARTTHINGS_POOL_SIZE = int(os.getenv("SMARTTHINGS_POOL_SIZE", "10"))
+ROKU_POOL_SIZE = int(os.getenv("ROKU_POOL_SIZE", "4"))
+# Connect timeouts in seconds; read timeouts are chosen per call.
+SMARTTHINGS_CONNECT_TIMEOUT = float(os.getenv("SMARTTHINGS_CONNECT_TIMEOUT", "3.05"))
+ROKU_CONNECT_TIMEOUT = float(os.getenv("ROKU_CONNECT_TIMEOUT", "2"))
+# Worker threads shared by all concurrent upstream calls
+UPSTREAM_WORKERS = int(os.getenv("UPSTREAM_WORKERS", "8"))
+
+# ---------- Circuit breaker config ----------
+# Offline/timeout results in a row before a device's circuit opens
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "3"))
+# First open period is BREAKER_BASE_DELAY..2x that; it doubles per failed probe up to the max
+BREAKER_BASE_DELAY = float(os.getenv("BREAKER_BASE_DELAY", "15"))
+BREAKER_MAX_DELAY = float(os.getenv("BREAKER_MAX_DELAY", "300"))
+
+# ---------- Status poller config ----------
+# Seconds between background polls of SmartThings and the Roku
+STATUS_POLL_INTERVAL = float(os.getenv("STATUS_POLL_INTERVAL", "15"))
+# Snapshots older than this are reported as stale
+STATUS_STALE_AFTER = float(os.getenv("STATUS_STALE_AFTER", "45"))
+# Stop polling when no client has read the status for this long
+STATUS_IDLE_AFTER = float(os.getenv("STATUS_IDLE_AFTER", "300"))
+# SmartThings status poll interval once webhook events are arriving
+STATUS_RECONCILE_INTERVAL = float(os.getenv("STATUS_RECONCILE_INTERVAL", "300"))
+# Seconds an optimistic mute value is held after its command is answered (see app/state.py)
+STATE_SETTLE = float(os.getenv("STATE_SETTLE", "5"))
+# Send at most one SmartThings refresh command per this many seconds
+REFRESH_WINDOW = float(os.getenv("REFRESH_WINDOW", "30"))
+# Overall deadline for one status fetch; slower upstreams are reported as unknown
+STATUS_DEADLINE = float(os.getenv("STATUS_DEADLINE", "4"))
+# Last known device state, loaded at startup so the first page renders before upstream answers
+STATUS_FILE = os.path.expanduser("~/.roku_status.json")
+
+# ---------- Server-Sent Events config ----------
+# Seconds between heartbeat comments on an idle /events stream
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+# Seconds after which a stream is closed so the browser reconnects
+SSE_MAX_AGE = float(os.getenv("SSE_MAX_AGE", "300"))
+# Reconnect delay suggested to EventSource clients, in milliseconds
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "3000"))
+
+# ---------- Background jobs config ----------
+# Finished jobs kept around for /jobs/<id> lookups
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "50"))
+
+# ---------- Scheduler config ----------
+# Timed actions as "<cron expression> <action> [app]" separated by ";" (see app/scheduler.py)
+SCHEDULES = os.getenv("SCHEDULES", "")
+# Renew the token and open upstream connections this many seconds before each fire
+SCHEDULE_WARMUP = float(os.getenv("SCHEDULE_WARMUP", "30"))
+# A fire at most this late (e.g. right after a restart) still runs; older ones are recorded as missed
+SCHEDULE_GRACE = float(os.getenv("SCHEDULE_GRACE", "300"))
+# Last fire, drift and missed fires per schedule
+SCHEDULE_FILE = os.path.expanduser("~/.roku_schedule.json")
+
+# ---------- Production server config ----------
+# Worker processes started by app/serve.py; above 1, workers share state (see app/shared.py)
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+# SQLite database (WAL) holding the shared snapshot and the followers' requests
+SHARED_STATE_FILE = os.path.expanduser("~/.roku_shared.db")
+# Seconds between checks of the shared database for changes from other workers
+SHARED_SYNC_INTERVAL = float(os.getenv("SHARED_SYNC_INTERVAL", "0.25"))
+
+
+def smartthings_config_ok() -> bool:
+    return all([SMARTTHINGS_CLIENT_ID, SMARTTHINGS_CLIENT_SECRET, SMARTTHINGS_TV_DEVICE_ID])
+
+
+def log(msg: str) -> None:
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {msg}", flush=True)
@@ -0,0 +1,287 @@
+"""SmartThings and Roku device helpers shared by the web app and the cron script."""
+import time
+import xml.etree.ElementTree as ET
+from urllib.parse import quote
+
+import requests
+
+from . import client, metrics
+from .breaker import backoff, roku_breaker, smartthings_breaker
+from .config import (
+    API_BASE,
+    SMARTTHINGS_TV_DEVICE_ID,
+    log,
+    smartthings_config_ok,
+)
+from .discovery import registry as roku_registry
+from .tokens import manager as token_manager
+
+# ---------- Response parsing ----------
+
+def command_entry(capability: str, command: str, arguments: list = None) -> dict:
+    return {
+        "component": "main",
+        "capability": capability,
+        "command": command,
+        "arguments": arguments or []
+    }
+
+def parse_command_results(body: dict, count: int) -> list:
+    """Per-command success flags from a /commands response; missing entries count as accepted."""
+    results = body.get("results") or []
+    return [
+        i >= len(results) or results[i].get("status", "ACCEPTED") in ("ACCEPTED", "COMPLETED")
+        for i in range(count)
+    ]
+
+def parse_mute_state(status: dict):
+    """Path to mute status: components.main.audioMute.mute.value"""
+    return status.get("components", {}).get("main", {}).get("audioMute", {}).get("mute", {}).get("value")
+
+def parse_tv_status(status: dict) -> str:
+    """Map a SmartThings device status document to 'off', 'muted' or 'unmuted'."""
+    main = status.get("components", {}).get("main", {})
+
+    # Check power status first
+    switch_state = main.get("switch", {}).get("switch", {}).get("value")
+    if switch_state != "on":
+        return "off"
+
+    # Check mute status
+    mute_state = parse_mute_state(status)
+    log(f"TV Status - Power: {switch_state}, Mute: {mute_state}")
+    return "muted" if mute_state == "muted" else "unmuted"
+
+def parse_active_app(text: str) -> dict:
+    """Parse /query/active-app XML into {'id': str, 'name': str} or {}."""
+    root = ET.fromstring(text)
+    app = root.find("app")
+    if app is None:
+        return {}
+    return {"id": app.attrib.get("id", ""), "name": (app.text or "").strip()}
+
+def parse_media_player(text: str) -> dict:
+    """Parse /query/media-player XML into {'state': str, 'app_id': str}."""
+    root = ET.fromstring(text)
+    plugin = root.find("plugin")
+    return {
+        "state": root.attrib.get("state", ""),
+        "app_id": plugin.attrib.get("id", "") if plugin is not None else "",
+    }
+
+# ---------- SmartThings helpers ----------
+
+def send_smartthings_command(capability: str, command: str, arguments: list = None, max_retries: int = 3, retry_delay: int = 3, device_id: str = None) -> bool:
+    """Send a command to the Samsung TV via SmartThings API."""
+    return all(send_smartthings_commands([command_entry(capability, command, arguments)],
+                                         max_retries, retry_delay, device_id))
+
+def send_smartthings_commands(commands: list, max_retries: int = 3, retry_delay: int = 3, device_id: str = None) -> list:
+    """Send several commands in one request; returns a success flag per command."""
+    token = token_manager.access_token()
+    device_id = device_id or SMARTTHINGS_TV_DEVICE_ID
+    url = f"{API_BASE}/devices/{device_id}/commands"
+    payload = {"commands": commands}
+    label = ", ".join(c["command"] for c in commands)
+    op = "refresh" if all(c["capability"] == "refresh" for c in commands) else "command"
+    circuit = smartthings_breaker(device_id)
+    if not circuit.allow():
+        log(f"TV {device_id} looks offline; trying {label} once without retries")
+        max_retries = 1
+
+    for attempt in range(1, max_retries + 1):
+        headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        }
+        try:
+            resp = client.smartthings.post(url, json=payload, headers=headers, timeout=15, op=op)
+        except requests.RequestException:
+            circuit.failure()
+            raise
+        log(f"SmartThings {label} attempt {attempt}: {resp.status_code} {resp.text!r}")
+
+        if resp.ok:
+            circuit.success()
+            try:
+                return parse_command_results(resp.json(), len(commands))
+            except ValueError:
+                return [True] * len(commands)
+
+        if resp.status_code == 401:
+            log("401 from SmartThings; refreshing token and retrying…")
+            metrics.observe_retry("smartthings", op, 401)
+            token = token_manager.force_refresh(token)
+            continue
+
+        if resp.status_code in (409, 503):
+            if attempt < max_retries:
+                delay = backoff(attempt, retry_delay)
+                log(f"Device not ready (status {resp.status_code}). Waiting {delay:.1f}s then retrying…")
+                metrics.observe_retry("smartthings", op, resp.status_code, delay)
+                time.sleep(delay)
+                continue
+            circuit.failure()
+
+        break
+    # A probe answered with neither success nor an offline status (e.g. a 500) counts as failed.
+    circuit.settle()
+    return [False] * len(commands)
+
+def mute_tv_smartthings(device_id: str = None) -> bool:
+    """Mute the Samsung TV via SmartThings API."""
+    return send_smartthings_command("audioMute", "mute", device_id=device_id)
+
+def get_mute_state(device_id: str = None):
+    """Current audioMute value ('muted'/'unmuted'), or None if it can't be read."""
+    token = token_manager.access_token()
+    url = f"{API_BASE}/devices/{device_id or SMARTTHINGS_TV_DEVICE_ID}/status"
+    resp = client.smartthings.get(url, headers={"Authorization": f"Bearer {token}"}, timeout=15, op="status")
+    if resp.status_code != 200:
+        log(f"Failed to get TV status: {resp.status_code} {resp.text}")
+        return None
+    mute_state = parse_mute_state(resp.json())
+    log(f"Current mute state: {mute_state}")
+    return mute_state
+
+def toggle_mute_smartthings(device_id: str = None) -> bool:
+    """Toggle mute status on the Samsung TV via SmartThings API."""
+    try:
+        # Fallback: just send mute if we can't get status
+        new_command = "unmute" if get_mute_state(device_id) == "muted" else "mute"
+        log(f"Toggling mute to: {new_command}")
+        return send_smartthings_command("audioMute", new_command, device_id=device_id)
+    except Exception as e:
+        log(f"Error toggling mute: {e}")
+        return False
+
+def get_tv_status(device_id: str = None) -> str:
+    """Get current TV status from SmartThings. Returns 'off', 'muted', 'unmuted', or 'unavailable'."""
+    if not smartthings_config_ok():
+        return "unavailable"
+    device_id = device_id or SMARTTHINGS_TV_DEVICE_ID
+    circuit = smartthings_breaker(device_id)
+    if not circuit.allow():
+        # Offline for a while: answer from memory until the next probe.
+        return "off"
+    try:
+        token = token_manager.access_token()
+        url = f"{API_BASE}/devices/{device_id}/status"
+        headers = {"Authorization": f"Bearer {token}"}
+        
+        resp = client.smartthings.get(url, headers=headers, timeout=10, op="status")
+
+        if resp.status_code == 200:
+            circuit.success()
+            return parse_tv_status(resp.json())
+            
+        # Handle known offline/error states
+        if resp.status_code in (409, 503):
+            log(f"TV appears to be offline (status {resp.status_code})")
+            circuit.failure()
+            return "off"
+            
+    except requests.RequestException as e:
+        log(f"Error getting TV status: {e}")
+        circuit.failure()
+    except Exception as e:
+        log(f"Error getting TV status: {e}")
+    finally:
+        # Settle a half-open probe answered with anything else (e.g. a 401 or 500).
+        circuit.settle()
+
+    return "off" # Default fallback (offline/error)
+
+def refresh_smartthings_status(device_id: str = None) -> bool:
+    """Send a refresh command to the TV to update its status."""
+    try:
+        if not smartthings_config_ok():
+            return False
+        log("Sending refresh command to SmartThings...")
+        return send_smartthings_command("refresh", "refresh", device_id=device_id)
+    except Exception as e:
+        log(f"Error sending refresh: {e}")
+        return False
+
+# ---------- Roku helpers ----------
+
+def launch_roku_app(app_id: str, label: str, base_url: str = None) -> bool:
+    """Launch a Roku app by ID (on ``base_url``, default: our discovered Roku)."""
+    roku_url = base_url or roku_registry.base_url()
+    # A launch is user-initiated, so it always goes out; its outcome still feeds the breaker.
+    circuit = roku_breaker(roku_url)
+    try:
+        url = f"{roku_url}/launch/{app_id}"
+        log(f"Launching Roku app {label} (id={app_id}) at {url}…")
+        resp = client.roku.post(url, timeout=5, op="launch")
+        circuit.success()
+        log(f"{label} launch response: {resp.status_code}")
+        return resp.status_code in (200, 204)
+    except requests.RequestException as e:
+        log(f"Failed to launch {label}: {e}")
+        circuit.failure()
+        roku_registry.report_failure(base_url)
+        return False
+
+def send_roku_keypress(key: str, base_url: str = None) -> bool:
+    """Press a remote key (ECP name such as ``Select``, ``Down`` or ``Lit_a``) on the Roku."""
+    roku_url = base_url or roku_registry.base_url()
+    circuit = roku_breaker(roku_url)
+    try:
+        resp = client.roku.post(f"{roku_url}/keypress/{quote(key)}", timeout=3, op="keypress")
+        circuit.success()
+        if resp.status_code not in (200, 204):
+            log(f"Roku keypress {key} failed: {resp.status_code}")
+            return False
+        return True
+    except requests.RequestException as e:
+        log(f"Failed to send Roku keypress {key}: {e}")
+        circuit.failure()
+        roku_registry.report_failure(base_url)
+        return False
+
+def get_roku_active_app(base_url: str = None) -> dict:
+    """Return the active Roku app as {'id': str, 'name': str} or {} on failure."""
+    roku_url = base_url or roku_registry.base_url()
+    circuit = roku_breaker(roku_url)
+    if not circuit.allow():
+        return {}
+    try:
+        url = f"{roku_url}/query/active-app"
+        resp = client.roku.get(url, timeout=3, op="active-app")
+        circuit.success()
+        if resp.status_code != 200:
+            log(f"Roku active-app query failed: {resp.status_code}")
+            return {}
+        return parse_active_app(resp.text)
+    except Exception as e:
+        log(f"Failed to query Roku active app: {e}")
+        if isinstance(e, requests.RequestException):
+            circuit.failure()
+        roku_registry.report_failure(base_url)
+        return {}
+    finally:
+        circuit.settle()
+
+def get_roku_media_player(base_url: str = None) -> dict:
+    """Return Roku playback as {'state': str, 'app_id': str} or {} on failure."""
+    roku_url = base_url or roku_registry.base_url()
+    circuit = roku_breaker(roku_url)
+    if not circuit.allow():
+        return {}
+    try:
+        url = f"{roku_url}/query/media-player"
+        resp = client.roku.get(url, timeout=3, op="media-player")
+        circuit.success()
+        if resp.status_code != 200:
+            log(f"Roku media-player query failed: {resp.status_code}")
+            return {}
+        return parse_media_player(resp.text)
+    except Exception as e:
+        log(f"Failed to query Roku media player: {e}")
+        if isinstance(e, requests.RequestException):
+            circuit.failure()
+        roku_registry.report_failure(base_url)
+        return {}
+    finally:
+        circuit.settle()
@@ -0,0 +1,241 @@
+"""SSDP discovery of Roku devices with a persisted registry keyed by serial number.
+
+Roku calls go to ``registry.base_url()``, which is answered from memory. At
+startup the cached address is checked with a quick ``/query/device-info``; if
+it does not answer (or a later Roku call fails), an SSDP ``roku:ecp`` search
+runs in the background and the registry is updated with wherever the device
+moved to. Group members named by serial (app/groups.py) are looked up the same
+way: an unknown serial is searched for instead of falling back to ``ROKU_IP``,
+and a failed call to a member's address rediscovers that member.
+"""
+import json
+import os
+import socket
+import threading
+import time
+import xml.etree.ElementTree as ET
+from urllib.parse import urlparse
+
+from . import client
+from .config import (
+    ROKU_IP,
+    ROKU_PORT,
+    ROKU_REGISTRY_FILE,
+    ROKU_SERIAL,
+    SSDP_ADDRESS,
+    SSDP_TIMEOUT,
+    log,
+)
+
+# Don't start another SSDP search within this many seconds of the last one
+REDISCOVER_INTERVAL = 30
+
+M_SEARCH = (
+    "M-SEARCH * HTTP/1.1\r\n"
+    "HOST: 239.255.255.250:1900\r\n"
+    'MAN: "ssdp:discover"\r\n'
+    "ST: roku:ecp\r\n"
+    "MX: 1\r\n"
+    "\r\n"
+)
+
+
+def _parse_response(data: bytes) -> dict:
+    """Parse one SSDP response into {'serial', 'host', 'port'} or {}."""
+    headers = {}
+    for line in data.decode("latin-1").split("\r\n")[1:]:
+        key, _, value = line.partition(":")
+        headers[key.strip().lower()] = value.strip()
+    if headers.get("st") != "roku:ecp" or "location" not in headers:
+        return {}
+    location = urlparse(headers["location"])
+    serial = headers.get("usn", "").rpartition(":")[2]
+    return {"serial": serial, "host": location.hostname, "port": location.port or ROKU_PORT}
+
+def discover(timeout: float = SSDP_TIMEOUT, want: str = None) -> list:
+    """Send an SSDP M-SEARCH for roku:ecp and collect answers for up to ``timeout`` seconds.
+
+    Returns as soon as the device with serial ``want`` answers.
+    """
+    host, _, port = SSDP_ADDRESS.rpartition(":")
+    found = {}
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
+        sock.settimeout(timeout)
+        sock.sendto(M_SEARCH.encode(), (host, int(port)))
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            sock.settimeout(max(deadline - time.monotonic(), 0.01))
+            try:
+                data, _ = sock.recvfrom(2048)
+            except socket.timeout:
+                break
+            device = _parse_response(data)
+            if device:
+                found[device["serial"]] = device
+                if device["serial"] == want:
+                    break
+    return list(found.values())
+
+
+class RokuRegistry:
+    def __init__(self, path: str = ROKU_REGISTRY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._search_lock = threading.Lock()
+        self._last_search = 0.0
+        self.last_discovery_ms = None
+        self._data = self._load()
+
+    # ---------- Persistence ----------
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data.setdefault("devices", {})
+        data.setdefault("selected", ROKU_SERIAL)
+        return data
+
+    def _save(self) -> None:
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self._data, f)
+        os.replace(tmp, self.path)
+
+    # ---------- Lookups ----------
+
+    def _selected(self):
+        serial = ROKU_SERIAL or self._data.get("selected")
+        return self._data["devices"].get(serial) if serial else None
+
+    def base_url(self, serial: str = None) -> str:
+        """``http://host:port`` of our Roku (or the one with ``serial``), from memory.
+
+        Raises LookupError for a ``serial`` that hasn't been discovered yet, after
+        starting a search for it in the background.
+        """
+        if not serial:
+            device = self._selected()
+            if device is None:
+                return f"http://{ROKU_IP}:{ROKU_PORT}"
+        else:
+            device = self._data["devices"].get(serial)
+            if device is None:
+                self._search_soon(serial)
+                raise LookupError(f"Roku {serial} hasn't been discovered yet")
+        return f"http://{device['host']}:{device['port']}"
+
+    def _serial_at(self, base_url: str):
+        """Serial of the known device at ``base_url``, if any."""
+        parsed = urlparse(base_url)
+        for serial, device in self.devices().items():
+            if (device["host"], device["port"]) == (parsed.hostname, parsed.port):
+                return serial
+        return None
+
+    def devices(self) -> dict:
+        return dict(self._data["devices"])
+
+    # ---------- Checks and discovery ----------
+
+    def _device_info(self, base_url: str, timeout: float = 0.5) -> dict:
+        resp = client.roku.get(f"{base_url}/query/device-info", timeout=timeout, op="device-info")
+        resp.raise_for_status()
+        root = ET.fromstring(resp.text)
+        return {"serial": (root.findtext("serial-number") or "").strip()}
+
+    def ensure_reachable(self) -> bool:
+        """Quick check of the cached address; rediscover (blocking) if it doesn't answer."""
+        base_url = self.base_url()
+        try:
+            info = self._device_info(base_url)
+        except Exception as e:
+            log(f"Roku not answering at {base_url} ({e}); rediscovering…")
+            return self.rediscover(wait=True)
+        if info["serial"] and self._selected() is None:
+            # First run: remember the device behind ROKU_IP by its serial.
+            parsed = urlparse(base_url)
+            with self._lock:
+                self._data["devices"][info["serial"]] = {"host": parsed.hostname, "port": parsed.port, "seen_at": time.time()}
+                self._data["selected"] = info["serial"]
+                self._save()
+        return True
+
+    def rediscover(self, want: str = None, wait: bool = False) -> bool:
+        """Run an SSDP search and update the registry; True if ``want`` (default: our Roku) was found.
+
+        Without ``wait``, returns False at once if another search is running.
+        """
+        want = want or ROKU_SERIAL or self._data.get("selected")
+        if not self._search_lock.acquire(blocking=wait):
+            return False
+        try:
+            self._last_search = time.monotonic()
+            started = time.perf_counter()
+            found = discover(want=want)
+            self.last_discovery_ms = (time.perf_counter() - started) * 1000
+            log(f"SSDP found {len(found)} Roku device(s) in {self.last_discovery_ms:.0f} ms")
+            with self._lock:
+                for device in found:
+                    self._data["devices"][device["serial"]] = {
+                        "host": device["host"], "port": device["port"], "seen_at": time.time(),
+                    }
+                if found and self._selected() is None:
+                    # Prefer the device at ROKU_IP; otherwise take the first answer.
+                    match = next((d for d in found if d["host"] == ROKU_IP), found[0])
+                    self._data["selected"] = match["serial"]
+                self._data["discovery_ms"] = self.last_discovery_ms
+                self._save()
+            return any(d["serial"] == want for d in found)
+        except OSError as e:
+            log(f"SSDP discovery failed: {e}")
+            return False
+        finally:
+            self._search_lock.release()
+
+    def locate(self, serial: str) -> str:
+        """``base_url(serial)``, searching the network first (blocking) if the serial is unknown."""
+        if serial not in self._data["devices"]:
+            # Waits out a search already running, which may find it too.
+            with self._search_lock:
+                pass
+            if serial not in self._data["devices"] and not self.rediscover(serial, wait=True):
+                raise LookupError(f"Roku {serial} not found on the network")
+        return self.base_url(serial)
+
+    def _search_soon(self, serial: str = None) -> None:
+        """Rediscover ``serial`` (default: our Roku) in the background, rate limited."""
+        if self._search_lock.locked() or time.monotonic() - self._last_search < REDISCOVER_INTERVAL:
+            return
+        threading.Thread(target=self.rediscover, args=(serial,), name="roku-discovery", daemon=True).start()
+
+    def report_failure(self, base_url: str = None) -> None:
+        """A call to our Roku (or the one at ``base_url``) failed; rediscover it in the background.
+
+        Addresses that no discovered serial lives at (fixed IPs or host names)
+        are left alone.
+        """
+        if base_url is None or base_url == self.base_url():
+            self._search_soon()
+            return
+        serial = self._serial_at(base_url)
+        if serial is not None:
+            self._search_soon(serial)
+
+    def start(self) -> None:
+        """Check the cached address in the background at app startup."""
+        threading.Thread(target=self.ensure_reachable, name="roku-discovery", daemon=True).start()
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.base_url(),
+            "selected": ROKU_SERIAL or self._data.get("selected"),
+            "devices": len(self._data["devices"]),
+            "last_discovery_ms": self.last_discovery_ms or self._data.get("discovery_ms"),
+        }
+
+
+registry = RokuRegistry()
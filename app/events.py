@@ -0,0 +1,121 @@
+"""Server-Sent Events fan-out for TV status changes.
+
+The status poller publishes into a single ``EventHub``. Each ``/events``
+subscriber parks on the hub's condition variable (WSGI) or on an asyncio
+event (ASGI) and is only woken when the state actually changes or its
+heartbeat is due, so idle tabs cost no upstream calls and no per-tab polling.
+Under WSGI a parked subscriber still holds a server thread; only ASGI
+(``./run.sh --asgi``) serves open tabs without one.
+"""
+import asyncio
+import json
+import threading
+import time
+
+from .config import SSE_HEARTBEAT, SSE_MAX_AGE, SSE_RETRY_MS
+
+
+def _frame(event_id: str, state: dict) -> str:
+    return f"id: {event_id}\ndata: {json.dumps(state)}\n\n"
+
+
+class EventHub:
+    def __init__(self):
+        self._cond = threading.Condition()
+        # Event ids are "<epoch>.<version>" so ids from before a restart never match.
+        self._epoch = int(time.time())
+        self._version = 0
+        self._state = None
+        self._async_waiters = set()
+        self.subscribers = 0
+
+    @property
+    def last_id(self) -> str:
+        return f"{self._epoch}.{self._version}"
+
+    def publish(self, state: dict) -> bool:
+        """Store ``state`` and wake subscribers; no-op if nothing changed."""
+        with self._cond:
+            if state == self._state:
+                return False
+            self._state = state
+            self._version += 1
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+        return True
+
+    def _newer(self, last_id: str):
+        # Caller holds self._cond
+        if self._state is None or self.last_id == last_id:
+            return None
+        return self.last_id, self._state
+
+    def wait(self, last_id: str, timeout: float):
+        """Block until there is a state newer than ``last_id``; return (id, state) or None."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._newer(last_id) is not None, timeout)
+            return self._newer(last_id)
+
+    async def wait_async(self, last_id: str, timeout: float):
+        """Coroutine version of ``wait`` for the ASGI server."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            event = self._newer(last_id)
+            if event is not None:
+                return event
+            self._async_waiters.add(waiter)
+        try:
+            await asyncio.wait_for(waiter[1].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+        with self._cond:
+            return self._newer(last_id)
+
+    def _subscribed(self, delta: int) -> None:
+        with self._cond:
+            self.subscribers += delta
+
+    def stream(self, last_id: str = None, on_heartbeat=None):
+        """Yield SSE frames; resumes after ``last_id`` (the client's Last-Event-ID)."""
+        self._subscribed(1)
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            started = time.time()
+            # Close long-lived streams now and then; EventSource reconnects with Last-Event-ID.
+            while time.time() - started < SSE_MAX_AGE:
+                event = self.wait(last_id, SSE_HEARTBEAT)
+                if event is None:
+                    if on_heartbeat is not None:
+                        on_heartbeat()
+                    yield ": heartbeat\n\n"
+                    continue
+                last_id, state = event
+                yield _frame(last_id, state)
+        finally:
+            self._subscribed(-1)
+
+    async def stream_async(self, last_id: str = None, on_heartbeat=None):
+        """Async generator version of ``stream``."""
+        self._subscribed(1)
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            started = time.time()
+            while time.time() - started < SSE_MAX_AGE:
+                event = await self.wait_async(last_id, SSE_HEARTBEAT)
+                if event is None:
+                    if on_heartbeat is not None:
+                        on_heartbeat()
+                    yield ": heartbeat\n\n"
+                    continue
+                last_id, state = event
+                yield _frame(last_id, state)
+        finally:
+            self._subscribed(-1)
+
+
+hub = EventHub()
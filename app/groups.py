@@ -0,0 +1,162 @@
+"""Groups of TVs controlled together.
+
+Each member is a Roku plus (optionally) the SmartThings device of the TV it is
+plugged into. Group actions run on every member at once on a bounded pool with
+a per-device deadline, so wall time tracks the slowest TV rather than the sum.
+
+``TV_GROUP`` lists members as ``name=roku/smartthings_device_id`` separated by
+commas, where ``roku`` is an IP, a host name (with an optional ``:port``) or
+a Roku serial number, resolved through SSDP discovery. Without it the group
+is the single TV from ``ROKU_IP`` and ``SMARTTHINGS_TV_DEVICE_ID``; the first
+member is always the primary TV.
+"""
+import contextvars
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .config import (
+    GROUP_DEADLINE,
+    GROUP_PARALLELISM,
+    ROKU_PORT,
+    SMARTTHINGS_TV_DEVICE_ID,
+    TV_GROUP,
+    log,
+    smartthings_config_ok,
+)
+from . import commands
+from .breaker import smartthings_breaker
+from .devices import launch_roku_app
+from .discovery import registry as roku_registry
+from .readiness import wait_until_playing
+from .state import model
+
+# Roku serial numbers are upper-case letters and digits; anything else is an address.
+_SERIAL = re.compile(r"^[A-Z0-9]{8,}$")
+
+
+class TV:
+    def __init__(self, name: str, roku: str = None, device_id: str = None):
+        self.name = name
+        self.roku = roku
+        self.device_id = device_id
+
+    @property
+    def serial(self):
+        return self.roku if self.roku and _SERIAL.match(self.roku) else None
+
+    @property
+    def base_url(self):
+        """ECP base URL, or None to use the discovered default Roku.
+
+        Raises LookupError if the member's serial hasn't been discovered yet.
+        """
+        if not self.roku:
+            return None
+        if self.serial is None:
+            host, _, port = self.roku.partition(":")
+            return f"http://{host}:{port or ROKU_PORT}"
+        return roku_registry.base_url(self.serial)
+
+    def locate(self) -> None:
+        """Make sure ``base_url`` resolves, searching the network for an unknown serial."""
+        if self.serial is not None:
+            roku_registry.locate(self.serial)
+
+
+def parse_group(spec: str) -> list:
+    members = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, target = entry.partition("=")
+        roku, _, device_id = target.partition("/")
+        members.append(TV(name.strip(), roku.strip() or None, device_id.strip() or None))
+    return members
+
+
+group = parse_group(TV_GROUP) if TV_GROUP else [TV("tv", None, SMARTTHINGS_TV_DEVICE_ID)]
+primary = group[0]
+
+# Separate from client.executor: a launch sequence can block for READY_TIMEOUT.
+_executor = ThreadPoolExecutor(max_workers=GROUP_PARALLELISM, thread_name_prefix="tv-group")
+
+
+def run_on_group(fn, deadline: float = GROUP_DEADLINE) -> dict:
+    """Run ``fn(tv)`` for every member concurrently; return {name: result}.
+
+    Members that miss ``deadline`` or raise get ``{"ok": False, "error": ...}``.
+    """
+    def run(tv: TV):
+        tv.locate()
+        return fn(tv)
+
+    started = time.monotonic()
+    futures = {tv.name: _executor.submit(contextvars.copy_context().run, run, tv) for tv in group}
+    wait(futures.values(), timeout=deadline)
+    results = {}
+    for name, future in futures.items():
+        if not future.done():
+            results[name] = {"ok": False, "error": "timeout"}
+        elif future.exception() is not None:
+            results[name] = {"ok": False, "error": str(future.exception())}
+        else:
+            results[name] = future.result()
+    log(f"Group action on {len(group)} TV(s) took {time.monotonic() - started:.2f}s")
+    return results
+
+# ---------- Group actions ----------
+
+def start_app(app_id: str, label: str, progress=log) -> dict:
+    """Launch ``app_id`` on every TV and mute each one as soon as it plays."""
+    def start(tv: TV) -> dict:
+        where = f" on {tv.name}" if len(group) > 1 else ""
+        progress(f"Launching {label}{where}…")
+        if not launch_roku_app(app_id, label, tv.base_url):
+            progress(f"Error launching {label}{where}. Check the logs for details.")
+            return {"ok": False, "error": "launch failed"}
+        progress(f"Waiting for {label} to start playing{where}…")
+        ready = wait_until_playing(app_id, base_url=tv.base_url)
+        muted = False
+        if tv.device_id and smartthings_config_ok():
+            # The Roku playing is a good sign the TV just came on; don't fail fast.
+            smartthings_breaker(tv.device_id).probe_soon()
+            progress(f"Muting TV{where} via SmartThings…")
+            # Through the TV's command queue, so a toggle tapped meanwhile is
+            # batched with it, and the state model shows it at once.
+            model.expect_mute(tv.name, "muted")
+            result = {"ok": False, "error": "mute command raised"}
+            try:
+                result = commands.send("audioMute", "mute", device_id=tv.device_id)
+            finally:
+                # Settle even if the send raised, or the expected state is held.
+                model.settle_mute(tv.name, result)
+            muted = result["ok"]
+        return {"ok": True, "ready_s": ready, "muted": muted}
+    return run_on_group(start)
+
+def launch_app(app_id: str, label: str) -> dict:
+    """Launch ``app_id`` on every TV, without waiting for playback or muting."""
+    return run_on_group(lambda tv: {"ok": launch_roku_app(app_id, label, tv.base_url)})
+
+def run_macro(macro, progress=log) -> dict:
+    """Run a Roku key macro (app/macros.py) on every TV; results carry per-step timings."""
+    return run_on_group(lambda tv: macro.run(tv.base_url, progress=progress))
+
+def set_mute(command: str) -> dict:
+    """Send ``mute`` or ``unmute`` to every TV with a SmartThings device."""
+    def send(tv: TV) -> dict:
+        if not tv.device_id:
+            return {"ok": True, "skipped": True}
+        return commands.send("audioMute", command, device_id=tv.device_id)
+    return run_on_group(send)
+
+def mute_command(statuses: dict) -> str:
+    """'unmute' if every powered-on TV is muted, else 'mute'.
+
+    ``statuses`` maps member name to its last known tv_status.
+    """
+    on = [status for status in statuses.values() if status in ("muted", "unmuted")]
+    return "unmute" if on and all(status == "muted" for status in on) else "mute"
+
+def mute_targets(statuses: dict) -> list:
+    """Members a group mute toggle should be sent to."""
+    return [tv for tv in group if tv.device_id and statuses.get(tv.name) != "off"]
@@ -0,0 +1,181 @@
+"""In-process background job queue for slow device sequences.
+
+Routes submit a job and return right away; a single worker thread runs jobs in
+order. Submitting a job of a kind that is already queued or running returns
+the existing job instead of starting a second one. Under the multi-worker
+server a job runs in the worker that took the request, and its progress is
+copied to the shared store so /jobs/<id> works from any worker. Each job
+also claims its kind in the store, so a request for a kind that another
+worker is already running joins that job instead of starting another.
+"""
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .config import CNN_APP_ID, GROUP_DEADLINE, JOB_HISTORY, log
+from .groups import run_macro, start_app
+from .shared import cluster
+from .state import model
+from .status import status_service
+
+# A claim on a job kind not renewed for this long is taken to belong to a dead
+# worker. Jobs report progress at least once per group action, and a group
+# action ends within GROUP_DEADLINE.
+_CLAIM_TTL = 2 * GROUP_DEADLINE
+
+
+class Job:
+    def __init__(self, kind: str, fn):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.fn = fn
+        self.state = "queued"
+        self.message = "Waiting to start…"
+        self.ok = None
+        self.results = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("done", "failed")
+
+    def progress(self, message: str) -> None:
+        self.message = message
+        log(f"Job {self.kind} {self.id}: {message}")
+        self.share()
+
+    def share(self) -> None:
+        """Copy this job's state to the other workers (app/shared.py) and renew its claim."""
+        if not cluster.enabled:
+            return
+        try:
+            cluster.put(f"job:{self.id}", self.to_dict())
+            if self.finished:
+                cluster.release(f"job-kind:{self.kind}", self.id)
+            else:
+                cluster.renew(f"job-kind:{self.kind}", self.id)
+        except Exception as e:
+            log(f"Sharing job {self.id} failed: {e}")
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "message": self.message,
+            "ok": self.ok,
+            "results": self.results,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class SharedJob:
+    """A job another worker is running, as last shared; enough for routes to attach to it."""
+
+    def __init__(self, shared: dict):
+        self.id = shared["id"]
+        self._shared = shared
+
+    def to_dict(self) -> dict:
+        return cluster.get(f"job:{self.id}") or self._shared
+
+
+class JobQueue:
+    def __init__(self, history: int = JOB_HISTORY):
+        self.history = history
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict()
+        self._active = {}
+        self._worker = None
+
+    def submit(self, kind: str, fn):
+        """Queue ``fn(job)`` unless a ``kind`` job is pending; return (job, created)."""
+        with self._lock:
+            active = self._active.get(kind)
+            if active is not None and not active.finished:
+                return active, False
+            job = Job(kind, fn)
+            if cluster.enabled and not cluster.claim(f"job-kind:{kind}", job.to_dict(), _CLAIM_TTL):
+                owner = cluster.get(f"job-kind:{kind}")
+                if owner is not None:
+                    return SharedJob(owner), False
+            self._active[kind] = job
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                _, old = self._jobs.popitem(last=False)
+                if cluster.enabled:
+                    cluster.delete(f"job:{old.id}")
+        job.share()
+        self._ensure_worker()
+        self._queue.put(job)
+        return job, True
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def describe(self, job_id: str):
+        """``get(job_id).to_dict()``, also for a job another worker runs; None if unknown."""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        return cluster.get(f"job:{job_id}") if cluster.enabled else None
+
+    def _ensure_worker(self) -> None:
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="job-worker", daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            job.state = "running"
+            job.share()
+            try:
+                job.ok = bool(job.fn(job))
+            except Exception as e:
+                job.ok = False
+                job.progress(f"Error: {e}")
+            job.state = "done" if job.ok else "failed"
+            job.finished_at = time.time()
+            job.share()
+
+
+job_queue = JobQueue()
+
+# ---------- Job functions ----------
+
+def start_cnn(job: Job) -> bool:
+    """Launch CNN on every TV in the group, muting each once CNN plays."""
+    job.results = start_app(CNN_APP_ID, "CNN", progress=job.progress)
+    status_service.poll_now()
+    # Let upstream confirm (or correct) the mute once the model stops holding it.
+    status_service.reconcile_later(model.settle + 0.5)
+    launched = sum(result["ok"] for result in job.results.values())
+    muted = sum(bool(result.get("muted")) for result in job.results.values())
+    if len(job.results) == 1:
+        if not launched:
+            job.progress("Error launching CNN app. Check the logs for details.")
+        elif muted:
+            job.progress("CNN app launched and TV muted.")
+        else:
+            job.progress("CNN app launched, but muting the TV failed.")
+    else:
+        job.progress(f"CNN launched on {launched} of {len(job.results)} TVs ({muted} muted).")
+    return launched > 0
+
+def macro_job(macro):
+    """Job function running ``macro`` (app/macros.py) on every TV."""
+    def run(job: Job) -> bool:
+        job.results = run_macro(macro, progress=job.progress)
+        status_service.poll_now()
+        done = sum(result["ok"] for result in job.results.values())
+        job.progress(f"Macro {macro.name} finished on {done} of {len(job.results)} TV(s).")
+        return done > 0
+    return run
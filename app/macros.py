@@ -0,0 +1,171 @@
+"""Roku key macros: launch, keypress and wait steps run back to back.
+
+``ROKU_MACROS`` defines named macros, entries separated by ``;``, each
+``name = step, step, ...``. Steps:
+
+    launch <app>             launch an installed app by name or id (see app/catalog.py)
+    key <Key>[*N] [gap]      press an ECP key (Select, Down, Back, Home, Lit_a, ...)
+                             N times, at least ``gap`` seconds apart
+    wait app [seconds]       until the launched app is in the foreground
+    wait playing [seconds]   until it plays (as the Start CNN job does)
+    sleep <seconds>          a fixed pause, for screens with nothing to poll
+
+e.g. ``ROKU_MACROS="news = launch CNN, wait playing, key Down*2, key Select"``.
+``cnn-live`` (launch CNN, wait until it's up, press Select) is built in.
+
+A macro runs on one thread, so each request reuses the same pooled keep-alive
+connection to the Roku (app/client.py). There are no fixed sleeps unless a
+``sleep`` step asks for one: waits poll at short, slowly growing intervals
+and end as soon as the state is reached, and keypresses are only spaced by
+``MACRO_KEY_GAP`` (or the step's own gap) so the Roku UI registers each one.
+The first failing step, or a wait that times out, ends the run. Each run
+reports every step's outcome and duration.
+"""
+import time
+
+from .catalog import catalog
+from .config import MACRO_KEY_GAP, READY_POLL_MAX, READY_POLL_MIN, READY_TIMEOUT, ROKU_MACROS, log
+from .devices import get_roku_active_app, launch_roku_app, send_roku_keypress
+from .readiness import wait_until_playing
+
+BUILTIN = {
+    "cnn-live": "launch CNN, wait app, key Select",
+}
+_KINDS = ("launch", "key", "wait", "sleep")
+
+
+class Step:
+    def __init__(self, spec: str):
+        words = spec.split()
+        if not words or words[0] not in _KINDS:
+            raise ValueError(f"step {spec!r} must start with one of {', '.join(_KINDS)}")
+        self.kind, args = words[0], words[1:]
+        self.spec = " ".join(words)
+        self.count = 1
+        self.seconds = None
+        self.arg = None
+        try:
+            if self.kind == "launch":
+                if not args:
+                    raise ValueError("launch needs an app name")
+                self.arg = " ".join(args)
+            elif self.kind == "key":
+                if not 1 <= len(args) <= 2:
+                    raise ValueError("key takes a key name and an optional gap")
+                self.arg, _, count = args[0].partition("*")
+                self.count = int(count) if count else 1
+                if not self.arg or self.count < 1:
+                    raise ValueError("expected Key or Key*N")
+                self.seconds = float(args[1]) if len(args) > 1 else MACRO_KEY_GAP
+            elif self.kind == "wait":
+                if not 1 <= len(args) <= 2 or args[0] not in ("app", "playing"):
+                    raise ValueError("wait takes 'app' or 'playing' and an optional timeout")
+                self.arg = args[0]
+                self.seconds = float(args[1]) if len(args) > 1 else READY_TIMEOUT
+            else:
+                if len(args) != 1:
+                    raise ValueError("sleep takes a number of seconds")
+                self.seconds = float(args[0])
+        except ValueError as e:
+            raise ValueError(f"{self.spec}: {e}") from None
+
+    def __str__(self) -> str:
+        return self.spec
+
+    def run(self, context: dict, base_url: str = None):
+        """Carry out the step; returns (ok, detail). ``context`` is shared by the macro's steps."""
+        if self.kind == "launch":
+            found = catalog.lookup(self.arg, base_url)
+            if found is None:
+                return False, f"no installed app matches {self.arg!r}"
+            context["app"] = found
+            return launch_roku_app(found["id"], found["name"], base_url), found["name"]
+        if self.kind == "key":
+            for _ in range(self.count):
+                # Space presses out only as much as the Roku needs.
+                gap = self.seconds - (time.monotonic() - context.get("key_at", 0.0))
+                if gap > 0:
+                    time.sleep(gap)
+                ok = send_roku_keypress(self.arg, base_url)
+                context["key_at"] = time.monotonic()
+                if not ok:
+                    return False, f"keypress {self.arg} failed"
+            return True, None
+        if self.kind == "wait":
+            app_id = context["app"]["id"]
+            if self.arg == "playing":
+                waited = wait_until_playing(app_id, timeout=self.seconds, base_url=base_url)
+                return waited is not None, None if waited is not None else "not playing in time"
+            return _wait_for_app(app_id, self.seconds, base_url), None
+        time.sleep(self.seconds)
+        return True, None
+
+
+def _wait_for_app(app_id: str, timeout: float, base_url: str = None) -> bool:
+    """Poll the active app until it is ``app_id``; False after ``timeout`` seconds."""
+    deadline = time.monotonic() + timeout
+    interval = READY_POLL_MIN
+    while get_roku_active_app(base_url).get("id") != app_id:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 1.5, READY_POLL_MAX)
+    return True
+
+
+class Macro:
+    def __init__(self, name: str, spec: str):
+        self.name = name
+        self.steps = [Step(part) for part in spec.split(",") if part.strip()]
+        if not self.steps:
+            raise ValueError("no steps")
+        launched = False
+        for step in self.steps:
+            launched |= step.kind == "launch"
+            if step.kind == "wait" and not launched:
+                raise ValueError(f"{step}: wait needs an earlier launch step")
+
+    def to_dict(self) -> dict:
+        return {"steps": [str(step) for step in self.steps]}
+
+    def run(self, base_url: str = None, progress=log) -> dict:
+        """Run every step in order; returns {'ok', 'steps': [{'step', 'ok', 'ms', ...}], 'total_ms'}."""
+        started = time.perf_counter()
+        context = {}
+        results = []
+        for number, step in enumerate(self.steps, 1):
+            step_started = time.perf_counter()
+            try:
+                ok, detail = step.run(context, base_url)
+            except Exception as e:
+                ok, detail = False, str(e)
+            elapsed = (time.perf_counter() - step_started) * 1000
+            result = {"step": str(step), "ok": ok, "ms": round(elapsed, 1)}
+            if detail:
+                result["detail"] = detail
+            results.append(result)
+            progress(f"Macro {self.name} step {number}/{len(self.steps)} {step}: "
+                     f"{'ok' if ok else 'failed'} in {elapsed:.0f} ms" + (f" ({detail})" if detail else ""))
+            if not ok:
+                break
+        ok = len(results) == len(self.steps) and results[-1]["ok"]
+        return {"ok": ok, "steps": results, "total_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+def parse_macros(spec: str) -> dict:
+    """``{name: Macro}`` for ``name = steps`` entries separated by ``;``; bad entries are logged and skipped."""
+    found = {}
+    for entry in filter(None, (part.strip() for part in spec.split(";"))):
+        name, _, steps = entry.partition("=")
+        try:
+            if not name.strip() or not steps.strip():
+                raise ValueError("expected name = step, step, ...")
+            found[name.strip()] = Macro(name.strip(), steps)
+        except ValueError as e:
+            log(f"Ignoring macro {entry!r}: {e}")
+    return found
+
+
+macros = parse_macros("; ".join(f"{name} = {steps}" for name, steps in BUILTIN.items()))
+macros.update(parse_macros(ROKU_MACROS))
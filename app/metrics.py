@@ -0,0 +1,158 @@
+"""In-process latency histograms and counters, exposed in Prometheus text format.
+
+Every SmartThings and Roku call is timed by operation (status, command,
+refresh, token, launch, active-app, …) and counted by outcome (HTTP status,
+or "error" for connection failures and timeouts). Recording is a dict lookup
+and a few additions under a lock, cheap enough to leave on.
+
+Calls made while serving a request are also added to that request's
+``Server-Timing`` header, e.g. ``smartthings-status;dur=182.4, total;dur=190.1``.
+"""
+import threading
+from bisect import bisect_left
+from contextvars import ContextVar
+
+# Upper bounds (seconds) shared by all histograms; +Inf is implied.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values, amount: float = 1) -> None:
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines += [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in items]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, *values) -> None:
+        index = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            row = self._values.get(values)
+            if row is None:
+                row = self._values[values] = [0] * (len(BUCKETS) + 2)
+            row[index] += 1
+            row[-1] += seconds
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(row)) for key, row in self._values.items())
+        for key, row in items:
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), row):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels + ('le',), key + (str(bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {row[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """A value read from ``fn()`` at scrape time."""
+
+    def __init__(self, name: str, help: str, fn, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {_number(self.fn())}"]
+
+
+def _number(value) -> str:
+    """Full-precision sample value (``:g`` would round 1234567 to 1.23457e+06)."""
+    if isinstance(value, int):
+        return str(int(value))
+    return repr(float(value))
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+upstream_seconds = Histogram(
+    "upstream_request_duration_seconds", "Time spent on one upstream HTTP call.", ("upstream", "op"))
+upstream_responses = Counter(
+    "upstream_responses_total", "Upstream HTTP calls by outcome (status code, or error).", ("upstream", "op", "code"))
+upstream_retries = Counter(
+    "upstream_retries_total", "SmartThings command retries by reason.", ("upstream", "op", "reason"))
+request_seconds = Histogram(
+    "http_request_duration_seconds", "Time to produce a response, by route.", ("route", "method"))
+requests_total = Counter(
+    "http_requests_total", "Responses by route and status code.", ("route", "method", "status"))
+
+_metrics = [upstream_seconds, upstream_responses, upstream_retries, request_seconds, requests_total]
+
+
+def register(metric) -> None:
+    """Add a metric (e.g. a ``Gauge`` over another module's stats) to /metrics."""
+    _metrics.append(metric)
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+# ---------- Recording ----------
+
+def observe_upstream(upstream: str, op: str, seconds: float, code) -> None:
+    upstream_seconds.observe(seconds, upstream, op)
+    upstream_responses.inc(upstream, op, str(code))
+    timings = _timings.get()
+    if timings is not None:
+        name = f"{upstream}-{op}"
+        timings[name] = timings.get(name, 0.0) + seconds
+
+def observe_retry(upstream: str, op: str, reason, wait: float = 0.0) -> None:
+    """Count a retry; ``wait`` is the back-off before it, shown in Server-Timing."""
+    upstream_retries.inc(upstream, op, str(reason))
+    timings = _timings.get()
+    if timings is not None and wait:
+        name = f"{upstream}-retry-wait"
+        timings[name] = timings.get(name, 0.0) + wait
+
+def observe_request(route: str, method: str, status: int, seconds: float) -> None:
+    request_seconds.observe(seconds, route, method)
+    requests_total.inc(route, method, str(status))
+
+# ---------- Server-Timing ----------
+
+_timings = ContextVar("server_timing", default=None)
+
+
+def start_timing() -> None:
+    """Collect upstream time for the current request (thread or task)."""
+    _timings.set({})
+
+def stop_timing(total: float) -> str:
+    """End collection and return the ``Server-Timing`` header value."""
+    timings = _timings.get() or {}
+    _timings.set(None)
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
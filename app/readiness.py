@@ -0,0 +1,71 @@
+"""Detect when a Roku app is foreground and playing, instead of sleeping a fixed time.
+
+Observed time-to-ready is kept per app as a moving average in ``READY_FILE``.
+The first poll after a launch is scheduled a little before the app usually
+becomes ready, then polling continues at short, slowly growing intervals.
+"""
+import json
+import os
+import time
+
+from .config import READY_FILE, READY_POLL_MAX, READY_POLL_MIN, READY_TIMEOUT, log
+from .devices import get_roku_active_app, get_roku_media_player
+
+# Weight of the newest observation in the moving average
+_SMOOTHING = 0.3
+# Fraction of the expected time-to-ready to wait before the first poll
+_FIRST_POLL = 0.6
+
+
+def _load_history() -> dict:
+    try:
+        with open(READY_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_history(history: dict) -> None:
+    tmp = READY_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(history, f)
+    os.replace(tmp, READY_FILE)
+
+def _record(app_id: str, elapsed: float) -> None:
+    history = _load_history()
+    previous = history.get(app_id)
+    history[app_id] = elapsed if previous is None else (1 - _SMOOTHING) * previous + _SMOOTHING * elapsed
+    try:
+        _save_history(history)
+    except OSError as e:
+        log(f"Could not save readiness history: {e}")
+
+def expected_time_to_ready(app_id: str):
+    """Average observed seconds from launch to playback, or None if never seen."""
+    return _load_history().get(app_id)
+
+def is_playing(app_id: str, base_url: str = None) -> bool:
+    """True when ``app_id`` is the foreground Roku app and is playing."""
+    if get_roku_active_app(base_url).get("id") != app_id:
+        return False
+    player = get_roku_media_player(base_url)
+    return player.get("state") == "play" and player.get("app_id") in ("", app_id)
+
+def wait_until_playing(app_id: str, timeout: float = READY_TIMEOUT, base_url: str = None):
+    """Poll until ``app_id`` plays; return seconds waited, or None at the timeout."""
+    started = time.monotonic()
+    expected = expected_time_to_ready(app_id)
+    delay = expected * _FIRST_POLL if expected else READY_POLL_MIN
+    interval = READY_POLL_MIN
+    while True:
+        remaining = timeout - (time.monotonic() - started)
+        if remaining <= 0:
+            log(f"App {app_id} not playing after {timeout:.0f}s; giving up on readiness")
+            return None
+        time.sleep(min(delay, remaining))
+        if is_playing(app_id, base_url):
+            elapsed = time.monotonic() - started
+            log(f"App {app_id} playing after {elapsed:.2f}s")
+            _record(app_id, elapsed)
+            return elapsed
+        delay = interval
+        interval = min(interval * 1.5, READY_POLL_MAX)
@@ -1,253 +1,234 @@
-import os
-import time
 import json
-import requests
-import xml.etree.ElementTree as ET
-from flask import render_template, request, redirect, url_for, jsonify
-from dotenv import load_dotenv
-
-# Load .env from repo root
-BASE_DIR = os.path.dirname(__file__)
-ROOT_DIR = os.path.abspath(os.path.join(BASE_DIR, ".."))
-load_dotenv(os.path.join(ROOT_DIR, ".env"))
-
-# ---------- Roku config ----------
-ROKU_IP = os.getenv("ROKU_IP", "192.168.50.129")
-CNN_APP_ID = "65978"  # from /query/apps
-
-# ---------- SmartThings config ----------
-SMARTTHINGS_CLIENT_ID = os.getenv("SMARTTHINGS_CLIENT_ID")
-SMARTTHINGS_CLIENT_SECRET = os.getenv("SMARTTHINGS_CLIENT_SECRET")
-SMARTTHINGS_TV_DEVICE_ID = os.getenv("SMARTTHINGS_TV_DEVICE_ID")
-
-OAUTH_TOKEN_URL = "https://api.smartthings.com/oauth/token"
-API_BASE = "https://api.smartthings.com/v1"
-TOKEN_FILE = os.path.expanduser("~/.smartthings_tokens.json")
-
-def _smartthings_config_ok() -> bool:
-    return all([SMARTTHINGS_CLIENT_ID, SMARTTHINGS_CLIENT_SECRET, SMARTTHINGS_TV_DEVICE_ID])
-
-def log(msg: str) -> None:
-    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {msg}", flush=True)
-
-# ---------- SmartThings token helpers ----------
-
-def _load_tokens() -> dict:
-    if not _smartthings_config_ok():
-        raise RuntimeError("SmartThings config missing")
-    if not os.path.exists(TOKEN_FILE):
-        raise RuntimeError(f"Token file not found: {TOKEN_FILE}")
-    with open(TOKEN_FILE, "r") as f:
-        return json.load(f)
-
-def _save_tokens(tokens: dict) -> None:
-    tmp = TOKEN_FILE + ".tmp"
-    with open(tmp, "w") as f:
-        json.dump(tokens, f)
-    os.replace(tmp, TOKEN_FILE)
-    try:
-        os.chmod(TOKEN_FILE, 0o600)
-    except Exception:
-        # Best effort; not fatal if chmod fails on some platforms
-        pass
-
-def _refresh_tokens(refresh_token: str) -> dict:
-    """Refresh SmartThings OAuth token using Basic auth."""
-    log("Refreshing SmartThings token…")
-    resp = requests.post(
-        OAUTH_TOKEN_URL,
-        auth=(SMARTTHINGS_CLIENT_ID, SMARTTHINGS_CLIENT_SECRET),
-        data={"grant_type": "refresh_token", "refresh_token": refresh_token},
-        timeout=15,
-    )
-    if resp.status_code != 200:
-        raise RuntimeError(f"SmartThings refresh failed: {resp.status_code} {resp.text}")
-    data = resp.json()
-    return {
-        "access_token": data["access_token"],
-        "refresh_token": data.get("refresh_token", refresh_token),
-        "expires_at": time.time() + int(data.get("expires_in", 3600)),
-    }
-
-def _get_access_token() -> str:
-    tokens = _load_tokens()
-    # Refresh a bit early to avoid clock skew
-    if tokens.get("expires_at", 0) <= time.time() + 60:
-        tokens = _refresh_tokens(tokens["refresh_token"])
-        _save_tokens(tokens)
-    return tokens["access_token"]
-
-def send_smartthings_command(capability: str, command: str, arguments: list = None, max_retries: int = 3, retry_delay: int = 3) -> bool:
-    """Send a command to the Samsung TV via SmartThings API."""
-    token = _get_access_token()
-    url = f"{API_BASE}/devices/{SMARTTHINGS_TV_DEVICE_ID}/commands"
+import time
+from flask import Response, g, render_template, request, redirect, url_for, jsonify
+
+from . import breaker, commands, groups, metrics
+from .assets import manifest as assets
+from .catalog import catalog
+from .config import CNN_APP_ID, log, smartthings_config_ok
+from .discovery import registry as roku_registry
+from .events import hub
+from .jobs import job_queue, macro_job, start_cnn
+from .macros import macros
+from .scheduler import scheduler
+from .shared import cluster
+from .state import model
+from .status import UNKNOWN, refresher, status_service
+from .webhook import handle_lifecycle, verify_signature
+
+def cnn_active(active_app) -> bool:
+    return UNKNOWN if active_app == UNKNOWN else active_app.get("id") == CNN_APP_ID
+
+def status_payload(snapshot: dict) -> dict:
+    """The client-facing part of a status snapshot; unknown fields stay "unknown".
+
+    With a TV group, "group" adds per-TV [status, cnn_active] pairs and counts.
+    """
     payload = {
-        "commands": [{
-            "component": "main",
-            "capability": capability,
-            "command": command,
-            "arguments": arguments or []
-        }]
+        "status": snapshot["tv_status"],
+        "cnn_active": cnn_active(snapshot["active_app"]),
+        "version": snapshot.get("version", 0),
     }
-
-    for attempt in range(1, max_retries + 1):
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
+    members = snapshot["members"]
+    if len(members) > 1:
+        tvs = {name: [m["tv_status"], cnn_active(m["active_app"])] for name, m in members.items()}
+        payload["group"] = {
+            "size": len(tvs),
+            "on": sum(status in ("muted", "unmuted") for status, _ in tvs.values()),
+            "muted": sum(status == "muted" for status, _ in tvs.values()),
+            "cnn": sum(active is True for _, active in tvs.values()),
+            "tvs": tvs,
         }
-        resp = requests.post(url, json=payload, headers=headers, timeout=15)
-        log(f"SmartThings {command} attempt {attempt}: {resp.status_code} {resp.text!r}")
-
-        if resp.ok:
-            return True
-
-        if resp.status_code == 401:
-            log("401 from SmartThings; refreshing token and retrying…")
-            tokens = _refresh_tokens(_load_tokens()["refresh_token"])
-            _save_tokens(tokens)
-            token = tokens["access_token"]
-            continue
-
-        if resp.status_code in (409, 503) and attempt < max_retries:
-            log(f"Device not ready (status {resp.status_code}). Waiting {retry_delay}s then retrying…")
-            time.sleep(retry_delay)
-            continue
-
-        break
-    return False
-
-def mute_tv_smartthings() -> bool:
-    """Mute the Samsung TV via SmartThings API."""
-    return send_smartthings_command("audioMute", "mute")
-
-def toggle_mute_smartthings() -> bool:
-    """Toggle mute status on the Samsung TV via SmartThings API."""
-    token = _get_access_token()
-    url = f"{API_BASE}/devices/{SMARTTHINGS_TV_DEVICE_ID}/status"
-    headers = {"Authorization": f"Bearer {token}"}
-    
-    try:
-        resp = requests.get(url, headers=headers, timeout=15)
-        if resp.status_code == 200:
-            status = resp.json()
-            # Path to mute status: components.main.audioMute.mute.value
-            mute_state = status.get("components", {}).get("main", {}).get("audioMute", {}).get("mute", {}).get("value")
-            log(f"Current mute state: {mute_state}")
-            
-            new_command = "unmute" if mute_state == "muted" else "mute"
-            log(f"Toggling mute to: {new_command}")
-            return send_smartthings_command("audioMute", new_command)
-        else:
-            log(f"Failed to get TV status: {resp.status_code} {resp.text}")
-            # Fallback: just send mute if we can't get status
-            return send_smartthings_command("audioMute", "mute")
-    except Exception as e:
-        log(f"Error toggling mute: {e}")
-        return False
-
-def get_tv_status() -> str:
-    """Get current TV status from SmartThings. Returns 'off', 'muted', 'unmuted', or 'unavailable'."""
-    try:
-        if not _smartthings_config_ok():
-            return "unavailable"
-        token = _get_access_token()
-        url = f"{API_BASE}/devices/{SMARTTHINGS_TV_DEVICE_ID}/status"
-        headers = {"Authorization": f"Bearer {token}"}
-        
-        resp = requests.get(url, headers=headers, timeout=10)
-
-        if resp.status_code == 200:
-            status = resp.json()
-            main = status.get("components", {}).get("main", {})
-            
-            # Check power status first
-            switch_state = main.get("switch", {}).get("switch", {}).get("value")
-            if switch_state != "on":
-                return "off"
-            
-            # Check mute status
-            audio_mute = main.get("audioMute", {})
-            mute_attr = audio_mute.get("mute", {})
-            mute_state = mute_attr.get("value")
-            
-            log(f"TV Status - Power: {switch_state}, Mute: {mute_state}")
-            return "muted" if mute_state == "muted" else "unmuted"
-            
-        # Handle known offline/error states
-        if resp.status_code in (409, 503):
-            log(f"TV appears to be offline (status {resp.status_code})")
-            return "off"
-            
-    except Exception as e:
-        log(f"Error getting TV status: {e}")
-
-    return "off" # Default fallback (offline/error)
-
-def refresh_smartthings_status():
-    """Send a refresh command to the TV to update its status."""
-    try:
-        if not _smartthings_config_ok():
-            return
-        log("Sending refresh command to SmartThings...")
-        send_smartthings_command("refresh", "refresh")
-    except Exception as e:
-        log(f"Error sending refresh: {e}")
-
-# ---------- Roku helpers ----------
-
-def launch_roku_app(app_id: str, label: str) -> bool:
-    """Launch a Roku app by ID."""
-    try:
-        url = f"http://{ROKU_IP}:8060/launch/{app_id}"
-        log(f"Launching Roku app {label} (id={app_id}) at {url}…")
-        resp = requests.post(url, timeout=5)
-        log(f"{label} launch response: {resp.status_code}")
-        return resp.status_code in (200, 204)
-    except requests.RequestException as e:
-        log(f"Failed to launch {label}: {e}")
-        return False
-
-def get_roku_active_app() -> dict:
-    """Return the active Roku app as {'id': str, 'name': str} or {} on failure."""
-    try:
-        url = f"http://{ROKU_IP}:8060/query/active-app"
-        resp = requests.get(url, timeout=3)
-        if resp.status_code != 200:
-            log(f"Roku active-app query failed: {resp.status_code}")
-            return {}
-        root = ET.fromstring(resp.text)
-        app = root.find("app")
-        if app is None:
-            return {}
-        return {"id": app.attrib.get("id", ""), "name": (app.text or "").strip()}
-    except Exception as e:
-        log(f"Failed to query Roku active app: {e}")
-        return {}
+    return payload
+
+def toggle_mute_all():
+    """Toggle mute without waiting on SmartThings; returns (ok, per-TV results).
+
+    The state model (app/state.py) decides mute vs. unmute and shows the
+    expected state right away. Commands go through the batching queue; their
+    results settle or roll back the optimistic state, and a poll after
+    STATE_SETTLE reconciles it with what the TV reports.
+    """
+    if not smartthings_config_ok():
+        return False, None
+    if len(groups.group) == 1:
+        # Rapid taps share one batch and net out (see app/commands.py).
+        tv = groups.primary
+        expected = model.expect_mute(tv.name)
+        futures = {tv.name: commands.toggle_mute(tv.device_id)}
+        results = {tv.name: {"ok": True, "pending": True, "expected": expected}}
+    else:
+        # Every TV gets the same command so the group stays in step.
+        statuses = {name: m["tv_status"] for name, m in status_service.snapshot()["members"].items()}
+        command = groups.mute_command(statuses)
+        targets = groups.mute_targets(statuses)
+        log(f"Group mute toggle: sending {command} to {len(targets)} TV(s)")
+        results = {name: {"ok": True, "skipped": True} for name in statuses}
+        futures = {}
+        for tv in targets:
+            expected = model.expect_mute(tv.name, "muted" if command == "mute" else "unmuted")
+            futures[tv.name] = commands.submit("audioMute", command, device_id=tv.device_id)
+            results[tv.name] = {"ok": True, "pending": True, "expected": expected}
+    for name, future in futures.items():
+        future.add_done_callback(lambda f, name=name: settle_mute(name, f))
+    return True, results
+
+def settle_mute(name: str, future) -> None:
+    """Settle the optimistic mute state with the command's result; a raised command counts as failed."""
+    error = future.exception()
+    result = {"ok": False, "error": str(error)} if error else future.result()
+    model.settle_mute(name, result)
+    status_service.reconcile_later(model.settle + 0.5)
+
+def toggle_payload(ok: bool, results) -> tuple:
+    """(body, status) of a JSON /toggle-mute response, shared by the Flask and ASGI routes."""
+    if not ok:
+        return {"ok": False, "error": "SmartThings is not configured"}, 502
+    return dict(status_payload(status_service.snapshot()), ok=True, results=results), 202
+
+def tv_status_payload(refresh: bool) -> dict:
+    """Body of /tv-status, shared by the Flask and ASGI routes."""
+    if refresh:
+        status_service.request_refresh()
+    snapshot = status_service.snapshot()
+    payload = dict(status_payload(snapshot), updated_at=snapshot["updated_at"], stale=snapshot["stale"],
+                   devices=model.to_dict(), circuits=breaker.states())
+    if cluster.enabled:
+        payload["worker"] = cluster.stats()
+    return payload
+
+def open_event_stream() -> None:
+    """Seed the hub (and ask for a SmartThings refresh) so a new tab gets current state."""
+    status_service.request_refresh()
+    hub.publish(status_payload(status_service.snapshot()))
+
+def event_stream_heartbeat() -> None:
+    # Keeps the poller awake while tabs are open; the refresh rides on the next poll.
+    status_service.snapshot()
+    status_service.request_refresh(poll=False)
+
+def wants_json() -> bool:
+    return request.accept_mimetypes.best == "application/json"
 
 # ---------- Flask routes ----------
 
+def register_metrics() -> None:
+    """Expose other modules' counters on /metrics."""
+    metrics.register(metrics.Gauge(
+        "smartthings_refresh_issued_total", "SmartThings refresh commands sent.", lambda: refresher.issued, "counter"))
+    metrics.register(metrics.Gauge(
+        "smartthings_refresh_coalesced_total", "Refresh requests served by an earlier refresh.", lambda: refresher.coalesced, "counter"))
+    metrics.register(metrics.Gauge(
+        "circuits_open", "Devices whose circuit breaker is open or half-open.", breaker.open_count))
+    metrics.register(metrics.Gauge(
+        "sse_subscribers", "Open /events streams.", lambda: hub.subscribers))
+    metrics.register(metrics.Gauge(
+        "status_snapshot_age_seconds", "Age of the cached device status.", status_service.age))
+
 def register_routes(app):
+    status_service.add_listener(lambda snapshot: hub.publish(status_payload(snapshot)))
+    register_metrics()
+
+    @app.context_processor
+    def asset_helpers():
+        return {"asset_url": assets.url}
+
+    @app.before_request
+    def start_request_timing():
+        g.started = time.perf_counter()
+        metrics.start_timing()
+
+    @app.after_request
+    def add_server_timing(response):
+        elapsed = time.perf_counter() - g.started
+        response.headers["Server-Timing"] = metrics.stop_timing(elapsed)
+        route = request.url_rule.rule if request.url_rule else "other"
+        metrics.observe_request(route, request.method, response.status_code, elapsed)
+        return response
+
     @app.route("/")
     def home():
-        tv_status = get_tv_status()
-        active_app = get_roku_active_app()
-        cnn_active = active_app.get("id") == CNN_APP_ID
-        return render_template("index.html", tv_status=tv_status, cnn_active=cnn_active)
+        # Never wait on upstream here: before the first poll lands, render the
+        # shell and let the page fill in state from /events or /tv-status.
+        if status_service.ready:
+            payload = status_payload(status_service.snapshot())
+        else:
+            status_service.poll_now()
+            payload = {"status": UNKNOWN, "cnn_active": UNKNOWN}
+        return render_template("index.html", tv_status=payload["status"], cnn_active=payload["cnn_active"] is True)
+
+    @app.route("/assets/<path:filename>")
+    def hashed_asset(filename):
+        asset = assets.get(filename)
+        if asset is None:
+            return jsonify({"error": "Unknown asset"}), 404
+        headers = {
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "ETag": f'"{asset.etag}"',
+            "Vary": "Accept-Encoding",
+        }
+        if request.if_none_match.contains(asset.etag):
+            return Response(status=304, headers=headers)
+        encoding, body = asset.negotiate(lambda name: request.accept_encodings[name] > 0)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(body, mimetype=asset.mimetype, headers=headers)
+
+    @app.route("/sw.js")
+    def service_worker():
+        # Served from / so it controls the whole app; never cached so updates land.
+        body = render_template("sw.js", version=assets.version, assets=assets.urls())
+        return Response(body, mimetype="application/javascript", headers={"Cache-Control": "no-cache"})
 
     @app.route("/tv-status")
     def tv_status():
         refresh = request.args.get("refresh", "1") == "1"
-        if refresh:
-            refresh_smartthings_status()
-        status = get_tv_status()
-        active_app = get_roku_active_app()
-        cnn_active = active_app.get("id") == CNN_APP_ID
-        return jsonify({"status": status, "cnn_active": cnn_active})
+        return jsonify(tv_status_payload(refresh))
+
+    @app.route("/refresh-stats")
+    def refresh_stats():
+        return jsonify(refresher.stats())
+
+    @app.route("/metrics")
+    def prometheus_metrics():
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/roku/discovery")
+    def roku_discovery():
+        return jsonify(dict(roku_registry.stats(), known=roku_registry.devices()))
+
+    @app.route("/events")
+    def events():
+        open_event_stream()
+        last_id = request.headers.get("Last-Event-ID")
+        return Response(
+            hub.stream(last_id, event_stream_heartbeat),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    @app.route("/smartthings/webhook", methods=["POST"])
+    def smartthings_webhook():
+        body = request.get_data()
+        target = request.full_path.rstrip("?")
+        if not verify_signature(request.method, target, request.headers, body):
+            log("Rejected SmartThings webhook call with a bad signature")
+            return jsonify({"error": "Invalid signature"}), 401
+        try:
+            return jsonify(handle_lifecycle(json.loads(body)))
+        except ValueError as e:
+            # Bad JSON (including bad UTF-8), a non-object body or missing fields
+            log(f"Rejected malformed SmartThings webhook call: {e}")
+            return jsonify({"error": "Malformed request"}), 400
 
     @app.route("/toggle-mute", methods=["POST"])
     def toggle_mute():
         log("Web request received to toggle mute")
-        if toggle_mute_smartthings():
+        ok, results = toggle_mute_all()
+        if wants_json():
+            body, status = toggle_payload(ok, results)
+            return jsonify(body), status
+        if ok:
             return redirect(url_for('home'))
         else:
             return render_template("message.html", 
@@ -259,25 +240,59 @@ def register_routes(app):
     @app.route("/start-cnn", methods=["POST"])
     def launch_cnn():
         log("Web request received to start CNN Roku app")
-
-        if not launch_roku_app(CNN_APP_ID, "CNN"):
-            return render_template("message.html", 
-                                   title="Error",
-                                   message="Error launching CNN app. Check the logs for details.",
-                                   refresh_time=3,
-                                   is_error=True)
-
-        # Let CNN app load & auto-dismiss its own overlay
-        time.sleep(12)
-
-        log("Muting TV via SmartThings (CNN)…")
-        if mute_tv_smartthings():
-            log("TV muted successfully (CNN).")
-        else:
-            log("Failed to mute TV via SmartThings (CNN).")
-
-        return render_template("message.html", 
-                               title="Done!",
-                               message="CNN app launched successfully.",
-                               refresh_time=2,
-                               is_error=False)
+        job, created = job_queue.submit("start-cnn", start_cnn)
+        if not created:
+            log(f"CNN start already in progress; attaching to job {job.id}")
+
+        if wants_json():
+            return jsonify(job.to_dict()), 202
+        return render_template("message.html",
+                               title="Starting CNN",
+                               message="CNN is launching. The TV will be muted once it loads.",
+                               refresh_time=3,
+                               is_loading=True)
+
+    @app.route("/apps")
+    def installed_apps():
+        return jsonify(catalog.apps())
+
+    @app.route("/launch/<path:app_name>", methods=["POST"])
+    def launch_app(app_name):
+        found = catalog.lookup(app_name)
+        if found is None:
+            return jsonify({"ok": False, "error": f"No installed app matches {app_name!r}"}), 404
+        log(f"Web request received to launch {found['name']} (matched {app_name!r})")
+        results = groups.launch_app(found["id"], found["name"])
+        ok = any(result["ok"] for result in results.values())
+        if ok:
+            status_service.poll_now()
+        body = {"ok": ok, "app": found}
+        if len(results) > 1:
+            body["results"] = results
+        return jsonify(body), 200 if ok else 502
+
+    @app.route("/macros")
+    def list_macros():
+        return jsonify({name: macro.to_dict() for name, macro in macros.items()})
+
+    @app.route("/macros/<name>", methods=["POST"])
+    def run_macro(name):
+        macro = macros.get(name)
+        if macro is None:
+            return jsonify({"error": f"Unknown macro {name!r}"}), 404
+        log(f"Web request received to run macro {name}")
+        job, created = job_queue.submit(f"macro:{name}", macro_job(macro))
+        if not created:
+            log(f"Macro {name} already running; attaching to job {job.id}")
+        return jsonify(job.to_dict()), 202
+
+    @app.route("/schedules")
+    def schedules():
+        return jsonify(scheduler.to_dict())
+
+    @app.route("/jobs/<job_id>")
+    def job_status(job_id):
+        job = job_queue.describe(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown job"}), 404
+        return jsonify(job)
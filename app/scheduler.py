@@ -0,0 +1,368 @@
+"""In-process scheduler for timed TV actions (the cron job, kept warm).
+
+``SCHEDULES`` lists entries separated by ``;``. Each is a five-field cron
+expression in local time (minute hour day-of-month month day-of-week, or an
+alias such as ``@daily``) followed by an action:
+
+    start <app>    launch the app on every TV and mute once it plays
+    launch <app>   launch the app without muting
+    mute, unmute   set mute on every TV
+    power-check    poll every TV and log whether it is on
+
+e.g. ``SCHEDULES="0 19 * * 1-5 start CNN; 30 23 * * * mute"``.
+
+Running inside the web app (or ``scripts/scheduler.py``) means a fire reuses
+pooled connections and the in-memory token instead of paying interpreter
+startup, a token file read and a cold TLS handshake. ``SCHEDULE_WARMUP``
+seconds before each fire the token is renewed if it would expire around the
+fire, the Roku address is checked, the app name is resolved and device status
+is polled, which leaves the Roku and SmartThings connections open.
+
+Only the process holding an exclusive lock on ``SCHEDULE_FILE + ".lock"``
+runs schedules, so several app processes (or the app and the daemon) never
+fire twice. Each fire's drift from its scheduled time and its outcome are
+kept in ``SCHEDULE_FILE`` and on /metrics. Fires the process was down or
+suspended for are recorded as missed; the latest still runs if it is less
+than ``SCHEDULE_GRACE`` seconds late.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from datetime import datetime, time as dtime, timedelta
+
+from . import groups, metrics
+from .catalog import catalog
+from .config import SCHEDULE_FILE, SCHEDULE_GRACE, SCHEDULE_WARMUP, SCHEDULES, log, smartthings_config_ok
+from .discovery import registry as roku_registry
+from .jobs import job_queue
+from .status import UNKNOWN, status_service
+from .tokens import manager as token_manager
+
+ACTIONS = ("start", "launch", "mute", "unmute", "power-check")
+_ALIASES = {
+    "@hourly": "0 * * * *",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@weekly": "0 0 * * 0",
+    "@monthly": "0 0 1 * *",
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+}
+_NAMES = {
+    "month": {name: i for i, name in enumerate(
+        ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), 1)},
+    "weekday": {name: i for i, name in enumerate(("sun", "mon", "tue", "wed", "thu", "fri", "sat"))},
+}
+# The token must outlive the fire by this much (seconds) so the action never refreshes it.
+_TOKEN_MARGIN = 120
+# Look no further back than this for fires missed while the process was down.
+_MISSED_LOOKBACK = 7 * 86400
+# Missed fire times kept per schedule.
+_MISSED_HISTORY = 10
+# Longest single sleep, so clock changes and suspend/resume are noticed promptly.
+_MAX_NAP = 30
+
+fire_drift = metrics.Histogram(
+    "schedule_fire_drift_seconds", "How late a scheduled action started.", ("schedule",))
+fires_total = metrics.Counter(
+    "schedule_fires_total", "Scheduled fires by outcome (ok, failed, missed).", ("schedule", "outcome"))
+metrics.register(fire_drift)
+metrics.register(fires_total)
+
+
+class Cron:
+    """A five-field cron expression, matched against naive local datetimes."""
+
+    _FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 7))
+
+    def __init__(self, expr: str):
+        self.expr = expr
+        fields = _ALIASES.get(expr.lower(), expr).split()
+        if len(fields) != 5:
+            raise ValueError(f"expected 5 fields, got {len(fields)}")
+        minutes, hours, days, months, weekdays = (
+            _parse_field(text, *spec) for text, spec in zip(fields, self._FIELDS))
+        self.minutes = sorted(minutes)
+        self.hours = sorted(hours)
+        self.days = days
+        self.months = months
+        self.weekdays = {day % 7 for day in weekdays}  # 7 is Sunday too
+        # As in cron: if both day fields are restricted, matching either is enough.
+        self._either_day = not fields[2].startswith("*") and not fields[4].startswith("*")
+
+    def _day_matches(self, day) -> bool:
+        in_month = day.day in self.days
+        in_week = day.isoweekday() % 7 in self.weekdays
+        return (in_month or in_week) if self._either_day else (in_month and in_week)
+
+    def next_after(self, after: datetime) -> datetime:
+        """The first matching minute strictly after ``after``."""
+        start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        for _ in range(366 * 5):
+            if day.month in self.months and self._day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime.combine(day, dtime(hour, minute))
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"{self.expr!r} never fires")
+
+
+def _parse_field(text: str, name: str, low: int, high: int) -> set:
+    def value(token: str) -> int:
+        return _NAMES.get(name, {}).get(token.lower()[:3]) if not token.isdigit() else int(token)
+
+    values = set()
+    for part in text.split(","):
+        part, _, step = part.partition("/")
+        if part == "*":
+            start, end = low, high
+        else:
+            first, _, last = part.partition("-")
+            start = value(first)
+            end = value(last) if last else (high if step else start)
+        if start is None or end is None or not low <= start <= end <= high or step and not step.strip("0").isdigit():
+            raise ValueError(f"bad {name} field {text!r}")
+        values.update(range(start, end + 1, int(step or 1)))
+    return values
+
+
+class Schedule:
+    def __init__(self, spec: str):
+        words = spec.split()
+        cron, rest = (words[0], words[1:]) if words and words[0].startswith("@") else (" ".join(words[:5]), words[5:])
+        self.cron = Cron(cron)
+        if not rest or rest[0] not in ACTIONS:
+            raise ValueError(f"action must be one of {', '.join(ACTIONS)}")
+        self.action = rest[0]
+        self.arg = " ".join(rest[1:]) or None
+        if self.action in ("start", "launch") and not self.arg:
+            raise ValueError(f"{self.action} needs an app name")
+        self.name = " ".join(filter(None, (cron, self.action, self.arg)))
+        self.next_at = None
+        self.warmed = False
+        self.app = None
+        # Recorded history (persisted)
+        self.last_scheduled = None
+        self.last = None
+        self.fires = 0
+        self.missed = []
+
+    def to_dict(self) -> dict:
+        return {
+            "action": self.action,
+            "app": self.arg,
+            "next_at": self.next_at,
+            "last": self.last,
+            "fires": self.fires,
+            "missed": self.missed,
+        }
+
+
+def parse_schedules(spec: str) -> list:
+    schedules = []
+    for entry in filter(None, (part.strip() for part in spec.split(";"))):
+        try:
+            schedules.append(Schedule(entry))
+        except ValueError as e:
+            log(f"Ignoring schedule {entry!r}: {e}")
+    return schedules
+
+
+class Scheduler:
+    def __init__(self, spec: str = SCHEDULES, path: str = SCHEDULE_FILE,
+                 warmup: float = SCHEDULE_WARMUP, grace: float = SCHEDULE_GRACE):
+        self.path = path
+        self.warmup = warmup
+        self.grace = grace
+        self.schedules = parse_schedules(spec)
+        self.leader = False
+        self._lock_file = None
+        self._thread = None
+        self._save_lock = threading.Lock()
+        self._load()
+
+    # ---------- Persistence ----------
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for schedule in self.schedules:
+            saved = data.get(schedule.name, {})
+            schedule.last_scheduled = saved.get("last_scheduled")
+            schedule.last = saved.get("last")
+            schedule.fires = saved.get("fires", 0)
+            schedule.missed = saved.get("missed", [])
+
+    def _save(self) -> None:
+        data = {s.name: {"last_scheduled": s.last_scheduled, "last": s.last, "fires": s.fires, "missed": s.missed}
+                for s in self.schedules}
+        tmp = self.path + ".tmp"
+        with self._save_lock:
+            with open(tmp, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+
+    # ---------- Running ----------
+
+    def _acquire(self) -> bool:
+        """Take the schedule lock without blocking; True if this process runs schedules."""
+        handle = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._lock_file = handle
+        self.leader = True
+        return True
+
+    def start(self) -> None:
+        """Run the schedules on a background thread (no-op without ``SCHEDULES``)."""
+        if self._thread is not None or not self.schedules:
+            return
+        self._thread = threading.Thread(target=self.run_forever, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def run_forever(self) -> None:
+        if not self._acquire():
+            log("Another process is running the schedules; standing by")
+            while not self._acquire():
+                time.sleep(60)
+            log("Took over running the schedules")
+        now = time.time()
+        for schedule in self.schedules:
+            # Resume from the last handled fire so downtime shows up as missed fires.
+            since = max(schedule.last_scheduled or now, now - _MISSED_LOOKBACK)
+            schedule.next_at = schedule.cron.next_after(datetime.fromtimestamp(since)).timestamp()
+            log(f"Schedule {schedule.name!r}: next at {_format(schedule.next_at)}")
+        while True:
+            schedule = min(self.schedules, key=lambda s: s.next_at)
+            now = time.time()
+            if not schedule.warmed and now >= schedule.next_at - self.warmup:
+                self._warm(schedule)
+                continue
+            due = schedule.next_at if schedule.warmed else schedule.next_at - self.warmup
+            if now < due:
+                time.sleep(min(due - now, _MAX_NAP))
+                continue
+            try:
+                self._fire(schedule, now)
+            except Exception as e:
+                log(f"Schedule {schedule.name!r} failed to fire: {e}")
+            schedule.warmed = False
+            schedule.app = None
+            schedule.next_at = schedule.cron.next_after(datetime.fromtimestamp(max(schedule.next_at, now))).timestamp()
+
+    def _warm(self, schedule: Schedule) -> None:
+        """Get the token, Roku address and connections ready ahead of a fire."""
+        schedule.warmed = True
+        if time.time() > schedule.next_at + self.grace:
+            return  # about to be recorded as missed
+        started = time.perf_counter()
+        try:
+            if smartthings_config_ok():
+                token_manager.ensure_fresh(self.warmup + _TOKEN_MARGIN)
+            if schedule.action in ("start", "launch"):
+                roku_registry.ensure_reachable()
+                schedule.app = catalog.lookup(schedule.arg)
+            # One status poll opens (or reuses) the Roku and SmartThings connections.
+            status_service.update()
+        except Exception as e:
+            log(f"Schedule {schedule.name!r}: warm-up failed: {e}")
+            return
+        log(f"Schedule {schedule.name!r}: warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def _fire(self, schedule: Schedule, now: float) -> None:
+        # Fires overtaken by a later one (the process was down or suspended) are missed.
+        fire_at = schedule.next_at
+        following = schedule.cron.next_after(datetime.fromtimestamp(fire_at)).timestamp()
+        while following <= now:
+            self._record_missed(schedule, fire_at)
+            fire_at = schedule.next_at = following
+            following = schedule.cron.next_after(datetime.fromtimestamp(fire_at)).timestamp()
+        if now - fire_at > self.grace:
+            self._record_missed(schedule, fire_at)
+            self._save()
+            return
+        schedule.last_scheduled = fire_at
+        self._save()
+        job, created = job_queue.submit(self._job_kind(schedule), lambda job: self._run(schedule, fire_at, job))
+        if not created:
+            log(f"Schedule {schedule.name!r}: same action already running; attaching to job {job.id}")
+
+    def _record_missed(self, schedule: Schedule, fire_at: float) -> None:
+        log(f"Schedule {schedule.name!r}: missed the {_format(fire_at)} fire")
+        schedule.last_scheduled = fire_at
+        schedule.missed = (schedule.missed + [fire_at])[-_MISSED_HISTORY:]
+        fires_total.inc(schedule.name, "missed")
+
+    @staticmethod
+    def _job_kind(schedule: Schedule) -> str:
+        # Share the web route's job kind so a scheduled and a manual start coalesce.
+        return "start-cnn" if schedule.action == "start" and schedule.arg.lower() == "cnn" else f"schedule:{schedule.name}"
+
+    def _run(self, schedule: Schedule, fire_at: float, job) -> bool:
+        started = time.time()
+        drift = started - fire_at
+        fire_drift.observe(max(drift, 0.0), schedule.name)
+        job.progress(f"Scheduled {schedule.name!r} started {drift * 1000:.0f} ms after {_format(fire_at)}")
+        ok = False
+        try:
+            ok = self._action(schedule, job)
+        finally:
+            fires_total.inc(schedule.name, "ok" if ok else "failed")
+            schedule.fires += 1
+            schedule.last = {"scheduled_at": fire_at, "started_at": started, "drift_s": round(drift, 3),
+                             "duration_s": round(time.time() - started, 3), "ok": ok, "message": job.message}
+            self._save()
+        return ok
+
+    def _action(self, schedule: Schedule, job) -> bool:
+        if schedule.action in ("start", "launch"):
+            app = schedule.app or catalog.lookup(schedule.arg)
+            if app is None:
+                job.progress(f"No installed app matches {schedule.arg!r}")
+                return False
+            if schedule.action == "start":
+                job.results = groups.start_app(app["id"], app["name"], progress=job.progress)
+            else:
+                job.results = groups.launch_app(app["id"], app["name"])
+            status_service.poll_now()
+            launched = sum(result["ok"] for result in job.results.values())
+            job.progress(f"{app['name']} launched on {launched} of {len(job.results)} TV(s)")
+            return launched > 0
+        if schedule.action in ("mute", "unmute"):
+            job.results = groups.set_mute(schedule.action)
+            status_service.poll_now()
+            sent = sum(result["ok"] for result in job.results.values())
+            job.progress(f"Sent {schedule.action} to {sent} of {len(job.results)} TV(s)")
+            return sent == len(job.results)
+        # power-check
+        members = status_service.update()["members"]
+        job.results = {name: member["tv_status"] for name, member in members.items()}
+        job.progress("TV power: " + ", ".join(
+            f"{name} {'on' if status in ('muted', 'unmuted') else status}" for name, status in job.results.items()))
+        return UNKNOWN not in job.results.values()
+
+    def to_dict(self) -> dict:
+        return {
+            "leader": self.leader,
+            "warmup_s": self.warmup,
+            "grace_s": self.grace,
+            "schedules": {schedule.name: schedule.to_dict() for schedule in self.schedules},
+        }
+
+
+def _format(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+
+scheduler = Scheduler()
@@ -0,0 +1,36 @@
+"""Production server: the ASGI app (app/asgi.py) in several worker processes.
+
+Usage:
+    python3 -m app.serve                       # WEB_WORKERS workers on PORT (default 5050)
+    python3 -m app.serve --workers 4 --port 8000
+
+Each worker is a fresh process that builds its own app with
+``create_asgi_app()``. With more than one, the workers elect a leader that
+alone polls upstream and sends SmartThings commands; the others share device
+state, forward their commands and claim jobs through SHARED_STATE_FILE (see
+app/shared.py), so adding workers doesn't add upstream traffic.
+"""
+import argparse
+import os
+
+import uvicorn
+
+from .config import WEB_WORKERS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app with several worker processes")
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS, help="Worker processes (default: WEB_WORKERS)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT") or os.getenv("FLASK_RUN_PORT") or 5050))
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    # Workers read WEB_WORKERS from the environment they inherit.
+    os.environ["WEB_WORKERS"] = str(args.workers)
+    uvicorn.run("app:create_asgi_app", factory=True, host=args.host, port=args.port,
+                workers=args.workers, log_level=args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""State shared by the worker processes of the production server (app/serve.py).
+
+With ``WEB_WORKERS`` above 1, each worker is a separate process with its own
+memory, but upstream load must not grow with the number of workers. One
+worker, whichever holds an exclusive lock on ``SHARED_STATE_FILE + ".leader"``,
+is the leader: it alone polls device status, sends SmartThings refresh
+commands, renews the token and checks the Roku at startup. The others are
+followers.
+
+Workers exchange state through a small SQLite database at
+``SHARED_STATE_FILE`` in WAL mode, so reads never wait on a write. Every
+snapshot (polled by the leader, or changed by a toggle or webhook event in
+any worker) is written to it along with the state model; a write only lands
+if it is newer than the stored one. Each worker checks ``PRAGMA data_version``
+every ``SHARED_SYNC_INTERVAL`` seconds and copies changed rows into memory,
+so requests are still answered from memory. Followers write requests (a
+poll, a refresh, a page read keeping the poller awake) as rows the leader
+acts on. The token itself stays in ``TOKEN_FILE``, which every worker reads
+when its copy expires.
+
+Work whose upstream cost must not multiply with workers goes through the
+store too. SmartThings commands are ``call``ed: the follower writes a
+``call:<id>`` row, the leader runs it through its own command queue (so taps
+from every worker are batched and coalesced together) and answers with a
+``result:<id>`` row. Background jobs ``claim`` a row per job kind, so a job
+already running in one worker is joined instead of started again in another.
+
+When the leader exits its lock is released, and the first follower to notice
+takes over within one sync interval.
+"""
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from .config import SHARED_STATE_FILE, SHARED_SYNC_INTERVAL, WEB_WORKERS, log
+
+# Seconds between the leader's sweeps of call and result rows left past their deadline
+_SWEEP_INTERVAL = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shared (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class Cluster:
+    def __init__(self, path: str = SHARED_STATE_FILE, workers: int = WEB_WORKERS,
+                 interval: float = SHARED_SYNC_INTERVAL):
+        self.path = path
+        self.enabled = workers > 1
+        self.interval = interval
+        self.leader = False
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._lock_file = None
+        self._on_lead = None
+        self._thread = None
+        self._subscribers = {}
+        self._seen = {}
+        self._requested_at = {}
+        self._handlers = {}
+        self._calls = {}
+        self._calls_lock = threading.Lock()
+
+    @property
+    def following(self) -> bool:
+        """True in a worker that must leave upstream polling to the leader."""
+        return self.enabled and not self.leader
+
+    # ---------- Store ----------
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(_SCHEMA)
+        return db
+
+    def _execute(self, sql: str, params: tuple = ()) -> tuple:
+        """Run ``sql`` on the connection shared by request threads; returns (rows, rowcount)."""
+        with self._db_lock:
+            if self._db is None:
+                self._db = self._connect()
+            cursor = self._db.execute(sql, params)
+            return cursor.fetchall(), cursor.rowcount
+
+    def put(self, key: str, value: dict, version: int = 0) -> bool:
+        """Store ``value`` unless the stored one has a higher (version, updated_at); True if written."""
+        _, written = self._execute(
+            "INSERT INTO shared (key, value, version, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, version = excluded.version, "
+            "updated_at = excluded.updated_at "
+            "WHERE (excluded.version, excluded.updated_at) > (shared.version, shared.updated_at)",
+            (key, json.dumps(value), version, value.get("updated_at", time.time())),
+        )
+        return written > 0
+
+    def get(self, key: str):
+        rows, _ = self._execute("SELECT value FROM shared WHERE key = ?", (key,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def delete(self, key: str) -> None:
+        self._execute("DELETE FROM shared WHERE key = ?", (key,))
+
+    def request(self, kind: str, every: float = 0, **details) -> None:
+        """Ask the leader for something (see ``subscribe``); at most once per ``every`` seconds."""
+        now = time.time()
+        if now - self._requested_at.get(kind, 0) < every:
+            return
+        self._requested_at[kind] = now
+        try:
+            self.put(kind, dict(details, at=now, pid=os.getpid()))
+        except sqlite3.Error as e:
+            log(f"Shared state: request {kind} failed: {e}")
+
+    def subscribe(self, key: str, callback) -> None:
+        """Call ``callback(value)`` from the sync thread whenever ``key`` changes in the store."""
+        self._subscribers.setdefault(key, []).append(callback)
+
+    def claim(self, key: str, value: dict, ttl: float) -> bool:
+        """Store ``value`` under ``key`` unless another claim younger than ``ttl`` seconds holds it."""
+        now = time.time()
+        _, written = self._execute(
+            "INSERT INTO shared (key, value, version, updated_at) VALUES (?, ?, 0, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at "
+            "WHERE shared.updated_at < ?",
+            (key, json.dumps(value), now, now - ttl),
+        )
+        return written > 0
+
+    def renew(self, key: str, claim_id: str) -> None:
+        """Keep the claim on ``key`` whose value has this ``id`` alive for another ttl."""
+        self._execute("UPDATE shared SET updated_at = ? WHERE key = ? AND json_extract(value, '$.id') = ?",
+                      (time.time(), key, claim_id))
+
+    def release(self, key: str, claim_id: str) -> None:
+        """Drop the claim on ``key``, if it is still the one with this ``id``."""
+        self._execute("DELETE FROM shared WHERE key = ? AND json_extract(value, '$.id') = ?", (key, claim_id))
+
+    # ---------- Calls to the leader ----------
+
+    def serve(self, kind: str, handler) -> None:
+        """As the leader, answer ``call(kind, ...)`` with ``handler(payload)``, which returns a Future."""
+        self._handlers[kind] = handler
+
+    def call(self, kind: str, payload: dict, timeout: float) -> Future:
+        """Have the leader run ``kind`` with ``payload``; the Future gets the handler's result.
+
+        If no answer comes within ``timeout`` seconds (e.g. the leader died
+        mid-call), it gets ``{"ok": False, "error": ...}``. The call is then
+        withdrawn, and a leader that only gets to it later doesn't run it.
+        """
+        call_id = uuid.uuid4().hex
+        future = Future()
+        with self._calls_lock:
+            self._calls[call_id] = future
+        timer = threading.Timer(timeout, self._expire, (call_id,))
+        timer.daemon = True
+        timer.start()
+        future.add_done_callback(lambda f: timer.cancel())
+        now = time.time()
+        try:
+            self.put(f"call:{call_id}", dict(payload=payload, kind=kind, pid=os.getpid(),
+                                             deadline=now + timeout, updated_at=now))
+        except sqlite3.Error as e:
+            self._answer(call_id, {"ok": False, "error": str(e)})
+        return future
+
+    def _expire(self, call_id: str) -> None:
+        """``call`` timed out: fail it and remove its rows, answered or not."""
+        self._answer(call_id, {"ok": False, "error": "no answer from the leader"})
+        try:
+            self._execute("DELETE FROM shared WHERE key IN (?, ?)", (f"call:{call_id}", f"result:{call_id}"))
+        except sqlite3.Error as e:
+            log(f"Shared state: withdrawing call {call_id} failed: {e}")
+
+    def _answer(self, call_id: str, result: dict) -> None:
+        with self._calls_lock:
+            future = self._calls.pop(call_id, None)
+        if future is not None:
+            future.set_result(result)
+
+    def _handle_call(self, call_id: str, request: dict) -> None:
+        """Leader side of ``call``: run the handler and write its result for the caller."""
+        self.delete(f"call:{call_id}")
+        deadline = request["deadline"]
+        if time.time() >= deadline:
+            # The caller has already reported it as failed.
+            log(f"Shared state: call {call_id} ({request['kind']}) expired before it ran; dropped")
+            return
+
+        def reply(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"ok": False, "error": str(e)}
+            if time.time() >= deadline:
+                log(f"Shared state: call {call_id} ({request['kind']}) finished after its caller gave up")
+                return
+            try:
+                self.put(f"result:{call_id}", dict(result=result, deadline=deadline, updated_at=time.time()))
+            except sqlite3.Error as e:
+                log(f"Shared state: answering call {call_id} failed: {e}")
+
+        handler = self._handlers.get(request["kind"])
+        if handler is None:
+            future = Future()
+            future.set_result({"ok": False, "error": f"no handler for {request['kind']}"})
+        else:
+            future = handler(request["payload"])
+        future.add_done_callback(reply)
+
+    # ---------- Leader election and sync ----------
+
+    def _try_lead(self) -> bool:
+        handle = open(self.path + ".leader", "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._lock_file = handle
+        return True
+
+    def start(self, on_lead) -> None:
+        """Join the cluster; ``on_lead()`` runs once if and when this worker becomes the leader."""
+        if self._thread is not None:
+            return
+        self._on_lead = on_lead
+        self._execute("SELECT 1")
+        self._thread = threading.Thread(target=self._run, name="shared-state", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        # Its own connection: data_version only changes for commits made by other connections.
+        db = self._connect()
+        seen_version = None
+        swept_at = time.monotonic()
+        while True:
+            if not self.leader and self._try_lead():
+                self.leader = True
+                log(f"Worker {os.getpid()} is the leader; polling upstream for all workers")
+                # Go through every row again, e.g. calls the old leader left unanswered.
+                self._seen.clear()
+                seen_version = None
+                try:
+                    self._on_lead()
+                except Exception as e:
+                    log(f"Shared state: starting leader duties failed: {e}")
+            try:
+                version = db.execute("PRAGMA data_version").fetchone()[0]
+                if version != seen_version:
+                    seen_version = version
+                    self._sync(db)
+                if self.leader and time.monotonic() - swept_at >= _SWEEP_INTERVAL:
+                    swept_at = time.monotonic()
+                    self._sweep()
+            except sqlite3.Error as e:
+                log(f"Shared state sync failed: {e}")
+            time.sleep(self.interval)
+
+    def _sync(self, db: sqlite3.Connection) -> None:
+        """Hand every changed row to its subscribers, and calls and results to ``call``/``serve``."""
+        rows = db.execute("SELECT key, value FROM shared").fetchall()
+        for key in set(self._seen) - {key for key, _ in rows}:
+            del self._seen[key]
+        for key, raw in rows:
+            if self._seen.get(key) == raw:
+                continue
+            self._seen[key] = raw
+            value = json.loads(raw)
+            kind, _, call_id = key.partition(":")
+            try:
+                if kind == "call" and self.leader:
+                    self._handle_call(call_id, value)
+                elif kind == "result" and call_id in self._calls:
+                    self.delete(key)
+                    self._answer(call_id, value["result"])
+            except Exception as e:
+                log(f"Shared state: handling {key} failed: {e}")
+            for callback in self._subscribers.get(key, ()):
+                try:
+                    callback(value)
+                except Exception as e:
+                    log(f"Shared state: applying {key} failed: {e}")
+
+    def _sweep(self) -> None:
+        """Drop calls and results whose caller has given up (e.g. a result written as it timed out)."""
+        _, dropped = self._execute(
+            "DELETE FROM shared WHERE (key LIKE 'call:%' OR key LIKE 'result:%') "
+            "AND json_extract(value, '$.deadline') < ?", (time.time(),))
+        if dropped:
+            log(f"Shared state: dropped {dropped} expired call(s) and result(s)")
+
+    def stats(self) -> dict:
+        return {"workers": WEB_WORKERS, "pid": os.getpid(), "leader": self.leader if self.enabled else None}
+
+
+cluster = Cluster()
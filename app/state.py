@@ -0,0 +1,227 @@
+"""Authoritative in-memory state per TV, with optimistic updates.
+
+Each group member has a ``DeviceState``: power, mute, foreground app, when
+upstream last confirmed it, and a version that goes up on every change.
+Status polls and webhook events *confirm* state. A mute command changes it
+*optimistically*: the expected value is published at once and held until
+the command has been answered plus ``STATE_SETTLE`` seconds, so a poll that
+still reports the old value (SmartThings status lags behind commands) can't
+flip it back. A failed command rolls back to the last confirmed value. After
+the hold, upstream wins; when it disagrees with what we expected, the state
+is corrected and the disagreement is logged and counted.
+
+Readings that missed their deadline (``UNKNOWN``) leave the last known value
+in place; ``confirmed_at`` shows how old it is.
+"""
+import threading
+import time
+
+from . import metrics
+from .config import STATE_SETTLE, log
+
+# Marker for a field whose upstream missed the fetch deadline (re-exported by app/status.py).
+UNKNOWN = "unknown"
+# Seconds another worker holds a value whose command hasn't been answered yet
+_INFLIGHT_HOLD = 30
+
+reconciliations = metrics.Counter(
+    "state_reconciliations_total", "Optimistic values upstream disagreed with, by field.", ("field",))
+metrics.register(reconciliations)
+
+
+class DeviceState:
+    def __init__(self, name: str, device_id: str = None):
+        self.name = name
+        self.device_id = device_id
+        self.power = UNKNOWN
+        self.mute = UNKNOWN
+        self.app = UNKNOWN
+        self.confirmed_mute = UNKNOWN
+        self.confirmed_at = None
+        self._confirmed_clock = 0.0
+        self.version = 0
+        # Optimistic mute: commands not yet answered, and the hold after the last one
+        self.inflight = 0
+        self.hold_until = 0.0
+        self.optimistic = False
+
+    @property
+    def held(self) -> bool:
+        return self.inflight > 0 or time.monotonic() < self.hold_until
+
+    @property
+    def tv_status(self) -> str:
+        """The combined 'off' / 'muted' / 'unmuted' / 'unavailable' / UNKNOWN used by snapshots."""
+        if self.power == "on":
+            return self.mute if self.mute != UNKNOWN else "unmuted"
+        return self.power
+
+    def to_dict(self) -> dict:
+        return {
+            "power": self.power,
+            "mute": self.mute,
+            "app": self.app,
+            "confirmed_at": self.confirmed_at,
+            "version": self.version,
+            "pending": self.held,
+        }
+
+    def export(self) -> dict:
+        """Everything another worker needs to take this state over (see ``StateModel.adopt``)."""
+        if self.inflight:
+            # Its outcome will be exported when it settles.
+            held_for = _INFLIGHT_HOLD
+        else:
+            held_for = max(0.0, self.hold_until - time.monotonic())
+        return dict(self.to_dict(), device_id=self.device_id, confirmed_mute=self.confirmed_mute,
+                    optimistic=self.optimistic, held_until=time.time() + held_for if held_for else 0)
+
+
+class StateModel:
+    def __init__(self, settle: float = STATE_SETTLE):
+        self.settle = settle
+        # Start from the clock so versions keep increasing across restarts.
+        self.version = int(time.time() * 1000)
+        self._states = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def _state(self, name: str, device_id: str = None) -> DeviceState:
+        state = self._states.get(name)
+        if state is None:
+            state = self._states[name] = DeviceState(name, device_id)
+        elif device_id:
+            state.device_id = device_id
+        return state
+
+    def _bump(self, state: DeviceState) -> None:
+        self.version += 1
+        state.version = self.version
+
+    def _notify(self) -> None:
+        for listener in self._listeners:
+            listener()
+
+    def add_listener(self, callback) -> None:
+        """Call ``callback()`` after an optimistic change or rollback (not after readings)."""
+        self._listeners.append(callback)
+
+    # ---------- Upstream readings ----------
+
+    def observe(self, name: str, device_id: str, tv_status: str, active_app) -> DeviceState:
+        """Apply a status reading for one TV; returns its (possibly held) state."""
+        with self._lock:
+            state = self._state(name, device_id)
+            changed = False
+            if tv_status != UNKNOWN:
+                power = "on" if tv_status in ("muted", "unmuted") else tv_status
+                changed |= power != state.power
+                state.power = power
+                state.confirmed_at = time.time()
+                state._confirmed_clock = time.monotonic()
+                if power == "on":
+                    state.confirmed_mute = tv_status
+                    if not state.held and state.mute != tv_status:
+                        if state.optimistic:
+                            reconciliations.inc("mute")
+                            log(f"State of {name}: expected {state.mute}, TV reports {tv_status}; corrected")
+                        state.mute = tv_status
+                        changed = True
+                    if not state.held:
+                        state.optimistic = False
+            if active_app != UNKNOWN and active_app != state.app:
+                state.app = active_app
+                changed = True
+            if changed:
+                self._bump(state)
+            return state
+
+    # ---------- Optimistic changes ----------
+
+    def expect_mute(self, name: str, value: str = None):
+        """Show ``value`` ('muted'/'unmuted', or the opposite of the current one) until the command settles.
+
+        Returns the value now shown, or None if the TV's state isn't known.
+        """
+        with self._lock:
+            state = self._state(name)
+            state.inflight += 1
+            if state.power != "on" or state.mute == UNKNOWN:
+                return None
+            state.mute = value or ("unmuted" if state.mute == "muted" else "muted")
+            state.optimistic = True
+            self._bump(state)
+            shown = state.mute
+        self._notify()
+        return shown
+
+    def settle_mute(self, name: str, result: dict) -> None:
+        """Apply a command queue result (see app/commands.py) to an optimistic change."""
+        with self._lock:
+            state = self._state(name)
+            state.inflight = max(0, state.inflight - 1)
+            if state.inflight:
+                return  # a later command decides
+            previous = state.mute
+            if not result.get("ok"):
+                log(f"Mute command for {name} failed; back to {state.confirmed_mute}")
+                state.mute = state.confirmed_mute
+                state.optimistic = False
+            else:
+                if result.get("command") in ("mute", "unmute"):
+                    state.mute = "muted" if result["command"] == "mute" else "unmuted"
+                state.hold_until = time.monotonic() + self.settle
+            changed = state.mute != previous
+            if changed:
+                self._bump(state)
+        if changed:
+            self._notify()
+
+    # ---------- Other workers ----------
+
+    def export(self) -> dict:
+        with self._lock:
+            return {name: state.export() for name, state in self._states.items()}
+
+    def adopt(self, devices: dict, version: int) -> bool:
+        """Take over states another worker changed (app/shared.py); True if any was newer."""
+        changed = False
+        with self._lock:
+            self.version = max(self.version, version)
+            for name, shared in devices.items():
+                state = self._state(name, shared.get("device_id"))
+                # Readings that changed nothing don't bump the version but still count as confirmation.
+                if shared["confirmed_at"] and shared["confirmed_at"] > (state.confirmed_at or 0):
+                    state.confirmed_mute = shared["confirmed_mute"]
+                    state.confirmed_at = shared["confirmed_at"]
+                    state._confirmed_clock = time.monotonic() - (time.time() - shared["confirmed_at"])
+                if shared["version"] <= state.version:
+                    continue
+                state.power, state.mute, state.app = shared["power"], shared["mute"], shared["app"]
+                state.optimistic = shared["optimistic"]
+                state.version = shared["version"]
+                state.hold_until = time.monotonic() + max(0.0, shared["held_until"] - time.time())
+                changed = True
+        return changed
+
+    # ---------- Readers ----------
+
+    def get(self, name: str):
+        with self._lock:
+            return self._states.get(name)
+
+    def confirmed_mute(self, device_id: str, max_age: float):
+        """(mute value, monotonic time) upstream last reported for ``device_id``, if recent enough."""
+        with self._lock:
+            for state in self._states.values():
+                if state.device_id == device_id and state.power == "on" \
+                        and time.monotonic() - state._confirmed_clock < max_age:
+                    return state.confirmed_mute, state._confirmed_clock
+        return None
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {name: state.to_dict() for name, state in self._states.items()}
+
+
+model = StateModel()
@@ -0,0 +1,480 @@
+"""Background device status poller with an in-memory snapshot.
+
+One thread polls SmartThings and the Roku on a fixed schedule. Requests read
+the last snapshot from memory; only the very first read (before any snapshot
+exists) waits on upstream, and concurrent waiters share that single fetch.
+Every reading passes through the state model (app/state.py), so snapshots
+carry optimistic values and a version.
+
+Each snapshot that changed something is also written to ``STATUS_FILE``
+(atomically, as the token file is). At startup the saved snapshot is loaded
+back, flagged stale, and the first poll replaces it; until then pages render
+the last known state instead of waiting on upstream.
+
+Under the multi-worker server only the leader polls; every worker publishes
+its snapshots to, and adopts newer ones from, the shared store, and
+followers pass poll and refresh requests to the leader (see app/shared.py).
+"""
+import json
+import os
+import threading
+import time
+from functools import partial
+
+from . import client
+from .config import (
+    REFRESH_WINDOW,
+    STATUS_DEADLINE,
+    STATUS_FILE,
+    STATUS_RECONCILE_INTERVAL,
+    STATUS_IDLE_AFTER,
+    STATUS_POLL_INTERVAL,
+    STATUS_STALE_AFTER,
+    log,
+)
+from .devices import get_roku_active_app, get_tv_status, refresh_smartthings_status
+from .groups import group, primary
+from .shared import cluster
+from .state import UNKNOWN, model
+
+# Webhook events stop counting as live after this many reconcile intervals without one
+EVENTS_LAPSE_INTERVALS = 3
+
+
+class RefreshCoordinator:
+    """Sends at most one SmartThings refresh command per ``window`` seconds.
+
+    Every caller gets a future for the refresh covering its request; callers
+    inside a window (or while a refresh is still running) share the same one.
+    """
+
+    def __init__(self, window: float = REFRESH_WINDOW, send=refresh_smartthings_status):
+        self.window = window
+        self._send = send
+        self._lock = threading.Lock()
+        self._future = None
+        self._issued_at = 0.0
+        self.issued = 0
+        self.coalesced = 0
+
+    def refresh(self):
+        """Return the future for the current window's refresh, starting one if due."""
+        with self._lock:
+            current = self._future
+            if current is not None and (not current.done() or time.monotonic() - self._issued_at < self.window):
+                self.coalesced += 1
+                return current
+            self.issued += 1
+            self._issued_at = time.monotonic()
+            self._future = client.executor.submit(self._send)
+            return self._future
+
+    def stats(self) -> dict:
+        return {"issued": self.issued, "coalesced": self.coalesced, "window": self.window}
+
+
+refresher = RefreshCoordinator()
+
+
+class StatusService:
+    def __init__(self, interval: float = STATUS_POLL_INTERVAL, stale_after: float = STATUS_STALE_AFTER,
+                 idle_after: float = STATUS_IDLE_AFTER, path: str = STATUS_FILE):
+        self.interval = interval
+        self.stale_after = stale_after
+        self.idle_after = idle_after
+        self.path = path
+        self._lock = threading.Lock()
+        self._saved = None
+        self._snapshot = self._load()
+        self._inflight = None
+        self._last_read = 0.0
+        self._wake = threading.Event()
+        self._poller = None
+        self._listeners = []
+        # Wall-clock times of the last webhook device event and of the last
+        # UNINSTALL (see ``event_driven``).
+        self._event_at = 0.0
+        self._events_stopped_at = 0.0
+        self._smartthings_polled_at = 0.0
+        self._polled_refresh = None
+        model.add_listener(self._publish_model)
+        self._adopted = threading.Condition()
+        cluster.subscribe("snapshot", self._adopt)
+        cluster.subscribe("poll", self._poll_requested)
+        cluster.subscribe("refresh", self._refresh_requested)
+        cluster.subscribe("read", self._read_elsewhere)
+        cluster.subscribe("events", self._adopt_events)
+
+    # ---------- Persistence ----------
+
+    def _load(self):
+        """The snapshot saved by the last run, flagged ``restored`` until a poll replaces it."""
+        try:
+            with open(self.path, "r") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not self._well_formed(saved):
+            log(f"Ignoring the malformed status snapshot in {self.path}")
+            return None
+        if set(saved["members"]) != {tv.name for tv in group}:
+            return None  # saved for a different TV_GROUP
+        try:
+            model.adopt(saved.pop("devices", {}), saved["version"])
+        except (AttributeError, KeyError, TypeError):
+            log(f"Ignoring the malformed device states in {self.path}")
+        self._saved = (saved["version"], saved["members"])
+        return dict(saved, restored=True)
+
+    @staticmethod
+    def _well_formed(saved) -> bool:
+        """Whether ``saved`` has the fields a snapshot is read by (the file may be old or hand-edited)."""
+        if not isinstance(saved, dict) or not isinstance(saved.get("members"), dict):
+            return False
+        if not isinstance(saved.get("version"), int) or not isinstance(saved.get("updated_at"), (int, float)):
+            return False
+        return all(isinstance(member, dict) and {"tv_status", "active_app"} <= member.keys()
+                   for member in saved["members"].values())
+
+    def _save(self, snapshot: dict) -> None:
+        """Write ``snapshot`` unless it only differs from the saved one by its time."""
+        if (snapshot["version"], snapshot["members"]) == self._saved:
+            return
+        self._saved = (snapshot["version"], snapshot["members"])
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(dict(snapshot, devices=model.export()), f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log(f"Saving the status snapshot failed: {e}")
+
+    # ---------- Upstream fetch ----------
+
+    def _smartthings_due(self) -> bool:
+        if not self.event_driven or self._snapshot is None:
+            return True
+        return time.time() - self._smartthings_polled_at >= STATUS_RECONCILE_INTERVAL
+
+    def _fetch(self) -> dict:
+        """Query every TV's SmartThings status and Roku app concurrently under one deadline."""
+        smartthings_due = self._smartthings_due()
+        if smartthings_due:
+            self._smartthings_polled_at = time.time()
+        calls = {}
+        for tv in group:
+            try:
+                calls[(tv.name, "active_app")] = partial(get_roku_active_app, tv.base_url)
+            except LookupError:
+                pass  # not discovered yet; the registry is searching for it
+            if smartthings_due and (tv.device_id or tv is primary):
+                calls[(tv.name, "tv_status")] = partial(get_tv_status, tv.device_id)
+        results, pending = client.fan_out(calls, STATUS_DEADLINE)
+
+        previous = (self._snapshot or {}).get("members", {})
+        members = {}
+        for tv in group:
+            if not tv.device_id and tv is not primary:
+                tv_status = "unavailable"
+            elif smartthings_due:
+                tv_status = results.get((tv.name, "tv_status"), UNKNOWN)
+            else:
+                tv_status = previous.get(tv.name, {}).get("tv_status", UNKNOWN)
+            members[tv.name] = {
+                "tv_status": tv_status,
+                "active_app": results.get((tv.name, "active_app"), UNKNOWN),
+            }
+        snapshot = self._with_members(members)
+        for key, future in pending.items():
+            log(f"Status field {key[1]} for {key[0]} missed the {STATUS_DEADLINE}s deadline")
+            future.add_done_callback(lambda f, key=key: self._late_result(snapshot, key, f))
+        return snapshot
+
+    @staticmethod
+    def _with_members(members: dict, base: dict = None) -> dict:
+        """Build a snapshot; the top-level fields mirror the primary TV.
+
+        A snapshot rebuilt from ``base`` keeps its time and its ``restored``
+        flag: only a poll makes a restored snapshot current.
+        """
+        snapshot = dict(members[primary.name], members=members, updated_at=time.time())
+        if base is not None:
+            snapshot["updated_at"] = base["updated_at"]
+            if base.get("restored"):
+                snapshot["restored"] = True
+        return snapshot
+
+    def _late_result(self, snapshot: dict, key: tuple, future) -> None:
+        """Fill in a field that finished after the deadline, if nothing newer replaced it."""
+        if future.exception() is not None:
+            return
+        with self._lock:
+            if self._snapshot is None or self._snapshot["updated_at"] != snapshot["updated_at"]:
+                return
+        name, field = key
+        members = dict(snapshot["members"])
+        members[name] = dict(members[name], **{field: future.result()})
+        self._store(self._with_members(members, snapshot))
+
+    def _store(self, snapshot: dict, observe: bool = True) -> None:
+        if observe:
+            # Upstream readings go through the state model, which may hold optimistic values.
+            members = {}
+            for tv in group:
+                reading = snapshot["members"][tv.name]
+                state = model.observe(tv.name, tv.device_id, reading["tv_status"], reading["active_app"])
+                members[tv.name] = {"tv_status": state.tv_status, "active_app": state.app}
+            snapshot = self._with_members(members, snapshot)
+        snapshot["version"] = model.version
+        with self._lock:
+            self._snapshot = snapshot
+        if cluster.enabled:
+            self._share(snapshot)
+        if not cluster.following:
+            # Only one writer; followers' changes reach the file via the leader's _adopt.
+            self._save(snapshot)
+        for listener in self._listeners:
+            listener(snapshot)
+
+    # ---------- Other workers ----------
+
+    def _share(self, snapshot: dict) -> None:
+        shared = dict(snapshot, devices=model.export())
+        try:
+            cluster.put("snapshot", shared, version=snapshot["version"])
+        except Exception as e:
+            log(f"Sharing the status snapshot failed: {e}")
+
+    def _adopt(self, shared: dict) -> None:
+        """Take a snapshot written by another worker if it is newer than ours."""
+        model.adopt(shared.pop("devices", {}), shared["version"])
+        with self._lock:
+            current = self._snapshot
+            if current is not None and \
+                    (current["version"], current["updated_at"]) >= (shared["version"], shared["updated_at"]):
+                return
+            self._snapshot = shared
+        if not cluster.following:
+            self._save(shared)
+        with self._adopted:
+            self._adopted.notify_all()
+        for listener in self._listeners:
+            listener(shared)
+
+    def _adopt_events(self, shared: dict) -> None:
+        self._event_at = max(self._event_at, shared["event_at"])
+        self._events_stopped_at = max(self._events_stopped_at, shared["stopped_at"])
+
+    def _share_events(self) -> None:
+        if not cluster.enabled:
+            return
+        try:
+            stored = cluster.get("events") or {"event_at": 0.0, "stopped_at": 0.0}
+            self._adopt_events(stored)
+            cluster.put("events", {"event_at": self._event_at, "stopped_at": self._events_stopped_at,
+                                   "updated_at": time.time()})
+        except Exception as e:
+            log(f"Sharing the webhook event state failed: {e}")
+
+    def _poll_requested(self, request: dict) -> None:
+        if cluster.leader:
+            self.poll_now(smartthings=request.get("smartthings", False))
+
+    def _refresh_requested(self, request: dict) -> None:
+        if cluster.leader:
+            self.request_refresh(poll=request.get("poll", True))
+
+    def _read_elsewhere(self, request: dict) -> None:
+        """A follower served a read; keep polling as if it had been served here."""
+        self._last_read = max(self._last_read, request["at"])
+        if cluster.leader and self.age() > self.interval:
+            self._wake.set()
+
+    def _update_via_leader(self, wait: bool) -> dict:
+        """Follower version of ``update``: ask the leader to poll and wait for its snapshot."""
+        seen = self._snapshot
+        cluster.request("poll", smartthings=True)
+        if wait:
+            with self._adopted:
+                self._adopted.wait_for(lambda: self._snapshot is not seen, STATUS_DEADLINE + 1)
+            if self._snapshot is None:
+                # No leader has published anything yet; don't keep the request waiting.
+                log("No shared status snapshot yet; fetching directly")
+                self._store(self._fetch())
+        return self._snapshot
+
+    def _publish_model(self) -> None:
+        """Re-publish the snapshot after an optimistic change or rollback in the state model."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return
+        members = {}
+        for name, member in snapshot["members"].items():
+            state = model.get(name)
+            members[name] = dict(member, tv_status=state.tv_status) if state is not None else member
+        self._store(self._with_members(members, snapshot), observe=False)
+
+    def reconcile_later(self, delay: float) -> None:
+        """Poll SmartThings once optimistic values stop being held, so upstream can correct them."""
+        timer = threading.Timer(delay, self.poll_now, kwargs={"smartthings": True})
+        timer.daemon = True
+        timer.start()
+
+    def apply_device_event(self, capability: str, attribute: str, value, device_id: str = None) -> None:
+        """Apply a pushed SmartThings device event (switch or audioMute) to the snapshot."""
+        self._event_at = time.time()
+        self._share_events()
+        snapshot = self._snapshot
+        tv = next((tv for tv in group if tv.device_id == device_id), primary)
+        if snapshot is None:
+            self.poll_now()
+            return
+        status = snapshot["members"][tv.name]["tv_status"]
+        if (capability, attribute) == ("switch", "switch"):
+            if value != "on":
+                status = "off"
+            elif status not in ("muted", "unmuted"):
+                # Powered on, but the mute state is unknown until the next poll.
+                self.poll_now(smartthings=True)
+                return
+        elif (capability, attribute) == ("audioMute", "mute"):
+            if status == "off":
+                return
+            status = "muted" if value == "muted" else "unmuted"
+        else:
+            return
+        log(f"SmartThings event {capability}.{attribute}={value}; {tv.name} status now {status}")
+        members = dict(snapshot["members"])
+        members[tv.name] = dict(members[tv.name], tv_status=status)
+        self._store(dict(self._with_members(members, snapshot), updated_at=time.time()))
+
+    def stop_events(self) -> None:
+        """The SmartApp was uninstalled: go back to polling SmartThings on every cycle."""
+        self._events_stopped_at = time.time()
+        self._share_events()
+        self.poll_now(smartthings=True)
+
+    def update(self, wait: bool = True) -> dict:
+        """Fetch a new snapshot; callers arriving mid-fetch wait for the same one."""
+        if cluster.following:
+            return self._update_via_leader(wait)
+        with self._lock:
+            inflight = self._inflight
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight = threading.Event()
+        if leader:
+            try:
+                self._store(self._fetch())
+            finally:
+                with self._lock:
+                    self._inflight = None
+                inflight.set()
+        elif wait:
+            inflight.wait()
+        return self._snapshot
+
+    # ---------- Readers ----------
+
+    @property
+    def event_driven(self) -> bool:
+        """True while webhook events keep the TV state current.
+
+        SmartThings status is then only polled every STATUS_RECONCILE_INTERVAL
+        seconds. It lapses on UNINSTALL, and after ``EVENTS_LAPSE_INTERVALS``
+        reconcile intervals without an event, in case the subscription died.
+        """
+        return self._event_at > self._events_stopped_at and \
+            time.time() - self._event_at < EVENTS_LAPSE_INTERVALS * STATUS_RECONCILE_INTERVAL
+
+    @property
+    def ready(self) -> bool:
+        """True once a snapshot exists, i.e. reads no longer wait on upstream."""
+        return self._snapshot is not None
+
+    def age(self) -> float:
+        """Seconds since the last fetch, without counting as a read (for /metrics)."""
+        snapshot = self._snapshot
+        return time.time() - snapshot["updated_at"] if snapshot is not None else 0.0
+
+    def snapshot(self) -> dict:
+        """Return the last snapshot with its age and a staleness flag."""
+        self._last_read = time.time()
+        if cluster.following:
+            # Keeps the leader polling; it also wakes the leader's poller if the snapshot is old.
+            cluster.request("read", every=1)
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = self.update()
+        age = time.time() - snapshot["updated_at"]
+        if age > self.interval and not cluster.following:
+            if self._poller is not None:
+                self._wake.set()
+            else:
+                snapshot = self.update()
+                age = time.time() - snapshot["updated_at"]
+        return dict(snapshot, age=age, stale=age > self.stale_after or snapshot.get("restored", False))
+
+    def tv_status(self) -> str:
+        """Cached equivalent of ``get_tv_status()``."""
+        return self.snapshot()["tv_status"]
+
+    def active_app(self) -> dict:
+        """Cached equivalent of ``get_roku_active_app()``."""
+        return self.snapshot()["active_app"]
+
+    def poll_now(self, smartthings: bool = False) -> None:
+        """Poll in the background without waiting, e.g. after a command changed state.
+
+        With ``smartthings``, SmartThings is polled even if device events made it due later.
+        """
+        if cluster.following:
+            cluster.request("poll", smartthings=smartthings)
+            return
+        if smartthings:
+            self._smartthings_polled_at = 0.0
+        self._wake.set()
+
+    def request_refresh(self, poll: bool = True) -> None:
+        """Ask SmartThings to refresh device state (debounced); with ``poll``, poll once it lands."""
+        if self.event_driven:
+            # Device events already keep the state current.
+            return
+        if cluster.following:
+            cluster.request("refresh", every=1, poll=poll)
+            return
+        future = refresher.refresh()
+        # Poll once per refresh, not once per caller sharing it (it may be done already).
+        if poll and future is not self._polled_refresh:
+            self._polled_refresh = future
+            future.add_done_callback(lambda f: self.poll_now())
+
+    def add_listener(self, callback) -> None:
+        """Call ``callback(snapshot)`` after every successful fetch."""
+        self._listeners.append(callback)
+
+    # ---------- Poller ----------
+
+    def start(self) -> None:
+        if self._poller is not None:
+            return
+        if self._snapshot is not None and self._snapshot.get("restored"):
+            # Revalidate the saved snapshot right away.
+            self._wake.set()
+        self._poller = threading.Thread(target=self._poll_loop, name="status-poller", daemon=True)
+        self._poller.start()
+
+    def _poll_loop(self) -> None:
+        while True:
+            woken = self._wake.wait(self.interval)
+            self._wake.clear()
+            # Nobody is looking at the page; skip the timed poll until someone does.
+            if not woken and time.time() - self._last_read > self.idle_after:
+                continue
+            try:
+                self.update(wait=False)
+            except Exception as e:
+                log(f"Status poll failed: {e}")
+
+
+status_service = StatusService()
@@ -0,0 +1,65 @@
+// App shell service worker; rendered by the /sw.js route.
+// Hashed assets never change, so they are served cache-first. The page itself
+// is served from cache immediately and refreshed in the background; live TV
+// state always comes from the network (/events, /tv-status).
+const CACHE = 'shell-{{ version }}';
+const ASSETS = {{ assets | tojson }};
+
+self.addEventListener('install', (event) => {
+    event.waitUntil(
+        caches.open(CACHE)
+            .then((cache) => cache.addAll(['/', ...ASSETS]))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil(
+        caches.keys()
+            .then((keys) => Promise.all(keys.filter((key) => key !== CACHE).map((key) => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    if (request.method !== 'GET') {
+        return;
+    }
+    const url = new URL(request.url);
+    if (url.origin !== self.location.origin) {
+        return;
+    }
+
+    if (url.pathname.startsWith('/assets/')) {
+        event.respondWith(
+            caches.match(request).then((cached) => cached || fetch(request).then((resp) => {
+                if (resp.ok) {
+                    const copy = resp.clone();
+                    caches.open(CACHE).then((cache) => cache.put(request, copy));
+                }
+                return resp;
+            }))
+        );
+        return;
+    }
+
+    if (request.mode === 'navigate' && url.pathname === '/') {
+        const network = fetch(request).then((resp) => {
+            if (resp.ok) {
+                const copy = resp.clone();
+                caches.open(CACHE).then((cache) => cache.put('/', copy));
+            }
+            return resp;
+        });
+        event.respondWith(
+            caches.match('/').then((cached) => {
+                if (cached) {
+                    event.waitUntil(network.catch(() => {}));
+                    return cached;
+                }
+                return network;
+            })
+        );
+    }
+});
@@ -0,0 +1,165 @@
+"""Process-wide SmartThings OAuth token manager.
+
+Tokens are kept in memory after the first read of ``TOKEN_FILE``. Refreshes are
+single-flight: one thread does the OAuth round trip while the others wait on
+the same lock and reuse its result. An exclusive file lock next to the token
+file keeps the web app and the cron script from refreshing (and rotating the
+refresh token) at the same time.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from . import client
+from .config import (
+    OAUTH_TOKEN_URL,
+    SMARTTHINGS_CLIENT_ID,
+    SMARTTHINGS_CLIENT_SECRET,
+    TOKEN_FILE,
+    TOKEN_RENEW_AHEAD,
+    log,
+    smartthings_config_ok,
+)
+
+LOCK_FILE = TOKEN_FILE + ".lock"
+
+
+def _load_tokens() -> dict:
+    if not smartthings_config_ok():
+        raise RuntimeError("SmartThings config missing")
+    if not os.path.exists(TOKEN_FILE):
+        raise RuntimeError(f"Token file not found: {TOKEN_FILE}")
+    with open(TOKEN_FILE, "r") as f:
+        return json.load(f)
+
+def _save_tokens(tokens: dict) -> None:
+    tmp = TOKEN_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(tokens, f)
+    os.replace(tmp, TOKEN_FILE)
+    try:
+        os.chmod(TOKEN_FILE, 0o600)
+    except Exception:
+        # Best effort; not fatal if chmod fails on some platforms
+        pass
+
+def _refresh_tokens(refresh_token: str) -> dict:
+    """Refresh SmartThings OAuth token using Basic auth."""
+    log("Refreshing SmartThings token…")
+    resp = client.smartthings.post(
+        OAUTH_TOKEN_URL,
+        auth=(SMARTTHINGS_CLIENT_ID, SMARTTHINGS_CLIENT_SECRET),
+        data={"grant_type": "refresh_token", "refresh_token": refresh_token},
+        timeout=15,
+        op="token",
+    )
+    if resp.status_code != 200:
+        raise RuntimeError(f"SmartThings refresh failed: {resp.status_code} {resp.text}")
+    data = resp.json()
+    return {
+        "access_token": data["access_token"],
+        "refresh_token": data.get("refresh_token", refresh_token),
+        "expires_at": time.time() + int(data.get("expires_in", 3600)),
+    }
+
+def is_fresh(tokens: dict, margin: float = 60) -> bool:
+    # Refresh a bit early to avoid clock skew
+    return tokens.get("expires_at", 0) > time.time() + margin
+
+@contextmanager
+def _file_lock():
+    """Exclusive lock shared with other processes using the same token file."""
+    with open(LOCK_FILE, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class TokenManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens = None
+        self._wake = threading.Event()
+        self._renewer = None
+
+    def cached(self):
+        """The in-memory tokens, or None before the first load."""
+        return self._tokens
+
+    def adopt(self, tokens: dict) -> None:
+        """Install tokens refreshed elsewhere (e.g. by the async engine)."""
+        self._tokens = tokens
+        self._wake.set()
+
+    def _refresh_locked(self, stale_token: str = None) -> dict:
+        """Refresh under both locks; caller holds ``self._lock``."""
+        with _file_lock():
+            # Another process may have refreshed (and rotated the refresh token).
+            on_disk = _load_tokens()
+            if on_disk.get("access_token") != stale_token and is_fresh(on_disk):
+                self._tokens = on_disk
+                return on_disk
+            tokens = _refresh_tokens(on_disk["refresh_token"])
+            _save_tokens(tokens)
+        self._tokens = tokens
+        self._wake.set()
+        return tokens
+
+    def access_token(self) -> str:
+        """Return a valid access token, refreshing it at most once across threads."""
+        tokens = self._tokens
+        if tokens is not None and is_fresh(tokens):
+            return tokens["access_token"]
+        with self._lock:
+            if self._tokens is None:
+                self._tokens = _load_tokens()
+            if not is_fresh(self._tokens):
+                self._refresh_locked(self._tokens.get("access_token"))
+            return self._tokens["access_token"]
+
+    def ensure_fresh(self, margin: float) -> None:
+        """Refresh now unless the token stays valid for ``margin`` more seconds."""
+        with self._lock:
+            if self._tokens is None:
+                self._tokens = _load_tokens()
+            if not is_fresh(self._tokens, margin):
+                self._refresh_locked(self._tokens.get("access_token"))
+
+    def force_refresh(self, rejected_token: str) -> str:
+        """Replace a token the API rejected; concurrent callers share one refresh."""
+        with self._lock:
+            if self._tokens is not None and self._tokens.get("access_token") != rejected_token:
+                return self._tokens["access_token"]
+            return self._refresh_locked(rejected_token)["access_token"]
+
+    # ---------- Background renewal ----------
+
+    def start_renewal(self) -> None:
+        """Renew the token ``TOKEN_RENEW_AHEAD`` seconds before it expires."""
+        if self._renewer is not None or not smartthings_config_ok():
+            return
+        self._renewer = threading.Thread(target=self._renew_loop, name="token-renewal", daemon=True)
+        self._renewer.start()
+
+    def _renew_loop(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                with self._lock:
+                    if self._tokens is None:
+                        self._tokens = _load_tokens()
+                    if not is_fresh(self._tokens, TOKEN_RENEW_AHEAD):
+                        self._refresh_locked(self._tokens.get("access_token"))
+                delay = self._tokens["expires_at"] - TOKEN_RENEW_AHEAD - time.time()
+            except Exception as e:
+                log(f"Background token renewal failed: {e}")
+                delay = 60
+            self._wake.wait(max(delay, 30))
+
+
+manager = TokenManager()
@@ -0,0 +1,272 @@
+"""SmartThings SmartApp webhook: lifecycle handling and device event intake.
+
+SmartThings POSTs signed lifecycle requests to ``/smartthings/webhook``. On
+INSTALL/UPDATE we subscribe to the TV's ``switch`` and ``audioMute``
+attributes; each EVENT is then applied straight to the in-memory status
+snapshot, so the page updates without waiting for a poll.
+
+Requests are authenticated with HTTP Signatures. SmartThings signs with
+``rsa-sha256`` and a key published under ``SMARTTHINGS_KEY_URL``; local tools
+(``scripts/fake_smartthings_events.py``) sign with ``hmac-sha256`` using
+``SMARTTHINGS_WEBHOOK_SECRET``.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import re
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+
+from . import client
+from .breaker import smartthings_breaker
+from .config import (
+    API_BASE,
+    SMARTTHINGS_KEY_URL,
+    SMARTTHINGS_TV_DEVICE_ID,
+    SMARTTHINGS_WEBHOOK_SECRET,
+    log,
+)
+from .groups import group
+from .status import status_service
+
+# Reject signed requests whose Date is further than this from our clock
+MAX_CLOCK_SKEW = 300
+# (capability, attribute) pairs we subscribe to
+SUBSCRIPTIONS = [("switch", "switch"), ("audioMute", "mute")]
+# Signing key ids as SmartThings publishes them, e.g. /pl/useast1/1f-2e-...
+KEY_ID = re.compile(r"^/pl/[a-z0-9-]{1,32}/[0-9a-f]{2}(-[0-9a-f]{2}){1,63}$")
+# A key id that could not be fetched isn't tried again for this many seconds
+KEY_RETRY_AFTER = 600
+# Least time between two signing key fetches, whatever the key id
+KEY_FETCH_INTERVAL = 5
+
+_keys = {}
+_failed_keys = {}
+_last_key_fetch = 0.0
+_keys_lock = threading.Lock()
+
+# ---------- HTTP Signatures ----------
+
+def _digest(body: bytes) -> str:
+    return "SHA-256=" + base64.b64encode(hashlib.sha256(body).digest()).decode()
+
+def _parse_signature(header: str) -> dict:
+    if not header.startswith("Signature "):
+        return {}
+    params = {}
+    for part in header[len("Signature "):].split(","):
+        key, _, value = part.strip().partition("=")
+        params[key] = value.strip('"')
+    return params
+
+def _signing_string(names: list, method: str, target: str, headers) -> str:
+    lines = []
+    for name in names:
+        if name == "(request-target)":
+            lines.append(f"(request-target): {method.lower()} {target}")
+        else:
+            lines.append(f"{name}: {headers[name]}")
+    return "\n".join(lines)
+
+def _public_key(key_id: str):
+    """The signing key ``key_id``, fetched once; raises LookupError if it can't be had.
+
+    Anyone can send a keyId, so failed ids are remembered for ``KEY_RETRY_AFTER``
+    seconds and fetches are spaced ``KEY_FETCH_INTERVAL`` apart.
+    """
+    global _last_key_fetch
+    with _keys_lock:
+        key = _keys.get(key_id)
+        if key is not None:
+            return key
+        now = time.monotonic()
+        if now - _failed_keys.get(key_id, -KEY_RETRY_AFTER) < KEY_RETRY_AFTER:
+            raise LookupError(f"signing key {key_id} failed to load recently")
+        if now - _last_key_fetch < KEY_FETCH_INTERVAL:
+            raise LookupError("signing key fetched too recently; not fetching another")
+        _last_key_fetch = now
+    try:
+        resp = client.smartthings.get(SMARTTHINGS_KEY_URL + key_id, timeout=10, op="signing-key")
+        resp.raise_for_status()
+        key = x509.load_pem_x509_certificate(resp.content).public_key()
+    except Exception:
+        with _keys_lock:
+            now = time.monotonic()
+            for expired in [k for k, at in _failed_keys.items() if now - at >= KEY_RETRY_AFTER]:
+                del _failed_keys[expired]
+            _failed_keys[key_id] = now
+        raise
+    with _keys_lock:
+        _keys[key_id] = key
+        _failed_keys.pop(key_id, None)
+    return key
+
+def verify_signature(method: str, target: str, headers, body: bytes) -> bool:
+    """Check the request's HTTP Signature, Digest and Date headers."""
+    params = _parse_signature(headers.get("Authorization", ""))
+    names = params.get("headers", "date").split()
+    if not params.get("signature") or "digest" not in names or "date" not in names:
+        return False
+    if headers.get("Digest") != _digest(body):
+        return False
+    try:
+        sent = parsedate_to_datetime(headers.get("Date", "")).timestamp()
+    except (TypeError, ValueError):
+        return False
+    if abs(time.time() - sent) > MAX_CLOCK_SKEW:
+        return False
+    if any(name != "(request-target)" and name not in headers for name in names):
+        return False
+
+    signing_string = _signing_string(names, method, target, headers).encode()
+    try:
+        signature = base64.b64decode(params.get("signature", ""), validate=True)
+    except (binascii.Error, ValueError):
+        return False
+    algorithm = params.get("algorithm", "rsa-sha256")
+    if algorithm == "hmac-sha256":
+        if not SMARTTHINGS_WEBHOOK_SECRET:
+            return False
+        expected = hmac.new(SMARTTHINGS_WEBHOOK_SECRET.encode(), signing_string, hashlib.sha256).digest()
+        return hmac.compare_digest(expected, signature)
+    if algorithm == "rsa-sha256" and KEY_ID.match(params.get("keyId", "")):
+        try:
+            _public_key(params["keyId"]).verify(signature, signing_string, padding.PKCS1v15(), hashes.SHA256())
+            return True
+        except InvalidSignature:
+            return False
+        except Exception as e:
+            log(f"Could not verify SmartThings signature: {e}")
+    return False
+
+def sign_request(method: str, target: str, body: bytes, secret: str) -> dict:
+    """Headers for an hmac-sha256 signed request (used by local test tools)."""
+    headers = {"Date": formatdate(usegmt=True), "Digest": _digest(body)}
+    names = ["(request-target)", "digest", "date"]
+    signing_string = _signing_string(names, method, target, {"digest": headers["Digest"], "date": headers["Date"]})
+    signature = base64.b64encode(hmac.new(secret.encode(), signing_string.encode(), hashlib.sha256).digest()).decode()
+    headers["Authorization"] = (
+        f'Signature keyId="local",signature="{signature}",'
+        f'headers="{" ".join(names)}",algorithm="hmac-sha256"'
+    )
+    return headers
+
+# ---------- Lifecycle handlers ----------
+
+def _configuration(data: dict) -> dict:
+    if data.get("phase") == "INITIALIZE":
+        return {"configurationData": {"initialize": {
+            "name": "One-Touch CNN",
+            "description": "Push TV power and mute changes to One-Touch CNN",
+            "id": "one-touch-cnn",
+            "permissions": ["r:devices:*"],
+            "firstPageId": "1",
+        }}}
+    return {"configurationData": {"page": {
+        "pageId": "1",
+        "name": "Choose your TV",
+        "complete": True,
+        "sections": [{"settings": [{
+            "id": "tv",
+            "name": "TV",
+            "type": "DEVICE",
+            "required": True,
+            "multiple": len(group) > 1,
+            "capabilities": ["switch", "audioMute"],
+            "permissions": ["r"],
+        }]}],
+    }}}
+
+def _field(data, *path, kind=object):
+    """``data[path[0]][path[1]]...`` of a request; ValueError if it is missing or not a ``kind``."""
+    for key in path:
+        if not isinstance(data, dict) or key not in data:
+            raise ValueError(f"missing {'.'.join(path)}")
+        data = data[key]
+    if not isinstance(data, kind):
+        raise ValueError(f"{'.'.join(path)} is not a {kind.__name__}")
+    return data
+
+def _subscribe(data: dict) -> None:
+    """Replace the installed app's subscriptions with switch/audioMute on the TV(s)."""
+    installed = _field(data, "installedApp", kind=dict)
+    app_id = _field(installed, "installedAppId", kind=str)
+    config = _field(installed, "config", kind=dict) if "config" in installed else {}
+    devices = _field(config, "tv", kind=list) if "tv" in config else []
+    device_ids = [_field(device, "deviceConfig", "deviceId", kind=str) for device in devices] or sorted(_group_devices())
+    url = f"{API_BASE}/installedapps/{app_id}/subscriptions"
+    headers = {"Authorization": f"Bearer {_field(data, 'authToken', kind=str)}"}
+
+    client.smartthings.request("DELETE", url, timeout=15, headers=headers, op="subscribe")
+    for index, device_id in enumerate(device_ids):
+        for capability, attribute in SUBSCRIPTIONS:
+            resp = client.smartthings.post(url, timeout=15, headers=headers, op="subscribe", json={
+                "sourceType": "DEVICE",
+                "device": {
+                    "deviceId": device_id,
+                    "componentId": "main",
+                    "capability": capability,
+                    "attribute": attribute,
+                    "stateChangeOnly": True,
+                    "subscriptionName": f"{capability}_{attribute}_{index}",
+                },
+            })
+            log(f"SmartThings subscription {capability}.{attribute} on {device_id}: {resp.status_code}")
+
+def _group_devices() -> set:
+    """SmartThings device ids of the TVs we track."""
+    return {tv.device_id for tv in group if tv.device_id} or {SMARTTHINGS_TV_DEVICE_ID}
+
+def _apply_events(events) -> None:
+    if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+        raise ValueError("eventData.events is not a list of objects")
+    for event in events:
+        if event.get("eventType") != "DEVICE_EVENT":
+            continue
+        device_event = _field(event, "deviceEvent", kind=dict)
+        device_id = device_event.get("deviceId")
+        if device_id not in _group_devices() or device_event.get("componentId", "main") != "main":
+            continue
+        if (device_event.get("capability"), device_event.get("value")) == ("switch", "on"):
+            smartthings_breaker(device_id).probe_soon()
+        status_service.apply_device_event(
+            device_event.get("capability"),
+            device_event.get("attribute"),
+            device_event.get("value"),
+            device_id=device_id,
+        )
+
+def handle_lifecycle(payload: dict) -> dict:
+    """Respond to one SmartApp lifecycle request; ValueError if it is malformed."""
+    if not isinstance(payload, dict):
+        raise ValueError("the request body is not a JSON object")
+    lifecycle = payload.get("lifecycle")
+    if lifecycle == "PING":
+        return {"pingData": {"challenge": _field(payload, "pingData", "challenge")}}
+    if lifecycle == "CONFIRMATION":
+        url = _field(payload, "confirmationData", "confirmationUrl", kind=str)
+        log("Confirming SmartThings webhook registration…")
+        client.smartthings.get(url, timeout=10, op="confirm")
+        return {"targetUrl": url}
+    if lifecycle == "CONFIGURATION":
+        return _configuration(_field(payload, "configurationData", kind=dict))
+    if lifecycle in ("INSTALL", "UPDATE"):
+        key = f"{lifecycle.lower()}Data"
+        _subscribe(_field(payload, key, kind=dict))
+        return {key: {}}
+    if lifecycle == "EVENT":
+        _apply_events(_field(payload, "eventData", kind=dict).get("events", []))
+        return {"eventData": {}}
+    if lifecycle == "UNINSTALL":
+        log("SmartThings webhook uninstalled; polling SmartThings status again")
+        status_service.stop_events()
+        return {"uninstallData": {}}
+    log(f"Ignoring SmartThings lifecycle {lifecycle!r}")
+    return {}
@@ -7,6 +7,15 @@ if [[ "$1" == "--auth" ]]; then
   exit $?
 fi
 
+if [[ "$1" == "--serve" ]]; then
+  # Production: WEB_WORKERS processes sharing one device state (see app/serve.py)
+  exec python3 -m app.serve
+fi
+
+if [[ "$1" == "--asgi" ]]; then
+  exec uvicorn --factory app:create_asgi_app --host 0.0.0.0 --port "${PORT:-${FLASK_RUN_PORT:-5050}}"
+fi
+
 if [[ -n "$PORT" ]]; then
   flask run --host=0.0.0.0 --port="$PORT"
 else
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Load-test the web app against local fake Roku and SmartThings servers.
+
+Starts the fakes from ``fake_upstreams.py``, starts the app (Flask, or
+uvicorn with --asgi) pointed at them with a throwaway HOME, then drives the
+chosen paths from N concurrent clients and reports p50/p95/p99 latency and
+requests per second per path, plus how many upstream calls the run caused.
+
+Usage:
+    python3 scripts/bench.py --clients 20 --duration 15
+    python3 scripts/bench.py --asgi --latency 150 --jitter 100 --error-503 0.1
+    python3 scripts/bench.py --workers 4     # the multi-process server (app/serve.py)
+    python3 scripts/bench.py --url http://127.0.0.1:5050 --paths /tv-status   # an already running app
+"""
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+from fake_upstreams import add_fault_arguments, faults_from, roku_server, serve, smartthings_server
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_PATHS = "/,/tv-status,/toggle-mute,/start-cnn"
+# Method per path; POSTs ask for JSON so they don't follow redirects.
+METHODS = {"/toggle-mute": "POST", "/start-cnn": "POST"}
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of already sorted ``values``."""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, math.ceil(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+def start_app(args, roku_port: int, smartthings_port: int, home: str) -> subprocess.Popen:
+    # Expired token: the app's first SmartThings call refreshes it against the fake.
+    # (A restart in the same HOME keeps the token the last run refreshed.)
+    token_file = os.path.join(home, ".smartthings_tokens.json")
+    if not os.path.exists(token_file):
+        with open(token_file, "w") as f:
+            json.dump({"access_token": "expired", "refresh_token": "bench", "expires_at": 0}, f)
+    env = dict(
+        os.environ,
+        HOME=home,
+        ROKU_IP="127.0.0.1",
+        ROKU_PORT=str(roku_port),
+        SMARTTHINGS_API_URL=f"http://127.0.0.1:{smartthings_port}",
+        SMARTTHINGS_CLIENT_ID="bench",
+        SMARTTHINGS_CLIENT_SECRET="bench",
+        SMARTTHINGS_TV_DEVICE_ID="bench-tv",
+        # Keep SSDP rediscovery off the LAN
+        SSDP_ADDRESS="127.0.0.1:9",
+        TV_GROUP="",
+    )
+    if args.workers:
+        command = [sys.executable, "-m", "app.serve", "--workers", str(args.workers),
+                   "--port", str(args.port), "--log-level", "warning"]
+    elif args.asgi:
+        command = [sys.executable, "-m", "uvicorn", "--factory", "app:create_asgi_app",
+                   "--port", str(args.port), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(args.port)]
+    log = open(os.path.join(home, "app.log"), "w")
+    return subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_for(url: str, timeout: float = 20) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/tv-status", timeout=5).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"App did not come up at {url}")
+
+
+def client_loop(url: str, paths: list, stop_at: float, offset: int, samples: list, lock) -> None:
+    """One client: cycle through ``paths`` until ``stop_at``, recording (path, seconds, status)."""
+    session = requests.Session()
+    local = []
+    i = offset
+    while time.monotonic() < stop_at:
+        path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            resp = session.request(METHODS.get(path, "GET"), url + path, timeout=30,
+                                   headers={"Accept": "application/json"} if path in METHODS else {})
+            status = resp.status_code
+        except requests.RequestException:
+            status = 0
+        local.append((path, time.perf_counter() - started, status))
+    with lock:
+        samples.extend(local)
+
+
+def run_load(url: str, paths: list, clients: int, duration: float) -> tuple:
+    samples, lock = [], threading.Lock()
+    stop_at = time.monotonic() + duration
+    threads = [threading.Thread(target=client_loop, args=(url, paths, stop_at, n, samples, lock))
+               for n in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+def summarize(samples: list, elapsed: float, paths: list) -> dict:
+    report = {}
+    for path in paths + ["all"]:
+        rows = [s for s in samples if path == "all" or s[0] == path]
+        latencies = sorted(seconds * 1000 for _, seconds, _ in rows)
+        report[path] = {
+            "requests": len(rows),
+            "errors": sum(not 200 <= status < 300 for _, _, status in rows),
+            "rps": len(rows) / elapsed if elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        }
+    return report
+
+
+def print_report(report: dict, upstream: dict) -> None:
+    print(f"{'path':<14}{'requests':>10}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for path, row in report.items():
+        print(f"{path:<14}{row['requests']:>10}{row['errors']:>8}{row['rps']:>10.1f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    for name, calls in upstream.items():
+        print(f"{name} upstream calls: " + (", ".join(f"{k}={v}" for k, v in sorted(calls.items())) or "none"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the app against fake upstreams")
+    parser.add_argument("--clients", type=int, default=10, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load")
+    parser.add_argument("--paths", default=DEFAULT_PATHS, help="Comma-separated paths to cycle through")
+    parser.add_argument("--asgi", action="store_true", help="Serve with uvicorn instead of Flask")
+    parser.add_argument("--workers", type=int, help="Serve with app/serve.py and this many worker processes")
+    parser.add_argument("--port", type=int, default=5099, help="Port for the app under test")
+    parser.add_argument("--url", help="Benchmark an already running app instead of starting one")
+    parser.add_argument("--json", help="Also write the report to this file")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    paths = [p.strip() for p in args.paths.split(",") if p.strip()]
+
+    roku_faults, smartthings_faults = faults_from(args)
+    roku = roku_server(("127.0.0.1", 0), roku_faults, ready=args.ready)
+    smartthings = smartthings_server(("127.0.0.1", 0), smartthings_faults)
+    serve(roku)
+    serve(smartthings)
+
+    app = None
+    url = args.url
+    with tempfile.TemporaryDirectory() as home:
+        try:
+            if url is None:
+                app = start_app(args, roku.server_address[1], smartthings.server_address[1], home)
+                url = f"http://127.0.0.1:{args.port}"
+            wait_for(url)
+            roku.calls.clear()
+            smartthings.calls.clear()
+            mode = ("external" if args.url else f"{args.workers} workers" if args.workers
+                    else "asgi" if args.asgi else "flask")
+            print(f"{args.clients} clients for {args.duration:.0f}s against {url} ({mode}); "
+                  f"upstream latency {args.latency:.0f}±{args.jitter:.0f} ms", flush=True)
+            samples, elapsed = run_load(url, paths, args.clients, args.duration)
+        finally:
+            if app is not None:
+                app.terminate()
+                app.wait(timeout=10)
+
+    report = summarize(samples, elapsed, paths)
+    upstream = {"roku": dict(roku.calls), "smartthings": dict(smartthings.calls)}
+    print_report(report, upstream)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "report": report, "upstream": upstream}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
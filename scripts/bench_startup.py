@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Measure how soon a freshly started app shows device state.
+
+Starts the fake upstreams from ``fake_upstreams.py``, then starts the app (as
+bench.py does) once from an empty HOME (cold: no saved status, catalog, Roku
+address or fresh token) and ``--runs`` more times in the same HOME (warm:
+everything the previous run saved). For each start it reports, from process
+start, when the first page was served, when /tv-status first had a known TV
+state and when that state had been revalidated upstream, plus the upstream
+calls made until the first known state.
+
+Usage:
+    python3 scripts/bench_startup.py --runs 3
+    python3 scripts/bench_startup.py --asgi --latency 400 --jitter 100
+"""
+import argparse
+import tempfile
+import time
+
+import requests
+
+from bench import start_app
+from fake_upstreams import add_fault_arguments, faults_from, roku_server, serve, smartthings_server
+
+# Give up on a start after this many seconds
+TIMEOUT = 30
+
+
+def until(started: float, check) -> float:
+    """Retry ``check()`` until it returns true; milliseconds since ``started``."""
+    deadline = time.monotonic() + TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return (time.perf_counter() - started) * 1000
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.01)
+    raise SystemExit(f"App did not get there within {TIMEOUT}s")
+
+
+def measure(args, roku, smartthings, home: str) -> dict:
+    url = f"http://127.0.0.1:{args.port}"
+
+    def status():
+        return requests.get(f"{url}/tv-status?refresh=0", timeout=TIMEOUT).json()
+
+    roku.calls.clear()
+    smartthings.calls.clear()
+    started = time.perf_counter()
+    app = start_app(args, roku.server_address[1], smartthings.server_address[1], home)
+    try:
+        first_page = until(started, lambda: requests.get(f"{url}/", timeout=TIMEOUT).ok)
+        known = until(started, lambda: status()["status"] != "unknown")
+        calls = sum(roku.calls.values()) + sum(smartthings.calls.values())
+        live = until(started, lambda: not status()["stale"])
+    finally:
+        app.terminate()
+        app.wait(timeout=10)
+    return {"first_page_ms": first_page, "known_state_ms": known, "live_state_ms": live, "upstream_calls": calls}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark app startup against fake upstreams")
+    parser.add_argument("--runs", type=int, default=3, help="Warm restarts after the cold start")
+    parser.add_argument("--asgi", action="store_true", help="Serve with uvicorn instead of Flask")
+    parser.add_argument("--port", type=int, default=5099, help="Port for the app under test")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    args.workers = None
+
+    roku_faults, smartthings_faults = faults_from(args)
+    roku = roku_server(("127.0.0.1", 0), roku_faults, ready=args.ready)
+    smartthings = smartthings_server(("127.0.0.1", 0), smartthings_faults)
+    serve(roku)
+    serve(smartthings)
+
+    print(f"{'start':<8}{'first page ms':>15}{'known state ms':>16}{'live state ms':>15}{'upstream calls':>16}")
+    with tempfile.TemporaryDirectory() as home:
+        for run in range(args.runs + 1):
+            row = measure(args, roku, smartthings, home)
+            print(f"{'cold' if run == 0 else 'warm':<8}{row['first_page_ms']:>15.0f}{row['known_state_ms']:>16.0f}"
+                  f"{row['live_state_ms']:>15.0f}{row['upstream_calls']:>16}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
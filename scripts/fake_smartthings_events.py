@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Send signed SmartThings-style webhook requests to a local One-Touch CNN server.
+
+Stands in for the SmartThings cloud when testing the webhook receiver. Requests
+are signed with hmac-sha256 using SMARTTHINGS_WEBHOOK_SECRET, which the server
+must share.
+
+Usage:
+    python3 scripts/fake_smartthings_events.py switch=on mute=muted
+    python3 scripts/fake_smartthings_events.py --ping
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import uuid
+from urllib.parse import urlparse
+
+import requests
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.config import SMARTTHINGS_TV_DEVICE_ID, SMARTTHINGS_WEBHOOK_SECRET  # noqa: E402
+from app.webhook import sign_request  # noqa: E402
+
+# Shorthand on the command line -> (capability, attribute)
+ATTRIBUTES = {
+    "switch": ("switch", "switch"),
+    "mute": ("audioMute", "mute"),
+}
+
+
+def _event_payload(device_id: str, changes: list) -> dict:
+    events = []
+    for change in changes:
+        name, _, value = change.partition("=")
+        capability, attribute = ATTRIBUTES[name]
+        events.append({
+            "eventType": "DEVICE_EVENT",
+            "deviceEvent": {
+                "eventId": str(uuid.uuid4()),
+                "deviceId": device_id,
+                "componentId": "main",
+                "capability": capability,
+                "attribute": attribute,
+                "value": value,
+                "stateChange": True,
+            },
+        })
+    return {"lifecycle": "EVENT", "eventData": {"events": events}}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake SmartThings webhook sender")
+    parser.add_argument("changes", nargs="*", help="Attribute changes, e.g. switch=off mute=unmuted")
+    parser.add_argument("--url", default="http://localhost:5050/smartthings/webhook")
+    parser.add_argument("--device", default=SMARTTHINGS_TV_DEVICE_ID)
+    parser.add_argument("--secret", default=SMARTTHINGS_WEBHOOK_SECRET)
+    parser.add_argument("--ping", action="store_true", help="Send a PING lifecycle instead of events")
+    args = parser.parse_args()
+
+    if not args.secret:
+        raise SystemExit("Set SMARTTHINGS_WEBHOOK_SECRET or pass --secret")
+    if args.ping:
+        payload = {"lifecycle": "PING", "pingData": {"challenge": str(uuid.uuid4())}}
+    else:
+        payload = _event_payload(args.device, args.changes)
+
+    body = json.dumps(payload).encode()
+    headers = sign_request("POST", urlparse(args.url).path, body, args.secret)
+    headers["Content-Type"] = "application/json"
+    start = time.perf_counter()
+    resp = requests.post(args.url, data=body, headers=headers, timeout=10)
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"{resp.status_code} in {elapsed:.1f} ms: {resp.text.strip()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Answer SSDP roku:ecp searches like a Roku would, for testing discovery.
+
+Multicast is often unavailable on test machines, so this listens on a plain
+UDP address; point the app at it with SSDP_ADDRESS.
+
+Usage:
+    python3 scripts/fake_ssdp_responder.py --listen 127.0.0.1:1901 --location http://127.0.0.1:8060/
+    SSDP_ADDRESS=127.0.0.1:1901 ./run.sh
+"""
+import argparse
+import socket
+import time
+
+RESPONSE = (
+    "HTTP/1.1 200 OK\r\n"
+    "Cache-Control: max-age=3600\r\n"
+    "ST: roku:ecp\r\n"
+    "USN: uuid:roku:ecp:{serial}\r\n"
+    "Ext: \r\n"
+    "Server: Roku/12.0.0 UPnP/1.0 Roku/12.0.0\r\n"
+    "LOCATION: {location}\r\n"
+    "\r\n"
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Roku SSDP responder")
+    parser.add_argument("--listen", default="127.0.0.1:1901", help="host:port to answer on")
+    parser.add_argument("--location", default="http://127.0.0.1:8060/", help="ECP base URL to advertise")
+    parser.add_argument("--serial", default="FAKE00000001")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering")
+    args = parser.parse_args()
+
+    host, _, port = args.listen.rpartition(":")
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind((host, int(port)))
+        print(f"Answering roku:ecp searches on {args.listen} with {args.location}", flush=True)
+        while True:
+            data, addr = sock.recvfrom(2048)
+            if b"M-SEARCH" not in data or b"roku:ecp" not in data:
+                continue
+            time.sleep(args.delay)
+            sock.sendto(RESPONSE.format(serial=args.serial, location=args.location).encode(), addr)
+
+
+if __name__ == "__main__":
+    main()
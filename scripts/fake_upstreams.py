@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""Local stand-ins for the Roku ECP and SmartThings APIs, for load testing.
+
+The fake Roku answers /launch/<id>, /keypress/<key>, /query/apps,
+/query/active-app, /query/media-player and /query/device-info; a launched app
+reports "play" after --ready seconds. The fake SmartThings API answers
+/oauth/token, /v1/devices/<id>/status and /v1/devices/<id>/commands and keeps
+mute/power state per device.
+
+Every response can be delayed (--latency plus up to +/- --jitter ms) and
+SmartThings calls can fail at random with 409, 503 or 401 (expired token).
+
+Usage:
+    python3 scripts/fake_upstreams.py --latency 80 --jitter 40 --error-503 0.05
+    ROKU_IP=127.0.0.1 ROKU_PORT=18060 SMARTTHINGS_API_URL=http://127.0.0.1:18443 ./run.sh
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+ACTIVE_APP = '<?xml version="1.0" encoding="UTF-8" ?>\n<active-app>\n\t<app id="{id}" type="appl" version="1.0.0">{name}</app>\n</active-app>\n'
+HOME_APP = '<?xml version="1.0" encoding="UTF-8" ?>\n<active-app>\n\t<app>Roku</app>\n</active-app>\n'
+MEDIA_PLAYER = '<?xml version="1.0" encoding="UTF-8" ?>\n<player error="false" state="{state}">\n\t<plugin bandwidth="0 bps" id="{id}" name="{name}"/>\n</player>\n'
+DEVICE_INFO = '<?xml version="1.0" encoding="UTF-8" ?>\n<device-info>\n\t<serial-number>{serial}</serial-number>\n\t<model-name>Fake Roku</model-name>\n</device-info>\n'
+APP_NAMES = {"65978": "CNN", "12": "Netflix", "13": "Prime Video", "837": "YouTube", "2285": "Hulu", "41468": "Tubi - Free Movies & TV"}
+
+
+class Faults:
+    """Latency, jitter and error injection shared by both fakes."""
+
+    def __init__(self, latency: float = 0, jitter: float = 0, error_409: float = 0,
+                 error_503: float = 0, error_401: float = 0, seed: int = None):
+        self.latency = latency / 1000
+        self.jitter = jitter / 1000
+        self.errors = [(409, error_409), (503, error_503), (401, error_401)]
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self) -> None:
+        with self._lock:
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def error(self):
+        """An HTTP status to fail with, or None."""
+        with self._lock:
+            roll = self._random.random()
+        for status, rate in self.errors:
+            if roll < rate:
+                return status
+            roll -= rate
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real upstreams
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: str = "", content_type: str = "text/xml") -> None:
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _count(self, key: str) -> None:
+        with self.server.lock:
+            self.server.calls[key] += 1
+
+
+# ---------- Fake Roku ----------
+
+class RokuHandler(_Handler):
+    def do_GET(self):
+        server = self.server
+        server.faults.delay()
+        if self.path == "/query/active-app":
+            self._count("active-app")
+            app_id = server.app_id
+            if app_id:
+                return self._reply(200, ACTIVE_APP.format(id=app_id, name=escape(APP_NAMES.get(app_id, app_id))))
+            return self._reply(200, HOME_APP)
+        if self.path == "/query/media-player":
+            self._count("media-player")
+            playing = server.app_id and time.monotonic() - server.launched_at >= server.ready
+            return self._reply(200, MEDIA_PLAYER.format(
+                state="play" if playing else "buffer", id=server.app_id or "", name=escape(APP_NAMES.get(server.app_id, ""))))
+        if self.path == "/query/apps":
+            self._count("apps")
+            apps = "".join(f'\t<app id="{app_id}" type="appl" version="1.0.0">{escape(name)}</app>\n'
+                           for app_id, name in APP_NAMES.items())
+            return self._reply(200, f'<?xml version="1.0" encoding="UTF-8" ?>\n<apps>\n{apps}</apps>\n')
+        if self.path == "/query/device-info":
+            self._count("device-info")
+            return self._reply(200, DEVICE_INFO.format(serial=server.serial))
+        self._reply(404)
+
+    def do_POST(self):
+        server = self.server
+        self._body()
+        server.faults.delay()
+        match = re.fullmatch(r"/launch/(\w+)", self.path.split("?")[0])
+        if match:
+            self._count("launch")
+            with server.lock:
+                if server.app_id != match.group(1):
+                    server.app_id = match.group(1)
+                    server.launched_at = time.monotonic()
+            return self._reply(200)
+        match = re.fullmatch(r"/keypress/(\S+)", self.path)
+        if match:
+            self._count("keypress")
+            with server.lock:
+                server.keys.append(match.group(1))
+                if match.group(1) == "Home":
+                    server.app_id = None
+            return self._reply(200)
+        self._reply(404)
+
+
+def roku_server(address: tuple, faults: Faults, ready: float = 2.0, serial: str = "FAKE00000001"):
+    server = ThreadingHTTPServer(address, RokuHandler)
+    server.daemon_threads = True
+    server.faults = faults
+    server.ready = ready
+    server.serial = serial
+    server.app_id = None
+    server.launched_at = 0.0
+    server.keys = []
+    server.lock = threading.Lock()
+    server.calls = Counter()
+    return server
+
+
+# ---------- Fake SmartThings ----------
+
+class SmartThingsHandler(_Handler):
+    def _json(self, status: int, payload: dict) -> None:
+        self._reply(status, json.dumps(payload), "application/json")
+
+    def _authorized(self) -> bool:
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        with self.server.lock:
+            return token in self.server.tokens
+
+    def _fault(self) -> bool:
+        """Inject a configured error; True if one was sent."""
+        status = self.server.faults.error()
+        if status is None:
+            return False
+        self._count(f"error-{status}")
+        if status == 401:
+            # Expire the caller's token so the app has to refresh it.
+            with self.server.lock:
+                self.server.tokens.discard(self.headers.get("Authorization", "").removeprefix("Bearer "))
+        self._json(status, {"error": {"code": str(status)}})
+        return True
+
+    def _device(self, device_id: str) -> dict:
+        with self.server.lock:
+            return self.server.devices.setdefault(device_id, {"switch": "on", "mute": "unmuted"})
+
+    def do_GET(self):
+        self.server.faults.delay()
+        match = re.fullmatch(r"/v1/devices/([\w-]+)/status", self.path)
+        if not match:
+            return self._json(404, {})
+        self._count("status")
+        if not self._authorized():
+            return self._json(401, {"error": {"code": "401"}})
+        if self._fault():
+            return
+        device = self._device(match.group(1))
+        self._json(200, {"components": {"main": {
+            "switch": {"switch": {"value": device["switch"]}},
+            "audioMute": {"mute": {"value": device["mute"]}},
+        }}})
+
+    def do_POST(self):
+        body = self._body()
+        self.server.faults.delay()
+        if self.path == "/oauth/token":
+            self._count("token")
+            token = uuid.uuid4().hex
+            with self.server.lock:
+                self.server.tokens.add(token)
+            return self._json(200, {"access_token": token, "refresh_token": uuid.uuid4().hex,
+                                    "expires_in": self.server.token_ttl})
+        match = re.fullmatch(r"/v1/devices/([\w-]+)/commands", self.path)
+        if not match:
+            return self._json(404, {})
+        self._count("commands")
+        if not self._authorized():
+            return self._json(401, {"error": {"code": "401"}})
+        if self._fault():
+            return
+        device = self._device(match.group(1))
+        for command in json.loads(body or b"{}").get("commands", []):
+            with self.server.lock:
+                if command.get("capability") == "audioMute":
+                    device["mute"] = "muted" if command.get("command") == "mute" else "unmuted"
+                elif command.get("capability") == "switch":
+                    device["switch"] = command.get("command")
+        self._json(200, {"results": [{"status": "ACCEPTED"}]})
+
+
+def smartthings_server(address: tuple, faults: Faults, token_ttl: int = 86400):
+    server = ThreadingHTTPServer(address, SmartThingsHandler)
+    server.daemon_threads = True
+    server.faults = faults
+    server.token_ttl = token_ttl
+    server.tokens = set()
+    server.devices = {}
+    server.lock = threading.Lock()
+    server.calls = Counter()
+    return server
+
+
+def serve(server) -> threading.Thread:
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return thread
+
+
+def add_fault_arguments(parser) -> None:
+    parser.add_argument("--latency", type=float, default=50, help="Mean upstream latency (ms)")
+    parser.add_argument("--jitter", type=float, default=20, help="Latency jitter, +/- ms")
+    parser.add_argument("--error-409", type=float, default=0.0, help="SmartThings 409 rate (0-1)")
+    parser.add_argument("--error-503", type=float, default=0.0, help="SmartThings 503 rate (0-1)")
+    parser.add_argument("--error-401", type=float, default=0.0, help="SmartThings 401 rate (0-1)")
+    parser.add_argument("--ready", type=float, default=2.0, help="Seconds from launch to playback")
+    parser.add_argument("--seed", type=int, help="Random seed for repeatable runs")
+
+
+def faults_from(args) -> tuple:
+    """(roku Faults, smartthings Faults); errors only apply to SmartThings."""
+    roku = Faults(args.latency, args.jitter, seed=args.seed)
+    smartthings = Faults(args.latency, args.jitter, args.error_409, args.error_503, args.error_401, seed=args.seed)
+    return roku, smartthings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Roku ECP and SmartThings servers")
+    parser.add_argument("--roku", default="127.0.0.1:18060", help="host:port for the fake Roku")
+    parser.add_argument("--smartthings", default="127.0.0.1:18443", help="host:port for the fake SmartThings API")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    roku_faults, smartthings_faults = faults_from(args)
+    host, _, port = args.roku.rpartition(":")
+    roku = roku_server((host, int(port)), roku_faults, ready=args.ready)
+    host, _, port = args.smartthings.rpartition(":")
+    smartthings = smartthings_server((host, int(port)), smartthings_faults)
+    serve(roku)
+    serve(smartthings)
+    print(f"Fake Roku on http://{args.roku}, fake SmartThings on http://{args.smartthings}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -6,144 +6,66 @@ Designed to run unattended via cron.
 
 Usage:
     python3 scripts/roku-cnn.py
+    python3 scripts/roku-cnn.py --macro cnn-live   # launch via a key macro (app/macros.py)
 
 Cron example (daily at 7 PM):
     00 19 * * * /path/to/venv/bin/python /path/to/roku-cnn.py >> /home/adam/roku-cnn.log 2>&1
+
+SCHEDULES (run by the web app or scripts/scheduler.py) does the same from a
+warm process, e.g. SCHEDULES="0 19 * * * start CNN".
 """
+import argparse
 import os
-import time
-import json
-import requests
+import sys
 from dotenv import load_dotenv
 
 # Load .env from the same directory as this script
 BASE_DIR = os.path.dirname(__file__)
 load_dotenv(os.path.join(BASE_DIR, ".env"))
-# Also try repo root .env (when running from the repo)
-load_dotenv(os.path.join(BASE_DIR, "..", ".env"))
-
-ROKU_IP = os.getenv("ROKU_IP", "192.168.50.129")
-CNN_APP_ID = "65978"  # from /query/apps
-
-SMARTTHINGS_TV_DEVICE_ID = os.getenv("SMARTTHINGS_TV_DEVICE_ID")
-SMARTTHINGS_CLIENT_ID = os.getenv("SMARTTHINGS_CLIENT_ID")
-SMARTTHINGS_CLIENT_SECRET = os.getenv("SMARTTHINGS_CLIENT_SECRET")
-
-TOKEN_FILE = os.path.expanduser("~/.smartthings_tokens.json")
-OAUTH_TOKEN_URL = "https://api.smartthings.com/oauth/token"
-API_BASE = "https://api.smartthings.com/v1"
-
-
-def log(msg):
-    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - {msg}", flush=True)
-
-
-# ---------- SmartThings token helpers ----------
-
-def _load_tokens():
-    if not os.path.exists(TOKEN_FILE):
-        raise RuntimeError(f"Token file not found: {TOKEN_FILE}")
-    with open(TOKEN_FILE) as f:
-        return json.load(f)
-
-
-def _save_tokens(tokens):
-    tmp = TOKEN_FILE + ".tmp"
-    with open(tmp, "w") as f:
-        json.dump(tokens, f)
-    os.replace(tmp, TOKEN_FILE)
-    try:
-        os.chmod(TOKEN_FILE, 0o600)
-    except Exception:
-        pass
-
-
-def _refresh_tokens(refresh_token):
-    log("Refreshing SmartThings token…")
-    resp = requests.post(
-        OAUTH_TOKEN_URL,
-        auth=(SMARTTHINGS_CLIENT_ID, SMARTTHINGS_CLIENT_SECRET),
-        data={"grant_type": "refresh_token", "refresh_token": refresh_token},
-        timeout=15,
-    )
-    if resp.status_code != 200:
-        raise RuntimeError(f"Token refresh failed: {resp.status_code} {resp.text}")
-    j = resp.json()
-    return {
-        "access_token": j["access_token"],
-        "refresh_token": j.get("refresh_token", refresh_token),
-        "expires_at": time.time() + int(j.get("expires_in", 3600)),
-    }
-
 
-def _get_access_token():
-    tokens = _load_tokens()
-    if tokens.get("expires_at", 0) <= time.time() + 60:
-        tokens = _refresh_tokens(tokens["refresh_token"])
-        _save_tokens(tokens)
-    return tokens["access_token"]
-
-
-def mute_tv_smartthings(max_retries=3, retry_delay=3):
-    token = _get_access_token()
-    url = f"{API_BASE}/devices/{SMARTTHINGS_TV_DEVICE_ID}/commands"
-    payload = {
-        "commands": [{
-            "component": "main",
-            "capability": "audioMute",
-            "command": "mute",
-        }]
-    }
-
-    for attempt in range(1, max_retries + 1):
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        }
-        resp = requests.post(url, json=payload, headers=headers, timeout=15)
-        log(f"SmartThings mute attempt {attempt}: {resp.status_code} {resp.text!r}")
-
-        if resp.ok:
-            return True
-
-        if resp.status_code == 401:
-            log("401 from SmartThings, refreshing token…")
-            tokens = _refresh_tokens(_load_tokens()["refresh_token"])
-            _save_tokens(tokens)
-            token = tokens["access_token"]
-            continue
-
-        if resp.status_code in (409, 503) and attempt < max_retries:
-            log(f"Device likely not ready (status {resp.status_code}). "
-                f"Waiting {retry_delay}s then retrying…")
-            time.sleep(retry_delay)
-            continue
-
-        break
-
-    return False
-
-
-# ---------- Roku helpers ----------
-
-def launch_cnn_app():
-    log("Launching CNN Roku app…")
-    try:
-        resp = requests.post(f"http://{ROKU_IP}:8060/launch/{CNN_APP_ID}", timeout=5)
-        log(f"Launch response: {resp.status_code}")
-        return resp.status_code in (200, 204)
-    except requests.RequestException as e:
-        log(f"Failed to launch CNN app: {e}")
-        return False
+# Device helpers live in the app package (which also loads the repo root .env)
+sys.path.insert(0, os.path.abspath(os.path.join(BASE_DIR, "..")))
+from app.config import CNN_APP_ID, log  # noqa: E402
+from app.devices import launch_roku_app, mute_tv_smartthings  # noqa: E402
+from app.discovery import registry as roku_registry  # noqa: E402
+from app.groups import group, run_macro, set_mute, start_app  # noqa: E402
+from app.macros import macros  # noqa: E402
+from app.readiness import wait_until_playing  # noqa: E402
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Launch CNN on the Roku and mute the TV")
+    parser.add_argument("--macro", help="Get to CNN with this Roku key macro instead of a plain launch")
+    args = parser.parse_args()
+    macro = None
+    if args.macro:
+        macro = macros.get(args.macro)
+        if macro is None:
+            sys.exit(f"Unknown macro {args.macro!r}; defined: {', '.join(sorted(macros))}")
+
     log("CNN auto-start script began.")
-    if not launch_cnn_app():
+    # Follow the Roku if DHCP moved it since the last run
+    roku_registry.ensure_reachable()
+    if len(group) > 1:
+        # TV_GROUP: launch and mute every TV concurrently
+        if macro is not None:
+            for name, result in run_macro(macro).items():
+                log(f"{name}: {result}")
+            log(f"Mute: {set_mute('mute')}")
+            return
+        for name, result in start_app(CNN_APP_ID, "CNN").items():
+            log(f"{name}: {result}")
+        return
+    if macro is not None:
+        result = macro.run()
+        log(f"Macro {macro.name} {'finished' if result['ok'] else 'failed'} in {result['total_ms']:.0f} ms.")
+        if not result["ok"]:
+            return
+    elif not launch_roku_app(CNN_APP_ID, "CNN"):
         return
 
-    # Give CNN app time to load
-    time.sleep(8)
+    # Mute as soon as CNN is playing (or after READY_TIMEOUT)
+    wait_until_playing(CNN_APP_ID)
 
     log("Muting TV via SmartThings…")
     if mute_tv_smartthings():
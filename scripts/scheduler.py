@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Run the TV schedules without the web server.
+
+Long-running replacement for the cron entry that calls roku-cnn.py: the
+process stays up between fires, so each one reuses open connections and an
+in-memory token (see app/scheduler.py). Schedules come from SCHEDULES in the
+repo root .env. Don't also run the web app with the same SCHEDULES; whichever
+starts second stands by until the first exits.
+
+Usage:
+    SCHEDULES="0 19 * * * start CNN" python3 scripts/scheduler.py
+    python3 scripts/scheduler.py --list   # show next fires and exit
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.config import log  # noqa: E402
+from app.scheduler import scheduler  # noqa: E402
+from app.tokens import manager as token_manager  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the SCHEDULES timed TV actions")
+    parser.add_argument("--list", action="store_true", help="Print the schedules and their next fire, then exit")
+    args = parser.parse_args()
+
+    if not scheduler.schedules:
+        sys.exit("No schedules configured; set SCHEDULES (see app/scheduler.py)")
+    if args.list:
+        now = datetime.now()
+        listing = {schedule.name: dict(schedule.to_dict(), next_at=str(schedule.cron.next_after(now)))
+                   for schedule in scheduler.schedules}
+        print(json.dumps(listing, indent=2))
+        return
+
+    log(f"Scheduler daemon started with {len(scheduler.schedules)} schedule(s).")
+    token_manager.start_renewal()
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
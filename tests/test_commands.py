@@ -0,0 +1,139 @@
+"""Coalescing rules and batch window of the SmartThings command queue (app/commands.py)."""
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from app import commands
+from app.commands import TOGGLE, DeviceQueue
+
+
+class Sent(list):
+    """Requests sent so far; ``flags[n]`` overrides the per-command results of request n (1-based)."""
+
+    def __init__(self):
+        super().__init__()
+        self.flags = {}
+
+
+def batch(*entries):
+    return [(capability, command, None, Future()) for capability, command in entries]
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    """Record every /commands request instead of sending it; each is a list of (capability, command)."""
+    requests = Sent()
+
+    def fake_send(entries, device_id=None):
+        requests.append([(entry["capability"], entry["command"]) for entry in entries])
+        return requests.flags.get(len(requests), [True] * len(entries))
+
+    monkeypatch.setattr(commands, "send_smartthings_commands", fake_send)
+    return requests
+
+
+def queue(mute_state="unmuted", window=0.05):
+    q = DeviceQueue("tv-1", window=window)
+    q._mute_state = lambda: mute_state
+    return q
+
+# ---------- _collapse ----------
+
+def test_toggles_share_one_slot():
+    slots = DeviceQueue._collapse(batch(("audioMute", TOGGLE), ("audioMute", TOGGLE), ("audioMute", TOGGLE)))
+    assert len(slots) == 1
+    assert slots[0]["command"] is None and slots[0]["flips"] == 3
+    assert len(slots[0]["futures"]) == 3
+
+def test_later_set_replaces_earlier_one():
+    slots = DeviceQueue._collapse(batch(("audioMute", "mute"), ("audioMute", "unmute")))
+    assert [(s["command"], s["flips"]) for s in slots] == [("unmute", 0)]
+
+def test_set_discards_earlier_toggles():
+    slots = DeviceQueue._collapse(batch(("audioMute", TOGGLE), ("audioMute", "mute")))
+    assert [(s["command"], s["flips"]) for s in slots] == [("mute", 0)]
+
+def test_toggles_after_a_set_flip_it():
+    slots = DeviceQueue._collapse(batch(("audioMute", "mute"), ("audioMute", TOGGLE)))
+    assert [(s["command"], s["flips"]) for s in slots] == [("mute", 1)]
+
+def test_capabilities_get_their_own_slots_in_order():
+    slots = DeviceQueue._collapse(batch(
+        ("switch", "on"), ("audioMute", "mute"), ("refresh", "refresh"), ("refresh", "refresh"), ("switch", "off")))
+    assert [(s["capability"], s["command"]) for s in slots] == [
+        ("switch", "off"), ("audioMute", "mute"), ("refresh", "refresh")]
+    assert [len(s["futures"]) for s in slots] == [2, 1, 2]
+
+def test_other_commands_are_kept_as_submitted():
+    slots = DeviceQueue._collapse(batch(("mediaInputSource", "setInputSource"), ("mediaInputSource", "setInputSource")))
+    assert len(slots) == 2
+
+# ---------- Batching ----------
+
+def submit_all(q, *entries):
+    futures = [q.submit(capability, command) for capability, command in entries]
+    return [future.result(timeout=2) for future in futures]
+
+def test_even_toggles_cancel_out(sent):
+    results = submit_all(queue(), ("audioMute", TOGGLE), ("audioMute", TOGGLE))
+    assert sent == []
+    assert results == [{"ok": True, "command": None, "coalesced": 2}] * 2
+
+def test_odd_toggles_send_one_command_to_every_waiter(sent):
+    results = submit_all(queue("unmuted"), ("audioMute", TOGGLE), ("audioMute", TOGGLE), ("audioMute", TOGGLE))
+    assert sent == [[("audioMute", "mute")]]
+    assert results == [{"ok": True, "command": "mute", "coalesced": 3}] * 3
+
+def test_toggle_of_a_muted_tv_unmutes(sent):
+    submit_all(queue("muted"), ("audioMute", TOGGLE))
+    assert sent == [[("audioMute", "unmute")]]
+
+def test_set_then_toggle_sends_the_opposite(sent):
+    results = submit_all(queue(), ("audioMute", "mute"), ("audioMute", TOGGLE))
+    assert sent == [[("audioMute", "unmute")]]
+    assert [r["command"] for r in results] == ["unmute", "unmute"]
+
+def test_each_waiter_gets_its_own_commands_result(sent):
+    sent.flags[1] = [True, False]
+    mute, power = submit_all(queue(), ("audioMute", "mute"), ("switch", "off"))
+    assert sent == [[("audioMute", "mute"), ("switch", "off")]]
+    assert (mute["ok"], mute["command"]) == (True, "mute")
+    assert (power["ok"], power["command"]) == (False, "off")
+
+def test_commands_after_the_window_go_in_a_new_batch(sent):
+    q = queue(window=0.05)
+    first = q.submit("audioMute", "mute")
+    first.result(timeout=2)
+    second = q.submit("audioMute", "unmute")
+    second.result(timeout=2)
+    assert sent == [[("audioMute", "mute")], [("audioMute", "unmute")]]
+
+def test_taps_during_a_send_wait_for_the_next_batch(sent, monkeypatch):
+    sending = threading.Event()
+    release = threading.Event()
+
+    def slow_send(entries, device_id=None):
+        sent.append([(entry["capability"], entry["command"]) for entry in entries])
+        sending.set()
+        release.wait(2)
+        return [True] * len(entries)
+
+    monkeypatch.setattr(commands, "send_smartthings_commands", slow_send)
+    q = queue(window=0.01)
+    first = q.submit("audioMute", "mute")
+    assert sending.wait(2)
+    later = [q.submit("audioMute", TOGGLE), q.submit("audioMute", "unmute")]
+    release.set()
+    assert first.result(timeout=2)["command"] == "mute"
+    assert [f.result(timeout=2)["command"] for f in later] == ["unmute", "unmute"]
+    assert sent == [[("audioMute", "mute")], [("audioMute", "unmute")]]
+
+def test_a_failed_batch_fails_every_waiter(monkeypatch):
+    def broken(entries, device_id=None):
+        raise RuntimeError("no route to host")
+
+    monkeypatch.setattr(commands, "send_smartthings_commands", broken)
+    results = submit_all(queue(), ("audioMute", "mute"), ("switch", "on"))
+    assert [r["ok"] for r in results] == [False, False]
+    assert all("no route to host" in r["error"] for r in results)
@@ -0,0 +1,59 @@
+"""SSDP discovery round trips against scripts/fake_ssdp_responder.py."""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from app import discovery
+from app.discovery import RokuRegistry
+
+SERIAL = "TESTSERIAL01"
+LOCATION = "http://127.0.0.1:8061/"
+
+_script = os.path.join(os.path.dirname(__file__), "..", "scripts", "fake_ssdp_responder.py")
+
+
+def free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def responder(monkeypatch):
+    """A fake Roku answering searches on a local UDP port that discovery is pointed at."""
+    address = f"127.0.0.1:{free_udp_port()}"
+    process = subprocess.Popen(
+        [sys.executable, _script, "--listen", address, "--location", LOCATION, "--serial", SERIAL, "--delay", "0.1"],
+        stdout=subprocess.PIPE, text=True)
+    try:
+        assert process.stdout.readline().startswith("Answering")
+        monkeypatch.setattr(discovery, "SSDP_ADDRESS", address)
+        yield address
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_discover_finds_the_responder(responder):
+    devices = discovery.discover(timeout=0.5)
+    assert [(d["serial"], d["host"], d["port"]) for d in devices] == [(SERIAL, "127.0.0.1", 8061)]
+
+def test_discover_returns_once_the_wanted_serial_answers(responder):
+    started = time.monotonic()
+    devices = discovery.discover(timeout=5, want=SERIAL)
+    assert [d["serial"] for d in devices] == [SERIAL]
+    assert time.monotonic() - started < 2
+
+def test_registry_locates_an_unknown_serial(responder, tmp_path):
+    registry = RokuRegistry(path=str(tmp_path / "registry.json"))
+    assert registry.locate(SERIAL) == "http://127.0.0.1:8061"
+    assert SERIAL in RokuRegistry(path=str(tmp_path / "registry.json")).devices()
+
+def test_registry_reports_a_serial_nobody_answers_for(responder, tmp_path):
+    registry = RokuRegistry(path=str(tmp_path / "registry.json"))
+    with pytest.raises(LookupError):
+        registry.locate("NOTONNETWORK1")
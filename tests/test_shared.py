@@ -0,0 +1,61 @@
+"""Calls from a follower to the leader through the shared store (app/shared.py)."""
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from app.shared import Cluster
+
+
+@pytest.fixture
+def store(tmp_path):
+    return str(tmp_path / "shared.db")
+
+
+def keys(cluster):
+    rows, _ = cluster._execute("SELECT key FROM shared ORDER BY key")
+    return [key for key, in rows]
+
+
+def test_timed_out_call_fails_and_leaves_no_rows(store):
+    follower = Cluster(path=store, workers=2)
+    future = follower.call("command", {"capability": "audioMute"}, timeout=0.1)
+    assert [key.partition(":")[0] for key in keys(follower)] == ["call"]
+    assert future.result(timeout=2) == {"ok": False, "error": "no answer from the leader"}
+    assert keys(follower) == []
+
+def test_leader_drops_a_call_past_its_deadline(store):
+    leader = Cluster(path=store, workers=2)
+    ran = []
+    leader.serve("command", lambda payload: ran.append(payload) or Future())
+    leader.put("call:1", {"kind": "command", "payload": {}, "deadline": time.time() - 1, "updated_at": time.time()})
+    leader._handle_call("1", leader.get("call:1"))
+    assert ran == []
+    assert keys(leader) == []
+
+def test_leader_answers_a_call_in_time(store):
+    leader = Cluster(path=store, workers=2)
+    answer = Future()
+    leader.serve("command", lambda payload: answer)
+    leader._handle_call("1", {"kind": "command", "payload": {}, "deadline": time.time() + 5})
+    answer.set_result({"ok": True})
+    assert leader.get("result:1")["result"] == {"ok": True}
+
+def test_leader_does_not_answer_after_the_deadline(store):
+    leader = Cluster(path=store, workers=2)
+    answer = Future()
+    leader.serve("command", lambda payload: answer)
+    leader._handle_call("1", {"kind": "command", "payload": {}, "deadline": time.time() + 0.05})
+    time.sleep(0.1)
+    answer.set_result({"ok": True})
+    assert keys(leader) == []
+
+def test_sweep_drops_expired_calls_and_results_only(store):
+    leader = Cluster(path=store, workers=2)
+    now = time.time()
+    leader.put("result:old", {"result": {}, "deadline": now - 1, "updated_at": now})
+    leader.put("call:old", {"kind": "command", "payload": {}, "deadline": now - 1, "updated_at": now})
+    leader.put("result:new", {"result": {}, "deadline": now + 60, "updated_at": now})
+    leader.put("snapshot", {"version": 1, "updated_at": now})
+    leader._sweep()
+    assert keys(leader) == ["result:new", "snapshot"]
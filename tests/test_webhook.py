@@ -0,0 +1,82 @@
+"""SmartThings webhook route, driven by the signed requests of scripts/fake_smartthings_events.py."""
+import importlib.util
+import json
+import os
+import time
+
+import pytest
+from flask import Flask
+
+from app import webhook
+from app.config import CNN_APP_ID
+from app.groups import group, primary
+from app.routes import register_routes
+from app.status import status_service
+
+SECRET = "test-secret"
+PATH = "/smartthings/webhook"
+
+_script = os.path.join(os.path.dirname(__file__), "..", "scripts", "fake_smartthings_events.py")
+_spec = importlib.util.spec_from_file_location("fake_smartthings_events", _script)
+fake_events = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(fake_events)
+
+
+@pytest.fixture(scope="module")
+def app():
+    """The routes alone, without the upstream workers create_app() starts."""
+    app = Flask("app")
+    register_routes(app)
+    return app
+
+
+@pytest.fixture
+def client(app, monkeypatch, tmp_path):
+    """A test client with a known TV state."""
+    monkeypatch.setattr(webhook, "SMARTTHINGS_WEBHOOK_SECRET", SECRET)
+    monkeypatch.setattr(primary, "device_id", "tv-1")
+    monkeypatch.setattr(status_service, "path", str(tmp_path / "status.json"))
+    members = {tv.name: {"tv_status": "unmuted", "active_app": {"id": CNN_APP_ID}} for tv in group}
+    monkeypatch.setattr(status_service, "_snapshot",
+                        dict(members[primary.name], members=members, updated_at=time.time(), version=0))
+    return app.test_client()
+
+
+def post(client, body: bytes, secret: str = SECRET):
+    headers = webhook.sign_request("POST", PATH, body, secret)
+    headers["Content-Type"] = "application/json"
+    return client.post(PATH, data=body, headers=headers)
+
+
+def test_signed_event_updates_the_snapshot(client):
+    body = json.dumps(fake_events._event_payload("tv-1", ["mute=muted"])).encode()
+    resp = post(client, body)
+    assert resp.status_code == 200
+    assert resp.get_json() == {"eventData": {}}
+    assert status_service.snapshot()["members"][primary.name]["tv_status"] == "muted"
+
+def test_ping_echoes_the_challenge(client):
+    resp = post(client, json.dumps({"lifecycle": "PING", "pingData": {"challenge": "abc"}}).encode())
+    assert resp.get_json() == {"pingData": {"challenge": "abc"}}
+
+def test_bad_signature_is_rejected(client):
+    body = json.dumps(fake_events._event_payload("tv-1", ["mute=muted"])).encode()
+    resp = post(client, body, secret="wrong-secret")
+    assert resp.status_code == 401
+    assert status_service.snapshot()["members"][primary.name]["tv_status"] == "unmuted"
+
+def test_unsigned_request_is_rejected(client):
+    resp = client.post(PATH, data=b"{}", headers={"Content-Type": "application/json"})
+    assert resp.status_code == 401
+
+@pytest.mark.parametrize("body", [
+    b"{not json",
+    b"\xff\xfe",
+    b"[1, 2]",
+    b'{"lifecycle": "PING"}',
+    b'{"lifecycle": "EVENT", "eventData": []}',
+    b'{"lifecycle": "EVENT", "eventData": {"events": ["switch"]}}',
+    b'{"lifecycle": "INSTALL", "installData": {"authToken": "t", "installedApp": {"config": {"tv": "x"}}}}',
+])
+def test_malformed_body_is_a_bad_request(client, body):
+    assert post(client, body).status_code == 400